@@ -0,0 +1,76 @@
+"""Delete finished jobs and the files they left behind.
+
+Finished and failed jobs are kept for a while so their owners can poll
+them and download what they wrote, then deleted along with their files.
+Export files are also swept on their own, so one whose job row is gone,
+for instance after a crash, does not stay in ``MEDIA_ROOT`` for good.
+"""
+
+import json
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.utils import timezone
+
+from jobs.models import Job
+
+
+FILE_DIRECTORIES = ('exports',)
+DEFAULT_BATCH_SIZE = 1000
+
+
+def retention_days():
+    """Days a finished job and its files are kept."""
+    return getattr(settings, 'JOB_RETENTION_DAYS', 7)
+
+
+def result_file(result):
+    """Name of the file a job's stored result points at, or None."""
+    try:
+        result = json.loads(result or 'null')
+    except ValueError:
+        return None
+    return result.get('file') if isinstance(result, dict) else None
+
+
+def delete_file(name):
+    """Delete a stored file if it is still there."""
+    if name and default_storage.exists(name):
+        default_storage.delete(name)
+
+
+def purge_jobs(days=None, batch_size=DEFAULT_BATCH_SIZE, now=None):
+    """Delete jobs finished ``days`` ago or earlier and their files."""
+    now = now or timezone.now()
+    days = retention_days() if days is None else days
+    old = Job.objects.filter(status__in=(Job.DONE, Job.FAILED),
+                             finished__lt=now - timedelta(days=days))
+    purged = 0
+    while True:
+        rows = list(old.order_by('id').values_list('id', 'result')[
+            :batch_size])
+        if not rows:
+            return purged
+        for job_id, result in rows:
+            delete_file(result_file(result))
+        Job.objects.filter(pk__in=[job_id for job_id, result in rows]
+                           ).delete()
+        purged += len(rows)
+
+
+def purge_files(days=None, directories=FILE_DIRECTORIES, now=None):
+    """Delete files in ``directories`` last changed ``days`` ago or earlier."""
+    now = now or timezone.now()
+    days = retention_days() if days is None else days
+    cutoff = now - timedelta(days=days)
+    purged = 0
+    for directory in directories:
+        if not default_storage.exists(directory):
+            continue
+        for filename in default_storage.listdir(directory)[1]:
+            name = '{}/{}'.format(directory, filename)
+            if default_storage.get_modified_time(name) < cutoff:
+                default_storage.delete(name)
+                purged += 1
+    return purged
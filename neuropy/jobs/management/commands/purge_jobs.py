@@ -0,0 +1,29 @@
+"""Delete old finished jobs and their files."""
+
+from django.core.management.base import BaseCommand
+
+from jobs.cleanup import DEFAULT_BATCH_SIZE, purge_files, purge_jobs
+
+
+class Command(BaseCommand):
+    """Delete finished jobs and stale export files."""
+
+    help = ('Delete jobs that finished more than --days days ago, the files '
+            'they wrote, and export files older than that.')
+
+    def add_arguments(self, parser):
+        """Command line options."""
+        parser.add_argument(
+            '--days', type=int, default=None,
+            help='Delete jobs finished this many days ago or earlier; '
+                 'JOB_RETENTION_DAYS by default.')
+        parser.add_argument(
+            '--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+            help='Jobs deleted per statement.')
+
+    def handle(self, *args, **options):
+        """Purge and report how many jobs and files were deleted."""
+        jobs = purge_jobs(options['days'], max(options['batch_size'], 1))
+        files = purge_files(options['days'])
+        self.stdout.write(self.style.SUCCESS(
+            'Deleted {} jobs and {} stale files.'.format(jobs, files)))
@@ -0,0 +1,56 @@
+"""Run background jobs from the database queue."""
+
+import multiprocessing
+
+import django
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from jobs.queue import work, worker_name
+
+
+def run_worker(burst, poll_interval):
+    """Work through jobs in a worker process."""
+    django.setup()
+    work(worker_name(), burst, poll_interval)
+
+
+class Command(BaseCommand):
+    """Claim and run queued jobs until stopped."""
+
+    help = 'Run queued background jobs, such as plan generation and imports.'
+
+    def add_arguments(self, parser):
+        """Command line options."""
+        parser.add_argument(
+            '--concurrency', type=int, default=1,
+            help='Worker processes to run; 1 works in this process.')
+        parser.add_argument(
+            '--burst', action='store_true',
+            help='Stop once no job is due instead of waiting for more.')
+        parser.add_argument(
+            '--poll-interval', type=float, default=1.0,
+            help='Seconds to wait before looking for jobs again.')
+
+    def handle(self, *args, **options):
+        """Work in this process or in a set of worker processes."""
+        burst, poll_interval = options['burst'], options['poll_interval']
+        if options['concurrency'] <= 1:
+            done = work(worker_name(), burst, poll_interval)
+            self.stdout.write(self.style.SUCCESS(
+                'Ran {} jobs.'.format(done)))
+            return
+        connections.close_all()
+        workers = [multiprocessing.Process(target=run_worker,
+                                           args=(burst, poll_interval))
+                   for i in range(options['concurrency'])]
+        for worker in workers:
+            worker.start()
+        try:
+            for worker in workers:
+                worker.join()
+        except KeyboardInterrupt:
+            for worker in workers:
+                worker.terminate()
+                worker.join()
+        self.stdout.write(self.style.SUCCESS('Workers stopped.'))
@@ -0,0 +1,51 @@
+"""Model for background jobs."""
+
+from django.db import models
+from django.utils import timezone
+from django.utils.encoding import python_2_unicode_compatible
+from userprofile.models import Profile
+
+
+@python_2_unicode_compatible
+class Job(models.Model):
+    """A unit of work for a background worker."""
+
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = (
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    )
+
+    name = models.CharField(max_length=100)
+    payload = models.TextField(default='{}')
+    owner = models.ForeignKey(Profile,
+                              related_name='jobs',
+                              blank=True,
+                              null=True,
+                              on_delete=models.CASCADE
+                              )
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES,
+                              default=QUEUED)
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=3)
+    run_after = models.DateTimeField(default=timezone.now)
+    locked_by = models.CharField(max_length=100, blank=True)
+    locked_at = models.DateTimeField(blank=True, null=True)
+    result = models.TextField(blank=True)
+    error = models.TextField(blank=True)
+    created = models.DateTimeField(default=timezone.now)
+    finished = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        """Index for workers looking for the next job due."""
+
+        index_together = [('status', 'run_after')]
+
+    def __str__(self):
+        """String representation of Job."""
+        return '{} {} ({})'.format(self.name, self.pk, self.status)
@@ -0,0 +1,241 @@
+"""A job queue kept in the database, so no broker is needed.
+
+Workers claim the next due job by marking it running. On PostgreSQL the
+claim is a single ``UPDATE`` whose subquery takes the row with
+``FOR UPDATE SKIP LOCKED``, so concurrent workers never wait on each other.
+Other databases claim optimistically with a conditional ``UPDATE`` of a
+queued row and move on to the next candidate if another worker won.
+
+While a job runs, a heartbeat thread renews its lease, so only a job
+whose worker died is claimed again once the lease runs out. Failed jobs
+are retried with exponential backoff until they run out of attempts, and
+a task may register a handler to clean up after a job that failed for
+good.
+"""
+
+import json
+import os
+import socket
+import threading
+import time
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections, router, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from jobs.models import Job
+
+
+SKIP_LOCKED_VENDORS = ('postgresql',)
+CLAIM_CANDIDATES = 5
+BACKOFF_SECONDS = 10
+MAX_BACKOFF_SECONDS = 60 * 60
+
+TASKS = {}
+FAILURE_HANDLERS = {}
+
+
+class JobFailed(Exception):
+    """Raised by a task to fail its job without retrying."""
+
+
+def task(name, on_failure=None):
+    """
+    Register a function as the task run for jobs called ``name``.
+
+    ``on_failure`` is called with the job's payload once a job has failed
+    for good, whether the task gave up or it ran out of attempts.
+    """
+    def register(function):
+        TASKS[name] = function
+        if on_failure is not None:
+            FAILURE_HANDLERS[name] = on_failure
+        return function
+    return register
+
+
+def enqueue(name, owner=None, max_attempts=3, delay=0, **payload):
+    """Queue a job running task ``name`` with ``payload`` as arguments."""
+    if name not in TASKS:
+        raise LookupError('No task named {!r}.'.format(name))
+    return Job.objects.create(
+        name=name, owner=owner, max_attempts=max_attempts,
+        payload=json.dumps(payload, cls=DjangoJSONEncoder),
+        run_after=timezone.now() + timedelta(seconds=delay))
+
+
+def lease_seconds():
+    """Seconds after which a running job is considered abandoned."""
+    return getattr(settings, 'JOB_LEASE_SECONDS', 10 * 60)
+
+
+def backoff(attempts):
+    """Seconds to wait before retrying a job that failed ``attempts`` times."""
+    return min(BACKOFF_SECONDS * 2 ** max(attempts - 1, 0),
+               MAX_BACKOFF_SECONDS)
+
+
+def worker_name():
+    """Name identifying this worker process."""
+    return '{}:{}'.format(socket.gethostname(), os.getpid())
+
+
+def claimable(now):
+    """Filter for jobs that are due or were abandoned by their worker."""
+    stale = now - timedelta(seconds=lease_seconds())
+    return (Q(status=Job.QUEUED, run_after__lte=now) |
+            Q(status=Job.RUNNING, locked_at__lt=stale))
+
+
+def claim_skip_locked(connection, worker, now):
+    """Claim the next job in one statement, skipping rows being claimed."""
+    table = connection.ops.quote_name(Job._meta.db_table)
+    sql = (
+        'UPDATE {table} SET status = %s, locked_by = %s, locked_at = %s, '
+        'attempts = attempts + 1 WHERE id = ('
+        'SELECT id FROM {table} WHERE (status = %s AND run_after <= %s) '
+        'OR (status = %s AND locked_at < %s) '
+        'ORDER BY run_after, id LIMIT 1 FOR UPDATE SKIP LOCKED) '
+        'RETURNING id').format(table=table)
+    stale = now - timedelta(seconds=lease_seconds())
+    with transaction.atomic(using=connection.alias):
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [Job.RUNNING, worker, now, Job.QUEUED, now,
+                                 Job.RUNNING, stale])
+            row = cursor.fetchone()
+    return row[0] if row else None
+
+
+def claim_optimistic(connection, worker, now):
+    """Claim the next job with a conditional update of a candidate."""
+    jobs = Job.objects.using(connection.alias)
+    candidates = jobs.filter(claimable(now)).order_by(
+        'run_after', 'id').values_list('id', flat=True)
+    for job_id in list(candidates[:CLAIM_CANDIDATES]):
+        claimed = jobs.filter(claimable(now), pk=job_id).update(
+            status=Job.RUNNING, locked_by=worker, locked_at=now,
+            attempts=F('attempts') + 1)
+        if claimed:
+            return job_id
+    return None
+
+
+def claim(worker, now=None):
+    """Mark the next due job as running for ``worker`` and return it."""
+    now = now or timezone.now()
+    connection = connections[router.db_for_write(Job)]
+    if connection.vendor in SKIP_LOCKED_VENDORS:
+        job_id = claim_skip_locked(connection, worker, now)
+    else:
+        job_id = claim_optimistic(connection, worker, now)
+    if job_id is None:
+        return None
+    return Job.objects.using(connection.alias).get(pk=job_id)
+
+
+def finish(job, **values):
+    """Store the outcome of a job unless another worker took it over."""
+    values['locked_at'] = None
+    return Job.objects.filter(pk=job.pk, status=Job.RUNNING,
+                              locked_by=job.locked_by).update(**values)
+
+
+def fail(job, error):
+    """Fail a job for good and let its task clean up after it."""
+    finished = finish(job, status=Job.FAILED, finished=timezone.now(),
+                      error=error)
+    handler = FAILURE_HANDLERS.get(job.name)
+    if finished and handler is not None:
+        handler(**json.loads(job.payload))
+    return finished
+
+
+def renew(job):
+    """Extend the lease of a job that is still running."""
+    return Job.objects.filter(pk=job.pk, status=Job.RUNNING,
+                              locked_by=job.locked_by).update(
+                                  locked_at=timezone.now())
+
+
+class Heartbeat(threading.Thread):
+    """Renew a running job's lease at regular intervals."""
+
+    def __init__(self, job, interval):
+        """Renew ``job`` every ``interval`` seconds once started."""
+        super(Heartbeat, self).__init__()
+        self.daemon = True
+        self.job = job
+        self.interval = interval
+        self.stopping = threading.Event()
+
+    def run(self):
+        """Renew the lease until stopped."""
+        try:
+            while not self.stopping.wait(self.interval):
+                renew(self.job)
+        finally:
+            connections.close_all()
+
+    def stop(self):
+        """Stop renewing and wait for the thread to end."""
+        self.stopping.set()
+        self.join()
+
+
+def run(job):
+    """Run a claimed job, storing its result or scheduling a retry."""
+    function = TASKS.get(job.name)
+    if function is None:
+        return fail(job, 'No task named {!r}.'.format(job.name))
+    if job.attempts > job.max_attempts:
+        return fail(job, job.error or 'Ran out of attempts.')
+    heartbeat = Heartbeat(job, lease_seconds() / 3.0)
+    heartbeat.start()
+    try:
+        result = function(**json.loads(job.payload))
+    except JobFailed as error:
+        return fail(job, str(error))
+    except Exception:
+        error = traceback.format_exc()
+        if job.attempts >= job.max_attempts:
+            return fail(job, error)
+        return finish(job, status=Job.QUEUED, error=error,
+                      run_after=timezone.now() + timedelta(
+                          seconds=backoff(job.attempts)))
+    finally:
+        heartbeat.stop()
+    return finish(job, status=Job.DONE, finished=timezone.now(), error='',
+                  result=json.dumps(result, cls=DjangoJSONEncoder))
+
+
+def refresh_connections():
+    """Drop broken or expired connections between jobs, as requests do."""
+    for connection in connections.all():
+        if not connection.in_atomic_block:
+            connection.close_if_unusable_or_obsolete()
+
+
+def work(worker=None, burst=False, poll_interval=1.0, max_jobs=None):
+    """
+    Claim and run jobs until stopped, returning how many were run.
+
+    With ``burst`` the worker returns once no job is due instead of
+    polling for more.
+    """
+    worker = worker or worker_name()
+    done = 0
+    while max_jobs is None or done < max_jobs:
+        refresh_connections()
+        job = claim(worker)
+        if job is None:
+            if burst:
+                break
+            time.sleep(poll_interval)
+            continue
+        run(job)
+        done += 1
+    return done
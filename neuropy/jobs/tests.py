@@ -0,0 +1,232 @@
+"""Tests for the jobs app."""
+
+from datetime import timedelta
+import os
+import shutil
+import tempfile
+from django.contrib.auth.models import Group, User
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.six import StringIO
+from jobs import cleanup, queue
+from jobs.models import Job
+
+
+calls = []
+
+
+@queue.task('tests.record')
+def record(value):
+    """Remember a value and hand it back."""
+    calls.append(value)
+    return {'value': value}
+
+
+@queue.task('tests.flaky')
+def flaky():
+    """Always fail in a way worth retrying."""
+    raise RuntimeError('Try again later.')
+
+
+def forget(value=None):
+    """Record that a job failed for good."""
+    calls.append(('failed', value))
+
+
+@queue.task('tests.broken', on_failure=forget)
+def broken():
+    """Fail in a way retrying cannot fix."""
+    raise queue.JobFailed('Bad input.')
+
+
+@queue.task('tests.doomed', on_failure=forget)
+def doomed(value):
+    """Fail in a way worth retrying, with a failure handler."""
+    raise RuntimeError('Try again later.')
+
+
+class QueueTestCase(TestCase):
+    """Test claiming, running and retrying jobs."""
+
+    def setUp(self):
+        """Forget earlier calls."""
+        del calls[:]
+
+    def test_job_runs_and_stores_result(self):
+        """Test a queued job is run once and its result kept."""
+        job = queue.enqueue('tests.record', value=3)
+        self.assertTrue(queue.work(burst=True) == 1)
+        job.refresh_from_db()
+        self.assertTrue(calls == [3])
+        self.assertTrue(job.status == Job.DONE)
+        self.assertTrue(job.result == '{"value": 3}')
+        self.assertTrue(job.attempts == 1)
+
+    def test_unknown_task_cannot_be_queued(self):
+        """Test enqueueing a task nobody registered fails early."""
+        with self.assertRaises(LookupError):
+            queue.enqueue('tests.missing')
+
+    def test_jobs_are_claimed_once_in_order(self):
+        """Test each claim takes a different due job, oldest first."""
+        first = queue.enqueue('tests.record', value=1)
+        second = queue.enqueue('tests.record', value=2)
+        queue.enqueue('tests.record', value=3, delay=60)
+        self.assertTrue(queue.claim('a').pk == first.pk)
+        self.assertTrue(queue.claim('b').pk == second.pk)
+        self.assertTrue(queue.claim('c') is None)
+
+    def test_failure_is_retried_with_backoff(self):
+        """Test a failed job is queued again later until out of attempts."""
+        job = queue.enqueue('tests.flaky', max_attempts=2)
+        queue.work(burst=True)
+        job.refresh_from_db()
+        self.assertTrue(job.status == Job.QUEUED)
+        self.assertTrue(job.run_after > timezone.now() + timedelta(seconds=5))
+        self.assertTrue('RuntimeError' in job.error)
+        Job.objects.filter(pk=job.pk).update(run_after=timezone.now())
+        queue.work(burst=True)
+        job.refresh_from_db()
+        self.assertTrue(job.status == Job.FAILED)
+        self.assertTrue(job.attempts == 2)
+
+    def test_backoff_doubles_up_to_a_limit(self):
+        """Test retry delays grow exponentially and are capped."""
+        self.assertTrue([queue.backoff(n) for n in (1, 2, 3)] == [10, 20, 40])
+        self.assertTrue(queue.backoff(30) == queue.MAX_BACKOFF_SECONDS)
+
+    def test_job_failed_is_not_retried(self):
+        """Test a task can fail its job for good."""
+        job = queue.enqueue('tests.broken')
+        queue.work(burst=True)
+        job.refresh_from_db()
+        self.assertTrue(job.status == Job.FAILED)
+        self.assertTrue(job.error == 'Bad input.')
+
+    def test_failure_handler_runs_once_failed_for_good(self):
+        """Test a task cleans up only after its last attempt fails."""
+        job = queue.enqueue('tests.doomed', max_attempts=2, value=4)
+        queue.work(burst=True)
+        self.assertTrue(calls == [])
+        Job.objects.filter(pk=job.pk).update(run_after=timezone.now())
+        queue.work(burst=True)
+        self.assertTrue(calls == [('failed', 4)])
+        queue.enqueue('tests.broken')
+        queue.work(burst=True)
+        self.assertTrue(calls[-1] == ('failed', None))
+
+    def test_renewed_lease_is_not_claimed_again(self):
+        """Test a job whose worker renews its lease stays with it."""
+        job = queue.enqueue('tests.record', value=5)
+        claimed = queue.claim('busy')
+        Job.objects.filter(pk=job.pk).update(
+            locked_at=timezone.now() - timedelta(
+                seconds=queue.lease_seconds() + 1))
+        self.assertTrue(queue.renew(claimed) == 1)
+        self.assertTrue(queue.claim('next') is None)
+
+    def test_abandoned_job_is_claimed_again(self):
+        """Test a job left running past its lease goes to a new worker."""
+        job = queue.enqueue('tests.record', value=5)
+        queue.claim('gone')
+        self.assertTrue(queue.claim('next') is None)
+        Job.objects.filter(pk=job.pk).update(
+            locked_at=timezone.now() - timedelta(
+                seconds=queue.lease_seconds() + 1))
+        self.assertTrue(queue.claim('next').locked_by == 'next')
+
+    def test_run_jobs_command(self):
+        """Test the worker command runs due jobs and stops in burst mode."""
+        queue.enqueue('tests.record', value=1)
+        queue.enqueue('tests.record', value=2)
+        out = StringIO()
+        call_command('run_jobs', burst=True, stdout=out)
+        self.assertTrue(calls == [1, 2])
+        self.assertTrue('Ran 2 jobs' in out.getvalue())
+
+
+class JobStatusTestCase(TestCase):
+    """Test polling a job's status."""
+
+    def setUp(self):
+        """Make a logged in user with a job."""
+        Group.objects.create(name='user')
+        self.user = User.objects.create(username='alice')
+        self.job = queue.enqueue('tests.record', owner=self.user.profile,
+                                 value=1)
+        self.client.force_login(self.user)
+
+    def test_owner_sees_status_and_result(self):
+        """Test the status endpoint reports progress and the result."""
+        url = reverse('job-status', args=[self.job.pk])
+        self.assertTrue(self.client.get(url).json()['status'] == 'queued')
+        queue.work(burst=True)
+        status = self.client.get(url).json()
+        self.assertTrue(status['status'] == 'done')
+        self.assertTrue(status['result'] == {'value': 1})
+
+    def test_other_users_jobs_are_hidden(self):
+        """Test a user cannot poll someone else's job."""
+        other = queue.enqueue('tests.record', value=2)
+        response = self.client.get(reverse('job-status', args=[other.pk]))
+        self.assertTrue(response.status_code == 404)
+
+
+class CleanupTestCase(TestCase):
+    """Test deleting old jobs and their files."""
+
+    def setUp(self):
+        """Use a throwaway media root."""
+        self.media = tempfile.mkdtemp()
+        self.settings = override_settings(MEDIA_ROOT=self.media)
+        self.settings.enable()
+
+    def tearDown(self):
+        """Remove stored files."""
+        self.settings.disable()
+        shutil.rmtree(self.media)
+
+    def finished_job(self, days_ago, filename=None):
+        """A done job that finished ``days_ago`` days ago."""
+        result = '{}'
+        if filename:
+            name = default_storage.save(filename, ContentFile(b'rows'))
+            result = '{{"file": "{}"}}'.format(name)
+        return Job.objects.create(
+            name='tests.record', status=Job.DONE, result=result,
+            finished=timezone.now() - timedelta(days=days_ago))
+
+    def test_old_jobs_are_deleted_with_their_files(self):
+        """Test only jobs past the retention go, taking their files."""
+        old = self.finished_job(10, 'exports/old.csv')
+        recent = self.finished_job(1, 'exports/recent.csv')
+        running = queue.enqueue('tests.record', value=1)
+        self.assertTrue(cleanup.purge_jobs(days=7, batch_size=1) == 1)
+        self.assertTrue(set(Job.objects.values_list('pk', flat=True)) ==
+                        set([recent.pk, running.pk]))
+        self.assertFalse(default_storage.exists('exports/old.csv'))
+        self.assertTrue(default_storage.exists('exports/recent.csv'))
+        self.assertFalse(Job.objects.filter(pk=old.pk).exists())
+
+    def test_stale_export_files_are_swept(self):
+        """Test export files nothing points at any more are deleted."""
+        default_storage.save('exports/orphan.csv', ContentFile(b'rows'))
+        default_storage.save('exports/fresh.csv', ContentFile(b'rows'))
+        stale = timezone.now() - timedelta(days=10)
+        os.utime(default_storage.path('exports/orphan.csv'),
+                 (stale.timestamp(), stale.timestamp()))
+        self.assertTrue(cleanup.purge_files(days=7) == 1)
+        self.assertTrue(default_storage.listdir('exports')[1] ==
+                        ['fresh.csv'])
+
+    def test_purge_command(self):
+        """Test purge_jobs reports what it deleted."""
+        self.finished_job(30)
+        out = StringIO()
+        call_command('purge_jobs', stdout=out)
+        self.assertTrue('Deleted 1 jobs and 0 stale files.' in
+                        out.getvalue())
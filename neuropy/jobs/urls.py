@@ -0,0 +1,11 @@
+"""Job urls."""
+from django.conf.urls import url
+from .views import JobDownloadView, JobStatusView
+from django.contrib.auth.decorators import login_required
+
+urlpatterns = [
+    url(r'^(?P<pk>\d+)/$', login_required(JobStatusView.as_view()),
+        name='job-status'),
+    url(r'^(?P<pk>\d+)/download$', login_required(JobDownloadView.as_view()),
+        name='job-download'),
+]
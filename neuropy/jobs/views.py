@@ -0,0 +1,62 @@
+"""Views for polling background jobs."""
+import json
+from django.core.files.storage import default_storage
+from django.http import FileResponse, Http404, JsonResponse
+from django.shortcuts import get_object_or_404
+from django.urls import reverse
+from django.views.generic import View
+from jobs.models import Job
+
+
+def job_status(job):
+    """Describe a job for its owner."""
+    result = json.loads(job.result) if job.result else None
+    status = {
+        'id': job.pk,
+        'name': job.name,
+        'status': job.status,
+        'attempts': job.attempts,
+        'max_attempts': job.max_attempts,
+        'created': job.created,
+        'run_after': job.run_after,
+        'finished': job.finished,
+        'result': result,
+        'error': job.error.strip().splitlines()[-1] if job.error else None,
+        'url': reverse('job-status', args=[job.pk]),
+    }
+    if isinstance(result, dict) and result.get('file'):
+        status['download'] = reverse('job-download', args=[job.pk])
+    return status
+
+
+def accepted(job):
+    """Respond that a job was queued, pointing at its status."""
+    response = JsonResponse(job_status(job), status=202)
+    response['Location'] = reverse('job-status', args=[job.pk])
+    return response
+
+
+class JobStatusView(View):
+    """Report the status of one of the logged in user's jobs."""
+
+    def get(self, request, pk):
+        """Return the job's status and, once done, its result."""
+        job = get_object_or_404(Job, pk=pk, owner=request.user.profile)
+        return JsonResponse(job_status(job))
+
+
+class JobDownloadView(View):
+    """Download the file a finished job wrote."""
+
+    def get(self, request, pk):
+        """Stream the job's file."""
+        job = get_object_or_404(Job, pk=pk, owner=request.user.profile,
+                                status=Job.DONE)
+        result = json.loads(job.result or 'null')
+        if not isinstance(result, dict) or not result.get('file'):
+            raise Http404('The job wrote no file.')
+        response = FileResponse(default_storage.open(result['file'], 'rb'),
+                                content_type=result.get('content_type'))
+        response['Content-Disposition'] = 'attachment; filename="{}"'.format(
+            result.get('filename', 'download'))
+        return response
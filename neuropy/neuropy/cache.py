@@ -0,0 +1,112 @@
+"""Whole page caching for anonymous and per-user pages.
+
+Per-user pages are cached under a version number kept in the cache for each
+user. Saving anything shown on those pages bumps the version, so stale
+pages are never served and simply age out of the cache.
+
+A page with a CSRF token in it is stored with the CSRF cookie it was
+rendered for and only served to requests sending that same cookie. Those
+hits mark the token as used, so the middleware keeps the cookie alive as
+it would for a rendered page.
+"""
+
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.middleware.csrf import get_token
+from django.utils.cache import patch_cache_control, patch_vary_headers
+
+
+def page_timeout():
+    """Seconds a cached page is kept."""
+    return getattr(settings, 'PAGE_CACHE_TIMEOUT', 300)
+
+
+def version_key(user_id):
+    """Cache key holding the page version of a user."""
+    return 'page-version:{}'.format(user_id)
+
+
+def new_version():
+    """A version number that cannot repeat one that has been evicted."""
+    return int(time.time() * 1000)
+
+
+def user_version(user_id):
+    """Return the current page version for a user."""
+    version = cache.get(version_key(user_id))
+    if version is None:
+        version = new_version()
+        cache.set(version_key(user_id), version, None)
+    return version
+
+
+def bump_user_version(user_id):
+    """Invalidate every cached page of a user."""
+    try:
+        cache.incr(version_key(user_id))
+    except ValueError:
+        cache.set(version_key(user_id), new_version(), None)
+
+
+def csrf_cookie(request):
+    """The CSRF cookie a request came with, or None."""
+    return request.COOKIES.get(settings.CSRF_COOKIE_NAME)
+
+
+def cached_response(key, view, request, *args, **kwargs):
+    """Serve a page from the cache, rendering and storing it on a miss."""
+    cached = cache.get(key)
+    if cached is not None:
+        content, content_type, token_cookie = cached
+        if token_cookie is None or token_cookie == csrf_cookie(request):
+            response = HttpResponse(content, content_type=content_type)
+            if token_cookie is not None:
+                get_token(request)
+                patch_vary_headers(response, ('Cookie',))
+            return response
+    response = view(request, *args, **kwargs)
+    if hasattr(response, 'render') and callable(response.render):
+        response.render()
+    token_cookie = None
+    if request.META.get('CSRF_COOKIE_USED'):
+        token_cookie = csrf_cookie(request)
+        if token_cookie is None:
+            return response
+    if response.status_code == 200 and not response.streaming:
+        cache.set(key, (response.content, response['Content-Type'],
+                        token_cookie), page_timeout())
+    return response
+
+
+def cache_anonymous_page(view):
+    """Cache a page for anonymous visitors; logged in users skip it."""
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        """Serve anonymous GET requests from the cache."""
+        if request.method not in ('GET', 'HEAD') or (
+                request.user.is_authenticated):
+            return view(request, *args, **kwargs)
+        key = 'page:anonymous:{}'.format(request.get_full_path())
+        return cached_response(key, view, request, *args, **kwargs)
+    return wrapper
+
+
+def cache_user_page(view):
+    """Cache a page per logged in user under the user's page version."""
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        """Serve a user's GET requests from the cache."""
+        if request.method not in ('GET', 'HEAD') or not (
+                request.user.is_authenticated):
+            return view(request, *args, **kwargs)
+        user_id = request.user.pk
+        key = 'page:user:{}:{}:{}'.format(user_id, user_version(user_id),
+                                          request.get_full_path())
+        response = cached_response(key, view, request, *args, **kwargs)
+        patch_cache_control(response, private=True)
+        return response
+    return wrapper
@@ -0,0 +1,22 @@
+"""Print a signed token for profiling requests."""
+
+from django.core.management.base import BaseCommand
+
+from neuropy.profiling import MODES, profiling_token
+
+
+class Command(BaseCommand):
+    """Sign an X-Profile-Token header value."""
+
+    help = ('Print an X-Profile-Token header value that has a request '
+            'profiled, valid for PROFILING_TOKEN_MAX_AGE seconds.')
+
+    def add_arguments(self, parser):
+        """Command line options."""
+        parser.add_argument(
+            '--mode', choices=MODES, default='cprofile',
+            help='cprofile for a .pstats file, sample for collapsed stacks.')
+
+    def handle(self, *args, **options):
+        """Print the token."""
+        self.stdout.write(profiling_token(options['mode']))
@@ -0,0 +1,263 @@
+"""Per-view request metrics in the Prometheus text format.
+
+Every thread aggregates into its own shard of fixed size counters, so
+recording a request takes no lock and allocates nothing beyond the first
+request a thread serves for a view. A scrape of ``/metrics`` adds the
+shards of the process together, first folding those of threads that have
+exited into a retired total, so servers starting a thread per request do
+not pile up shards.
+"""
+
+import threading
+import time
+from bisect import bisect_left
+
+from django.conf import settings
+from django.db import connections
+from django.http import HttpResponse, HttpResponseForbidden
+
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+                   10.0)
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+_local = threading.local()
+_shards = {}
+_retired = {}
+_lock = threading.Lock()
+
+
+class ViewStats(object):
+    """Counters for one view in one thread."""
+
+    __slots__ = ('buckets', 'count', 'latency', 'queries', 'db_time',
+                 'response_bytes')
+
+    def __init__(self):
+        """Start every counter at zero."""
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.count = 0
+        self.latency = 0.0
+        self.queries = 0
+        self.db_time = 0.0
+        self.response_bytes = 0
+
+    def add(self, other):
+        """Add another set of counters to this one."""
+        for index, value in enumerate(other.buckets):
+            self.buckets[index] += value
+        self.count += other.count
+        self.latency += other.latency
+        self.queries += other.queries
+        self.db_time += other.db_time
+        self.response_bytes += other.response_bytes
+
+
+def add_shard(totals, shard):
+    """Add the counters of a shard to ``totals``, both keyed by view."""
+    for view, stats in list(shard.items()):
+        totals.setdefault(view, ViewStats()).add(stats)
+
+
+def thread_shard():
+    """Return the counters of the current thread, keyed by view name."""
+    shard = getattr(_local, 'shard', None)
+    if shard is None:
+        shard = _local.shard = {}
+        ident = threading.current_thread().ident
+        with _lock:
+            if ident in _shards:
+                add_shard(_retired, _shards[ident])
+            _shards[ident] = shard
+    return shard
+
+
+def retire_shards():
+    """Fold the shards of threads that have exited into the retired total."""
+    alive = set(thread.ident for thread in threading.enumerate())
+    with _lock:
+        for ident in list(_shards):
+            if ident not in alive:
+                add_shard(_retired, _shards.pop(ident))
+
+
+def record(view, latency, queries, db_time, response_bytes):
+    """Record one request against a view."""
+    shard = thread_shard()
+    stats = shard.get(view)
+    if stats is None:
+        stats = shard[view] = ViewStats()
+    stats.buckets[bisect_left(LATENCY_BUCKETS, latency)] += 1
+    stats.count += 1
+    stats.latency += latency
+    stats.queries += queries
+    stats.db_time += db_time
+    stats.response_bytes += response_bytes
+
+
+def snapshot():
+    """Return the counters of every thread added together by view."""
+    retire_shards()
+    totals = {}
+    with _lock:
+        add_shard(totals, _retired)
+        shards = list(_shards.values())
+    for shard in shards:
+        add_shard(totals, shard)
+    return totals
+
+
+class TimedCursor(object):
+    """Cursor wrapper counting the statements of the current request."""
+
+    def __init__(self, cursor):
+        """Wrap a Django cursor."""
+        self.cursor = cursor
+
+    def __getattr__(self, name):
+        """Pass everything else through to the wrapped cursor."""
+        return getattr(self.cursor, name)
+
+    def __iter__(self):
+        """Iterate over the wrapped cursor."""
+        return iter(self.cursor)
+
+    def __enter__(self):
+        """Use the cursor as a context manager."""
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        """Close the wrapped cursor."""
+        return self.cursor.__exit__(exc_type, exc_value, traceback)
+
+    def timed(self, method, sql, params):
+        """
+        Run a cursor method, counting it if a request is measured.
+
+        A callable set with ``watch_statements`` is also handed every
+        statement and its duration.
+        """
+        measuring = getattr(_local, 'measuring', False)
+        watcher = getattr(_local, 'watcher', None)
+        if not measuring and watcher is None:
+            return method(sql, params)
+        started = time.time()
+        try:
+            return method(sql, params)
+        finally:
+            elapsed = time.time() - started
+            if measuring:
+                _local.queries += 1
+                _local.db_time += elapsed
+            if watcher is not None:
+                watcher(sql, elapsed)
+
+    def execute(self, sql, params=None):
+        """Run one statement."""
+        return self.timed(self.cursor.execute, sql, params)
+
+    def executemany(self, sql, param_list):
+        """Run one statement for many parameter sets."""
+        return self.timed(self.cursor.executemany, sql, param_list)
+
+    def callproc(self, procname, params=None):
+        """Call a stored procedure."""
+        return self.timed(self.cursor.callproc, procname, params)
+
+
+def watch_statements(watcher):
+    """Hand every statement of this thread to ``watcher``, None to stop."""
+    _local.watcher = watcher
+
+
+def instrument(connection):
+    """Wrap the cursors a connection hands out, once per connection."""
+    if getattr(connection, 'timed_cursors', False):
+        return
+    make_cursor = connection.make_cursor
+    make_debug_cursor = connection.make_debug_cursor
+    connection.make_cursor = lambda cursor: TimedCursor(make_cursor(cursor))
+    connection.make_debug_cursor = lambda cursor: TimedCursor(
+        make_debug_cursor(cursor))
+    connection.timed_cursors = True
+
+
+def view_name(request):
+    """Name a request by the URL pattern it resolved to."""
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unresolved'
+    return match.view_name or match.url_name or 'unnamed'
+
+
+class MetricsMiddleware(object):
+    """Record latency, queries, database time and size for each view."""
+
+    def __init__(self, get_response):
+        """Store the next handler."""
+        self.get_response = get_response
+
+    def __call__(self, request):
+        """Measure the request."""
+        for alias in connections:
+            instrument(connections[alias])
+        _local.queries, _local.db_time = 0, 0.0
+        _local.measuring = True
+        started = time.time()
+        try:
+            response = self.get_response(request)
+        finally:
+            _local.measuring = False
+        size = 0 if response.streaming else len(response.content)
+        record(view_name(request), time.time() - started, _local.queries,
+               _local.db_time, size)
+        return response
+
+
+def label(value):
+    """Escape a Prometheus label value."""
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace(
+        '\n', '\\n')
+
+
+def render(totals):
+    """Render counters in the Prometheus text exposition format."""
+    lines = [
+        '# HELP neuropy_request_duration_seconds Request latency by view.',
+        '# TYPE neuropy_request_duration_seconds histogram',
+    ]
+    views = sorted(totals)
+    for view in views:
+        stats, name = totals[view], label(view)
+        cumulative = 0
+        for bound, count in zip(LATENCY_BUCKETS + ('+Inf',), stats.buckets):
+            cumulative += count
+            lines.append('neuropy_request_duration_seconds_bucket'
+                         '{{view="{}",le="{}"}} {}'.format(name, bound,
+                                                           cumulative))
+        lines.append('neuropy_request_duration_seconds_sum{{view="{}"}} '
+                     '{!r}'.format(name, stats.latency))
+        lines.append('neuropy_request_duration_seconds_count{{view="{}"}} '
+                     '{}'.format(name, stats.count))
+    counters = (
+        ('neuropy_db_queries_total', 'Database queries by view.', 'queries'),
+        ('neuropy_db_duration_seconds_total', 'Database time by view.',
+         'db_time'),
+        ('neuropy_response_bytes_total', 'Response body bytes by view.',
+         'response_bytes'),
+    )
+    for metric, description, attribute in counters:
+        lines.append('# HELP {} {}'.format(metric, description))
+        lines.append('# TYPE {} counter'.format(metric))
+        for view in views:
+            lines.append('{}{{view="{}"}} {!r}'.format(
+                metric, label(view), getattr(totals[view], attribute)))
+    return '\n'.join(lines) + '\n'
+
+
+def metrics_view(request):
+    """Expose the metrics of this process to allowed addresses."""
+    allowed = getattr(settings, 'METRICS_ALLOWED_IPS', None)
+    if allowed is not None and request.META.get('REMOTE_ADDR') not in allowed:
+        return HttpResponseForbidden()
+    return HttpResponse(render(snapshot()), content_type=CONTENT_TYPE)
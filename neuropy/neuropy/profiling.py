@@ -0,0 +1,202 @@
+"""On demand profiling of single requests.
+
+A staff user asks for a profile with ``?profile=cprofile`` or
+``?profile=sample``, or the same value in an ``X-Profile`` header. Anyone
+else needs an ``X-Profile-Token`` header signed with the site's secret,
+made with the ``profiling_token`` command, so production requests can be
+profiled without a redeploy.
+
+``cprofile`` writes a ``.pstats`` file for ``pstats`` or snakeviz.
+``sample`` walks the request thread's stack every few milliseconds from a
+second thread and writes the stacks in the collapsed format that
+flamegraph.pl and speedscope read. Either way every SQL statement is
+written to a ``.sql.json`` file with its duration and the project frames
+it came from. Nothing is done unless ``PROFILING_DIR`` is set.
+"""
+
+import cProfile
+import json
+import os
+import sys
+import threading
+import time
+import traceback
+import uuid
+from collections import Counter
+
+from django.conf import settings
+from django.core import signing
+from django.db import connections
+
+from neuropy.metrics import instrument, view_name, watch_statements
+
+
+MODES = ('cprofile', 'sample')
+TOKEN_SALT = 'neuropy.profiling'
+SKIPPED_FILES = (__file__.rstrip('c'), os.path.join(
+    os.path.dirname(__file__), 'metrics.py'))
+
+
+def profiling_dir():
+    """Directory profiles are written to, None when profiling is off."""
+    return getattr(settings, 'PROFILING_DIR', None)
+
+
+def sample_interval():
+    """Seconds between two samples of the request's stack."""
+    return getattr(settings, 'PROFILING_SAMPLE_INTERVAL', 0.002)
+
+
+def profiling_token(mode='cprofile'):
+    """Signed ``X-Profile-Token`` value asking for a ``mode`` profile."""
+    return signing.TimestampSigner(salt=TOKEN_SALT).sign(mode)
+
+
+def token_mode(token):
+    """The mode a token asks for, None if it is bad or has expired."""
+    max_age = getattr(settings, 'PROFILING_TOKEN_MAX_AGE', 60 * 60)
+    try:
+        mode = signing.TimestampSigner(salt=TOKEN_SALT).unsign(
+            token, max_age=max_age)
+    except signing.BadSignature:
+        return None
+    return mode if mode in MODES else None
+
+
+def requested_mode(request):
+    """The profile a request asks for and may have, or None."""
+    token = request.META.get('HTTP_X_PROFILE_TOKEN')
+    if token:
+        return token_mode(token)
+    mode = request.GET.get('profile') or request.META.get('HTTP_X_PROFILE')
+    user = getattr(request, 'user', None)
+    if mode in MODES and user is not None and user.is_staff:
+        return mode
+    return None
+
+
+def project_frames(frames):
+    """Format the frames of ``frames`` that belong to the project."""
+    base = settings.BASE_DIR
+    return ['{}:{} in {}'.format(os.path.relpath(filename, base), line,
+                                 function)
+            for filename, line, function, text in frames
+            if filename.startswith(base) and 'site-packages' not in filename
+            and filename not in SKIPPED_FILES]
+
+
+class StatementLog(object):
+    """Every statement of a request with its duration and origin."""
+
+    def __init__(self):
+        """Start with no statements."""
+        self.statements = []
+
+    def __call__(self, sql, elapsed):
+        """Record a statement that has just run."""
+        self.statements.append({
+            'sql': sql,
+            'seconds': round(elapsed, 6),
+            'origin': project_frames(traceback.extract_stack()),
+        })
+
+
+def frame_label(frame):
+    """Name a frame for a collapsed stack line."""
+    code = frame.f_code
+    return '{} ({}:{})'.format(code.co_name, os.path.basename(
+        code.co_filename), code.co_firstlineno).replace(';', ',')
+
+
+class Sampler(threading.Thread):
+    """Count the stacks a thread is in at regular intervals."""
+
+    def __init__(self, thread_id, interval):
+        """Sample ``thread_id`` every ``interval`` seconds once started."""
+        super(Sampler, self).__init__()
+        self.daemon = True
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self.stopping = threading.Event()
+
+    def run(self):
+        """Sample until stopped."""
+        while not self.stopping.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            labels = []
+            while frame is not None:
+                labels.append(frame_label(frame))
+                frame = frame.f_back
+            if labels:
+                self.stacks[';'.join(reversed(labels))] += 1
+
+    def stop(self):
+        """Stop sampling and wait for the last sample."""
+        self.stopping.set()
+        self.join()
+
+    def collapsed(self):
+        """Stacks in the collapsed format, one ``stack count`` per line."""
+        return ''.join('{} {}\n'.format(stack, count)
+                       for stack, count in sorted(self.stacks.items()))
+
+
+def profile_name(request):
+    """Unique file name stem for a profile of ``request``."""
+    view = view_name(request) if getattr(
+        request, 'resolver_match', None) else 'request'
+    return '{}-{}-{}'.format(time.strftime('%Y%m%d-%H%M%S'),
+                             view.replace(':', '.').replace('/', '.'),
+                             uuid.uuid4().hex[:8])
+
+
+class ProfilingMiddleware(object):
+    """Profile the rest of a request when asked to."""
+
+    def __init__(self, get_response):
+        """Store the next handler."""
+        self.get_response = get_response
+
+    def __call__(self, request):
+        """Profile the request if profiling is on and it asks for it."""
+        directory = profiling_dir()
+        mode = requested_mode(request) if directory else None
+        if mode is None:
+            return self.get_response(request)
+        for alias in connections:
+            instrument(connections[alias])
+        log = StatementLog()
+        watch_statements(log)
+        if mode == 'cprofile':
+            profiler = cProfile.Profile()
+            profiler.enable()
+        else:
+            profiler = Sampler(threading.current_thread().ident,
+                               sample_interval())
+            profiler.start()
+        try:
+            response = self.get_response(request)
+        finally:
+            if mode == 'cprofile':
+                profiler.disable()
+            else:
+                profiler.stop()
+            watch_statements(None)
+        name = profile_name(request)
+        self.write(directory, name, mode, profiler, log)
+        response['X-Profile'] = name
+        return response
+
+    def write(self, directory, name, mode, profiler, log):
+        """Write the profile and the statement log to ``directory``."""
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        stem = os.path.join(directory, name)
+        if mode == 'cprofile':
+            profiler.dump_stats(stem + '.pstats')
+        else:
+            with open(stem + '.folded', 'w') as folded:
+                folded.write(profiler.collapsed())
+        with open(stem + '.sql.json', 'w') as statements:
+            json.dump(log.statements, statements, indent=1)
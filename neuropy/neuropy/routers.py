@@ -0,0 +1,120 @@
+"""Database routing between the primary and an optional read replica.
+
+Reads only go to the replica inside a read-only context: a safe request to
+a view marked with ``use_replica = True``, or a ``replica_reads()`` block.
+The first write in a context makes the rest of it stick to the primary, so
+a request always reads its own writes.
+
+While tests run, a replica set up as a test mirror is not read from. A
+mirror reads through a connection of its own, which cannot see what a
+test case has written inside its transaction, and on SQLite is locked out
+by it, so tests read from the primary.
+"""
+
+import threading
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+
+REPLICA_DB_ALIAS = 'replica'
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+_state = threading.local()
+
+
+def test_mirror(alias):
+    """
+    Return whether ``alias`` is standing in for another test database.
+
+    The test database of the mirrored alias must be named in its ``TEST``
+    settings, as the replica only takes that name while tests run.
+    """
+    replica = connections[alias]
+    mirror = replica.settings_dict['TEST'].get('MIRROR')
+    if not mirror:
+        return False
+    test_name = settings.DATABASES[mirror].get('TEST', {}).get('NAME')
+    return bool(test_name) and replica.settings_dict['NAME'] == test_name
+
+
+def replica_available():
+    """Return whether a replica database is configured and usable."""
+    return (REPLICA_DB_ALIAS in settings.DATABASES and
+            not test_mirror(REPLICA_DB_ALIAS))
+
+
+@contextmanager
+def replica_reads():
+    """Send reads in the block to the replica until the first write."""
+    previous = (getattr(_state, 'replica', False),
+                getattr(_state, 'sticky', False))
+    _state.replica, _state.sticky = True, False
+    try:
+        yield
+    finally:
+        _state.replica, _state.sticky = previous
+
+
+def wants_replica(view_func):
+    """Return whether a view, however decorated, opted in to the replica."""
+    view_class = getattr(view_func, 'view_class', None)
+    return bool(getattr(view_func, 'use_replica', False) or
+                getattr(view_class, 'use_replica', False))
+
+
+class PrimaryReplicaRouter(object):
+    """Send reads in read-only contexts to the replica, all else to primary."""
+
+    def db_for_read(self, model, **hints):
+        """Use the replica for reads in a context that has not written."""
+        if (getattr(_state, 'replica', False) and
+                not getattr(_state, 'sticky', False) and replica_available()):
+            return REPLICA_DB_ALIAS
+        return DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        """Write to the primary and stick the rest of the context to it."""
+        _state.sticky = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        """Both databases hold the same data."""
+        return True
+
+
+class ReplicaRoutingMiddleware(object):
+    """Open a replica read context for safe requests to opted-in views."""
+
+    def __init__(self, get_response):
+        """Store the next handler."""
+        self.get_response = get_response
+
+    def __call__(self, request):
+        """Reset routing state around each request."""
+        _state.replica, _state.sticky = False, False
+        try:
+            response = self.get_response(request)
+            if response.streaming and self.reading_replica():
+                response.streaming_content = self.replica_stream(
+                    response.streaming_content)
+            return response
+        finally:
+            _state.replica, _state.sticky = False, False
+
+    def reading_replica(self):
+        """Return whether the request is still reading from the replica."""
+        return (getattr(_state, 'replica', False) and
+                not getattr(_state, 'sticky', False))
+
+    def replica_stream(self, content):
+        """Keep reading from the replica while a response streams."""
+        with replica_reads():
+            for chunk in content:
+                yield chunk
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        """Allow replica reads once the view is known to be read-only."""
+        if request.method in SAFE_METHODS and wants_replica(view_func):
+            _state.replica = not getattr(_state, 'sticky', False)
@@ -40,14 +40,19 @@ INSTALLED_APPS = [
     'neuropy',
     'userprofile',
     'todo',
+    'jobs',
+    'outbox',
 ]
 
 MIDDLEWARE = [
+    'neuropy.metrics.MetricsMiddleware',
+    'neuropy.routers.ReplicaRoutingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'neuropy.profiling.ProfilingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -90,6 +95,124 @@ DATABASES = {
     }
 }
 
+# An optional read replica of the primary. Read-only views read from it
+# and everything else uses the primary, see neuropy.routers.
+if os.environ.get('DATABASE_REPLICA_HOST'):
+    DATABASES['replica'] = dict(
+        DATABASES['default'],
+        HOST=os.environ['DATABASE_REPLICA_HOST'],
+        PORT=os.environ.get('DATABASE_REPLICA_PORT', '5432'),
+        TEST={'MIRROR': 'default'},
+    )
+
+# A local SQLite file stands in for the primary when trying the routing
+# out without PostgreSQL. The replica is a second connection to the same
+# file, so replica reads see every write the way a caught up replica would.
+# Test databases are named so the router can tell the replica is a mirror.
+if os.environ.get('DATABASE_SQLITE'):
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+            'TEST': {
+                'NAME': os.path.join(BASE_DIR, 'test_db.sqlite3'),
+            },
+        },
+    }
+    DATABASES['replica'] = dict(DATABASES['default'],
+                                TEST={'MIRROR': 'default'})
+
+DATABASE_ROUTERS = ['neuropy.routers.PrimaryReplicaRouter']
+
+
+# Cache
+# https://docs.djangoproject.com/en/1.10/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get(
+            'CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('CACHE_LOCATION', 'neuropy'),
+    }
+}
+PAGE_CACHE_TIMEOUT = 300
+USER_CACHE_TIMEOUT = 300
+
+# Sessions are read from the cache and only fall back to the database on a
+# miss, and logged in users are loaded with their profile from the cache,
+# see userprofile.backends. ModelBackend stays listed so sessions started
+# before the switch keep working.
+SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
+
+AUTHENTICATION_BACKENDS = [
+    'userprofile.backends.CachedUserBackend',
+    'django.contrib.auth.backends.ModelBackend',
+]
+
+
+# Metrics
+# Addresses allowed to scrape /metrics, comma separated.
+
+METRICS_ALLOWED_IPS = os.environ.get(
+    'METRICS_ALLOWED_IPS', '127.0.0.1,::1').split(',')
+
+
+# Profiling
+# Requests from staff asking for a profile, or carrying a token made with
+# the profiling_token command, are profiled into PROFILING_DIR. Profiling
+# is off while it is unset.
+
+PROFILING_DIR = os.environ.get('PROFILING_DIR') or None
+PROFILING_TOKEN_MAX_AGE = 60 * 60
+PROFILING_SAMPLE_INTERVAL = 0.002
+
+
+# Warm-up
+# With WSGI_WARM_UP set, neuropy.wsgi resolves every URL, compiles the
+# templates and builds the scheduler's lookup tables before serving, see
+# neuropy.warmup. Load the application before forking, with gunicorn
+# --preload for instance, so every worker starts warm. Compiled templates
+# are only kept by the cached loader, which is used only then.
+
+WSGI_WARM_UP = bool(os.environ.get('WSGI_WARM_UP'))
+
+if WSGI_WARM_UP:
+    TEMPLATES[0]['APP_DIRS'] = False
+    TEMPLATES[0]['OPTIONS']['loaders'] = [
+        ('django.template.loaders.cached.Loader', [
+            'django.template.loaders.filesystem.Loader',
+            'django.template.loaders.app_directories.Loader',
+        ]),
+    ]
+
+
+# Background jobs
+# Uploads waiting to be imported and finished exports go to MEDIA_ROOT. A
+# job whose worker stopped renewing its lease for JOB_LEASE_SECONDS is
+# taken to be abandoned. purge_jobs deletes jobs and their files once they
+# finished JOB_RETENTION_DAYS ago.
+
+MEDIA_ROOT = os.environ.get('MEDIA_ROOT', os.path.join(BASE_DIR, 'media'))
+JOB_LEASE_SECONDS = int(os.environ.get('JOB_LEASE_SECONDS', 600))
+JOB_RETENTION_DAYS = int(os.environ.get('JOB_RETENTION_DAYS', 7))
+
+
+# Email
+# Mail sent by the site is only queued in the outbox. send_outbox delivers
+# it over SMTP at up to OUTBOX_RATE messages a second. To try it locally,
+# run python -m smtpd -n -c DebuggingServer localhost:1025 and set
+# EMAIL_PORT=1025.
+
+EMAIL_BACKEND = 'outbox.backends.OutboxBackend'
+EMAIL_HOST = os.environ.get('EMAIL_HOST', 'localhost')
+EMAIL_PORT = int(os.environ.get('EMAIL_PORT', 25))
+EMAIL_HOST_USER = os.environ.get('EMAIL_HOST_USER', '')
+EMAIL_HOST_PASSWORD = os.environ.get('EMAIL_HOST_PASSWORD', '')
+EMAIL_USE_TLS = bool(os.environ.get('EMAIL_USE_TLS'))
+EMAIL_TIMEOUT = 30
+OUTBOX_BATCH_SIZE = 50
+OUTBOX_RATE = float(os.environ.get('OUTBOX_RATE', 10))
+
 
 # Password validation
 # https://docs.djangoproject.com/en/1.10/ref/settings/#auth-password-validators
@@ -129,5 +252,4 @@ USE_TZ = True
 
 STATIC_URL = '/static/'
 ACCOUNT_ACTIVATION_DAYS = 7
-EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
 LOGIN_REDIRECT_URL = '/'
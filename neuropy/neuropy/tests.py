@@ -0,0 +1,295 @@
+"""Tests for the project wide modules."""
+
+import json
+import os
+import pstats
+import shutil
+import tempfile
+import threading
+import time
+from django.contrib.auth.models import Group, User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.http import HttpResponse
+from django.template import engines
+from django.test import (RequestFactory, SimpleTestCase, TestCase,
+                         override_settings)
+from django.utils.six import StringIO
+from neuropy import metrics, profiling, routers, warmup
+from neuropy.routers import (PrimaryReplicaRouter, REPLICA_DB_ALIAS,
+                             ReplicaRoutingMiddleware, replica_reads)
+from todo.views import TodoListView
+from userprofile import energy
+from userprofile.models import _group_ids
+from userprofile.views import EditProfile, ProfileView
+
+
+class RouterTestCase(SimpleTestCase):
+    """Test the primary/replica database router."""
+
+    def setUp(self):
+        """Make a router and a request factory, with a replica configured."""
+        self.router = PrimaryReplicaRouter()
+        self.request = RequestFactory()
+        self.replica_available = routers.replica_available
+        routers.replica_available = lambda: True
+
+    def tearDown(self):
+        """Restore the replica check."""
+        routers.replica_available = self.replica_available
+
+    def test_reads_use_primary_outside_read_context(self):
+        """Test reads default to the primary."""
+        self.assertTrue(self.router.db_for_read(User) == 'default')
+
+    def test_reads_use_replica_in_read_context(self):
+        """Test reads go to the replica in a read-only block."""
+        with replica_reads():
+            self.assertTrue(self.router.db_for_read(User) == REPLICA_DB_ALIAS)
+        self.assertTrue(self.router.db_for_read(User) == 'default')
+
+    def test_writes_stick_reads_to_primary(self):
+        """Test reads after a write come from the primary."""
+        with replica_reads():
+            self.assertTrue(self.router.db_for_write(User) == 'default')
+            self.assertTrue(self.router.db_for_read(User) == 'default')
+
+    def test_no_replica_configured(self):
+        """Test reads stay on the primary without a replica alias."""
+        routers.replica_available = lambda: False
+        with replica_reads():
+            self.assertTrue(self.router.db_for_read(User) == 'default')
+
+    def route_view(self, method, view):
+        """Return where the view of a request reads from."""
+        routes = []
+
+        def get_response(request):
+            middleware.process_view(request, view, (), {})
+            routes.append(self.router.db_for_read(User))
+            return HttpResponse()
+
+        middleware = ReplicaRoutingMiddleware(get_response)
+        middleware(getattr(self.request, method)('/'))
+        return routes[0]
+
+    def test_middleware_routes_read_only_views_to_replica(self):
+        """Test GETs to opted-in views read from the replica."""
+        self.assertTrue(self.route_view('get', ProfileView.as_view()) ==
+                        REPLICA_DB_ALIAS)
+        self.assertTrue(self.route_view('get', TodoListView.as_view()) ==
+                        REPLICA_DB_ALIAS)
+
+    def test_middleware_keeps_writes_and_other_views_on_primary(self):
+        """Test POSTs and views that did not opt in use the primary."""
+        self.assertTrue(self.route_view('post', ProfileView.as_view()) ==
+                        'default')
+        self.assertTrue(self.route_view('get', EditProfile.as_view()) ==
+                        'default')
+
+
+class MetricsTestCase(TestCase):
+    """Test the request metrics middleware and endpoint."""
+
+    def setUp(self):
+        """Forget metrics from other tests."""
+        metrics._shards.clear()
+        metrics._retired.clear()
+        metrics._local.__dict__.pop('shard', None)
+
+    def test_requests_are_recorded_by_view_name(self):
+        """Test latency, queries and size are recorded per view."""
+        self.client.get('/')
+        self.client.get('/login/')
+        totals = metrics.snapshot()
+        self.assertTrue(totals['home'].count == 1)
+        self.assertTrue(totals['login'].count == 1)
+        self.assertTrue(sum(totals['home'].buckets) == 1)
+        self.assertTrue(totals['login'].response_bytes > 0)
+
+    def test_queries_are_counted(self):
+        """Test database queries made by a view are counted."""
+        Group.objects.create(name='user')
+        User.objects.create(username='bob')
+        self.client.get('/login/')
+        self.client.post('/login/', {'username': 'bob', 'password': 'x'})
+        self.assertTrue(metrics.snapshot()['login'].queries >= 1)
+
+    def test_exited_threads_are_folded_into_one_total(self):
+        """Test shards of finished threads are kept as a single total."""
+        def serve():
+            """Record one request from a short lived thread."""
+            metrics.record('home', 0.01, 2, 0.001, 10)
+
+        for i in range(5):
+            thread = threading.Thread(target=serve)
+            thread.start()
+            thread.join()
+        totals = metrics.snapshot()
+        self.assertTrue(totals['home'].count == 5)
+        self.assertTrue(totals['home'].queries == 10)
+        self.assertTrue(len(metrics._shards) == 0)
+        serve()
+        self.assertTrue(metrics.snapshot()['home'].count == 6)
+        self.assertTrue(len(metrics._shards) == 1)
+
+    def test_metrics_endpoint_renders_prometheus_text(self):
+        """Test /metrics exposes a histogram and counters."""
+        self.client.get('/')
+        response = self.client.get('/metrics')
+        text = response.content.decode('utf-8')
+        self.assertTrue(response['Content-Type'].startswith('text/plain'))
+        self.assertTrue('# TYPE neuropy_request_duration_seconds histogram'
+                        in text)
+        self.assertTrue('neuropy_request_duration_seconds_bucket'
+                        '{view="home",le="+Inf"} 1' in text)
+        self.assertTrue('neuropy_db_queries_total{view="home"}' in text)
+
+    def test_metrics_endpoint_is_restricted(self):
+        """Test addresses outside METRICS_ALLOWED_IPS are refused."""
+        response = self.client.get('/metrics', REMOTE_ADDR='10.1.2.3')
+        self.assertTrue(response.status_code == 403)
+
+
+class ProfilingTestCase(TestCase):
+    """Test profiling requests on demand."""
+
+    def setUp(self):
+        """Profile into a temporary directory, with a staff user."""
+        cache.clear()
+        Group.objects.create(name='user')
+        self.staff = User.objects.create(username='admin', is_staff=True)
+        self.user = User.objects.create(username='bob')
+        self.directory = tempfile.mkdtemp()
+        self.settings = override_settings(PROFILING_DIR=self.directory)
+        self.settings.enable()
+
+    def tearDown(self):
+        """Remove written profiles."""
+        self.settings.disable()
+        shutil.rmtree(self.directory)
+
+    def written(self, response, suffix):
+        """Path of the profile file a response names."""
+        return os.path.join(self.directory, response['X-Profile'] + suffix)
+
+    def test_staff_request_writes_pstats_and_statements(self):
+        """Test a staff cProfile run writes stats and the SQL it ran."""
+        self.client.force_login(self.staff)
+        response = self.client.get('/todo/', HTTP_X_PROFILE='cprofile')
+        stats = pstats.Stats(self.written(response, '.pstats'))
+        self.assertTrue(any(function[2] == 'get' and
+                            function[0].endswith(os.path.join('todo',
+                                                              'views.py'))
+                            for function in stats.stats))
+        with open(self.written(response, '.sql.json')) as statements:
+            statements = json.load(statements)
+        self.assertTrue(any('todo_todo' in statement['sql'] and
+                            any('todo/views.py' in frame
+                                for frame in statement['origin'])
+                            for statement in statements))
+        self.assertTrue(all(statement['seconds'] >= 0
+                            for statement in statements))
+
+    def test_sample_mode_writes_collapsed_stacks(self):
+        """Test sampling writes a collapsed stack file."""
+        self.client.force_login(self.staff)
+        response = self.client.get('/todo/?profile=sample')
+        with open(self.written(response, '.folded')) as folded:
+            for line in folded:
+                stack, count = line.rsplit(' ', 1)
+                self.assertTrue(int(count) > 0)
+
+    def test_other_users_are_not_profiled(self):
+        """Test asking for a profile without being staff does nothing."""
+        self.client.force_login(self.user)
+        response = self.client.get('/todo/?profile=cprofile')
+        self.assertTrue('X-Profile' not in response)
+        self.assertTrue(os.listdir(self.directory) == [])
+
+    def test_signed_token_profiles_anyone(self):
+        """Test a valid token profiles an anonymous request."""
+        out = StringIO()
+        call_command('profiling_token', stdout=out)
+        response = self.client.get(
+            '/', HTTP_X_PROFILE_TOKEN=out.getvalue().strip())
+        self.assertTrue(os.path.exists(self.written(response, '.pstats')))
+
+    def test_tampered_token_is_ignored(self):
+        """Test a token with a bad signature is not honoured."""
+        token = profiling.profiling_token('sample')
+        response = self.client.get(
+            '/', HTTP_X_PROFILE_TOKEN=token.replace('sample', 'cprofile'))
+        self.assertTrue('X-Profile' not in response)
+
+    def test_nothing_is_profiled_without_a_directory(self):
+        """Test profiling is off unless PROFILING_DIR is set."""
+        self.client.force_login(self.staff)
+        with override_settings(PROFILING_DIR=None):
+            response = self.client.get('/todo/?profile=cprofile')
+        self.assertTrue('X-Profile' not in response)
+
+    def test_sampler_sees_the_running_function(self):
+        """Test the sampler records the stack of a busy thread."""
+        sampler = profiling.Sampler(threading.current_thread().ident,
+                                    0.001)
+        sampler.start()
+        stop = time.time() + 0.05
+        while time.time() < stop:
+            pass
+        sampler.stop()
+        self.assertTrue('test_sampler_sees_the_running_function' in
+                        sampler.collapsed())
+
+
+CACHED_TEMPLATES = [{
+    'BACKEND': 'django.template.backends.django.DjangoTemplates',
+    'OPTIONS': {'loaders': [('django.template.loaders.cached.Loader', [
+        'django.template.loaders.app_directories.Loader'])]},
+}]
+
+
+class WarmUpTestCase(TestCase):
+    """Test warming a process up before it serves."""
+
+    def test_every_url_pattern_is_resolved(self):
+        """Test the patterns of the included url modules are walked."""
+        self.assertTrue(warmup.resolve_urls() > 20)
+
+    @override_settings(TEMPLATES=CACHED_TEMPLATES)
+    def test_templates_are_compiled_into_the_cache(self):
+        """Test the project and profile templates are kept compiled."""
+        self.assertTrue(warmup.load_templates() >= 11)
+        cached = engines['django'].engine.template_loaders[0]
+        compiled = cached.get_template_cache
+        self.assertTrue('neuropy/home.html' in compiled)
+        self.assertTrue('userprofile/profile.html' in compiled)
+
+    def test_tables_are_built_for_common_rhythms(self):
+        """Test the medication tables profiles use are ready afterwards."""
+        Group.objects.get_or_create(name='user')
+        User.objects.create_user('rhythm', 'rhythm@cbt.com', 'rhythm')
+        profile = User.objects.get(username='rhythm').profile
+        energy.medication_table.cache_clear()
+        _group_ids.clear()
+        warmup.build_tables()
+        self.assertTrue(energy.medication_table.cache_info().currsize >= 1)
+        self.assertTrue(_group_ids)
+        before = energy.medication_table.cache_info().misses
+        energy.compute_curve(profile)
+        self.assertTrue(energy.medication_table.cache_info().misses ==
+                        before)
+
+    def test_tables_are_skipped_without_groups(self):
+        """Test a database without the user group does not stop warm-up."""
+        Group.objects.filter(name='user').delete()
+        _group_ids.clear()
+        self.assertTrue(warmup.build_tables() >= 1)
+        self.assertTrue(not _group_ids)
+
+    def test_warm_up_reports_each_step(self):
+        """Test warm-up runs every step and says how much each did."""
+        counts = warmup.warm_up()
+        self.assertTrue(set(counts) == {'patterns', 'templates', 'modules',
+                                        'tables'})
+        self.assertTrue(all(counts.values()))
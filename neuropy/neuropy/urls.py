@@ -15,14 +15,24 @@ Including another URLconf
 """
 from django.conf.urls import url, include
 from django.contrib import admin, auth
+from django.contrib.auth.decorators import login_required
 from django.views.generic import TemplateView
+from neuropy.cache import cache_anonymous_page
+from neuropy.metrics import metrics_view
+from todo.views import TodoExportView
 
 
 urlpatterns = [
     url(r'^admin/', admin.site.urls),
-    url(r'^$', TemplateView.as_view(template_name="neuropy/home.html"), name='home'),
+    url(r'^$', cache_anonymous_page(
+        TemplateView.as_view(template_name="neuropy/home.html")), name='home'),
     url(r'^accounts/', include('registration.backends.hmac.urls')),
     url(r'^login/', auth.views.login, name='login'),
     url(r'^logout/', auth.views.logout, {'next_page': '/'}, name='logout'),
-    url(r'^profile/', include('userprofile.urls'))
+    url(r'^profile/', include('userprofile.urls')),
+    url(r'^todo/', include('todo.urls')),
+    url(r'^jobs/', include('jobs.urls')),
+    url(r'^metrics$', metrics_view, name='metrics'),
+    url(r'^export/todos\.(?P<fmt>csv|json)$',
+        login_required(TodoExportView.as_view()), name='todo-export')
 ]
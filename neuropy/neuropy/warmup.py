@@ -0,0 +1,126 @@
+"""Warm a process up before it forks into workers.
+
+The first request a fresh worker serves pays for resolving the URL
+patterns, compiling templates, importing the admin and registration views
+and building the scheduler's lookup tables. ``warm_up`` does all of that
+once, so when the application is loaded before forking, with gunicorn's
+``--preload`` for instance, every worker starts warm and shares the
+result with the others copy-on-write. ``neuropy.wsgi`` calls it when
+``WSGI_WARM_UP`` is set.
+"""
+
+import importlib
+import os
+
+from django.apps import apps
+from django.db import DatabaseError, connections
+from django.db.models import Count
+from django.template.loader import get_template
+from django.urls import get_resolver
+
+
+TEMPLATE_APPS = ('neuropy', 'userprofile')
+WARM_MODULES = (
+    'django.contrib.admin.views.main',
+    'django.contrib.admin.templatetags.admin_list',
+    'django.contrib.auth.views',
+    'registration.backends.hmac.views',
+    'registration.forms',
+    'todo.scheduler',
+    'todo.week',
+    'todo.ranking',
+)
+
+
+def walk_patterns(resolver):
+    """Compile every pattern under ``resolver``, returning how many."""
+    count = 0
+    resolver.reverse_dict
+    for pattern in resolver.url_patterns:
+        pattern.regex
+        if hasattr(pattern, 'url_patterns'):
+            count += walk_patterns(pattern)
+        else:
+            count += 1
+    return count
+
+
+def resolve_urls():
+    """Populate the URL resolvers, returning how many patterns there are."""
+    return walk_patterns(get_resolver())
+
+
+def template_names(label):
+    """Names of the templates in the ``templates`` folder of an app."""
+    directory = os.path.join(apps.get_app_config(label).path, 'templates')
+    for root, dirs, files in os.walk(directory):
+        for filename in sorted(files):
+            name = os.path.relpath(os.path.join(root, filename), directory)
+            yield name.replace(os.sep, '/')
+
+
+def load_templates(labels=TEMPLATE_APPS):
+    """
+    Compile the templates of the apps in ``labels``, returning how many.
+
+    With the cached loader the compiled templates are kept for the life of
+    the process, otherwise this only checks that they compile.
+    """
+    count = 0
+    for label in labels:
+        for name in template_names(label):
+            get_template(name)
+            count += 1
+    return count
+
+
+def import_modules(names=WARM_MODULES):
+    """Import modules the URL patterns do not pull in on their own."""
+    for name in names:
+        importlib.import_module(name)
+    return len(names)
+
+
+def common_rhythms():
+    """The half-life and dose time pairs most profiles use."""
+    from userprofile.energy import TABLE_CACHE_SIZE
+    from userprofile.models import Profile
+    return Profile.objects.values_list(
+        'medication_half_life', 'dose_time').annotate(
+            profiles=Count('id')).order_by('-profiles')[:TABLE_CACHE_SIZE]
+
+
+def build_tables():
+    """Build the medication tables and group ids the scheduler looks up."""
+    from django.contrib.auth.models import Group
+    from userprofile.energy import (half_life_minutes, level_table,
+                                    medication_table, slot_of)
+    from userprofile.models import user_group_id
+    level_table(None)
+    count = 1
+    try:
+        for half_life, dose_time, profiles in common_rhythms():
+            medication_table(half_life_minutes(half_life), slot_of(dose_time))
+            count += 1
+        user_group_id()
+    except (DatabaseError, Group.DoesNotExist):
+        pass
+    return count
+
+
+def warm_up():
+    """
+    Do the work of a first request ahead of time, returning what was done.
+
+    Database connections opened on the way are closed again, so forked
+    workers never share one.
+    """
+    try:
+        return {
+            'patterns': resolve_urls(),
+            'templates': load_templates(),
+            'modules': import_modules(),
+            'tables': build_tables(),
+        }
+    finally:
+        connections.close_all()
@@ -2,6 +2,8 @@
 WSGI config for neuropy project.
 
 It exposes the WSGI callable as a module-level variable named ``application``.
+With ``WSGI_WARM_UP`` set it is warmed up before serving, see
+neuropy.warmup.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/1.10/howto/deployment/wsgi/
@@ -9,8 +11,13 @@ https://docs.djangoproject.com/en/1.10/howto/deployment/wsgi/
 
 import os
 
+from django.conf import settings
 from django.core.wsgi import get_wsgi_application
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "neuropy.settings")
 
 application = get_wsgi_application()
+
+if settings.WSGI_WARM_UP:
+    from neuropy.warmup import warm_up
+    warm_up()
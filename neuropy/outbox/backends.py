@@ -0,0 +1,41 @@
+"""Email backend that queues messages in the outbox instead of sending.
+
+Sending is left to ``send_outbox``, so a request that sends mail, such as
+a signup, only pays for one insert however slow the mail server is. The
+message is stored as the bytes Django's SMTP backend would have sent.
+"""
+
+from django.conf import settings
+from django.core.mail.backends.base import BaseEmailBackend
+from django.core.mail.message import sanitize_address
+
+from outbox.models import OutgoingEmail
+
+
+def outgoing(message):
+    """Render an ``EmailMessage`` into an unsaved ``OutgoingEmail``."""
+    encoding = message.encoding or settings.DEFAULT_CHARSET
+    return OutgoingEmail(
+        sender=sanitize_address(message.from_email, encoding),
+        recipients='\n'.join(sanitize_address(address, encoding)
+                             for address in message.recipients()),
+        subject=message.subject[:255],
+        message=message.message().as_bytes(linesep='\r\n'))
+
+
+class OutboxBackend(BaseEmailBackend):
+    """Store messages for the outbox sender and report them as sent."""
+
+    def send_messages(self, email_messages):
+        """Queue every message with recipients, returning how many."""
+        queued = []
+        try:
+            for message in email_messages:
+                if message.recipients():
+                    queued.append(outgoing(message))
+            OutgoingEmail.objects.bulk_create(queued)
+        except Exception:
+            if not self.fail_silently:
+                raise
+            return 0
+        return len(queued)
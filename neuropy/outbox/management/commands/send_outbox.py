@@ -0,0 +1,34 @@
+"""Send the email waiting in the outbox."""
+
+from django.core.management.base import BaseCommand
+
+from outbox.sender import drain, worker_name
+
+
+class Command(BaseCommand):
+    """Send queued email in batches until stopped."""
+
+    help = 'Send queued email in batches over one SMTP connection.'
+
+    def add_arguments(self, parser):
+        """Command line options."""
+        parser.add_argument(
+            '--batch-size', type=int, default=None,
+            help='Messages to claim at a time; OUTBOX_BATCH_SIZE by default.')
+        parser.add_argument(
+            '--rate', type=float, default=None,
+            help='Messages a second at most, 0 for no limit; OUTBOX_RATE '
+                 'by default.')
+        parser.add_argument(
+            '--burst', action='store_true',
+            help='Stop once no message is due instead of waiting for more.')
+        parser.add_argument(
+            '--poll-interval', type=float, default=5.0,
+            help='Seconds to wait before looking for messages again.')
+
+    def handle(self, *args, **options):
+        """Drain the outbox in this process."""
+        sent = drain(worker_name(), options['burst'],
+                     options['poll_interval'], options['batch_size'],
+                     options['rate'])
+        self.stdout.write(self.style.SUCCESS('Sent {} emails.'.format(sent)))
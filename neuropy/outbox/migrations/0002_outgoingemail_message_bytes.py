@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+def encode_messages(apps, schema_editor):
+    """Copy every queued message into the binary column as UTF-8."""
+    OutgoingEmail = apps.get_model('outbox', 'OutgoingEmail')
+    for email in OutgoingEmail.objects.only('message').iterator():
+        OutgoingEmail.objects.filter(pk=email.pk).update(
+            message_bytes=email.message.encode('utf-8'))
+
+
+def decode_messages(apps, schema_editor):
+    """Copy every queued message back into the text column."""
+    OutgoingEmail = apps.get_model('outbox', 'OutgoingEmail')
+    for email in OutgoingEmail.objects.only('message_bytes').iterator():
+        OutgoingEmail.objects.filter(pk=email.pk).update(
+            message=bytes(email.message_bytes).decode('utf-8', 'replace'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('outbox', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='outgoingemail',
+            name='message_bytes',
+            field=models.BinaryField(default=b''),
+        ),
+        migrations.AlterField(
+            model_name='outgoingemail',
+            name='message',
+            field=models.TextField(blank=True),
+        ),
+        migrations.RunPython(encode_messages, decode_messages),
+        migrations.RemoveField(
+            model_name='outgoingemail',
+            name='message',
+        ),
+        migrations.RenameField(
+            model_name='outgoingemail',
+            old_name='message_bytes',
+            new_name='message',
+        ),
+        migrations.AlterField(
+            model_name='outgoingemail',
+            name='message',
+            field=models.BinaryField(),
+        ),
+    ]
@@ -0,0 +1,50 @@
+"""Model for email waiting to be sent."""
+
+from django.db import models
+from django.utils import timezone
+from django.utils.encoding import python_2_unicode_compatible
+
+
+@python_2_unicode_compatible
+class OutgoingEmail(models.Model):
+    """A rendered message queued for the outbox sender."""
+
+    QUEUED = 'queued'
+    SENDING = 'sending'
+    SENT = 'sent'
+    FAILED = 'failed'
+    STATUS_CHOICES = (
+        (QUEUED, 'Queued'),
+        (SENDING, 'Sending'),
+        (SENT, 'Sent'),
+        (FAILED, 'Failed'),
+    )
+
+    sender = models.CharField(max_length=254)
+    recipients = models.TextField()
+    subject = models.CharField(max_length=255, blank=True)
+    message = models.BinaryField()
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES,
+                              default=QUEUED)
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=5)
+    send_after = models.DateTimeField(default=timezone.now)
+    locked_by = models.CharField(max_length=100, blank=True)
+    locked_at = models.DateTimeField(blank=True, null=True)
+    error = models.TextField(blank=True)
+    created = models.DateTimeField(default=timezone.now)
+    sent = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        """Index for senders looking for the next messages due."""
+
+        index_together = [('status', 'send_after')]
+
+    def __str__(self):
+        """String representation of OutgoingEmail."""
+        return '{} to {} ({})'.format(self.subject, self.recipient_list()[0],
+                                      self.status)
+
+    def recipient_list(self):
+        """Addresses the message goes to."""
+        return self.recipients.split('\n')
@@ -0,0 +1,212 @@
+"""Deliver queued email in batches over one reused SMTP connection.
+
+A sender claims a batch of due messages by marking them as sending, then
+hands them to the mail server one after another on the same connection,
+spaced out to stay under the configured rate. Temporary failures are
+retried with the backoff of the job queue. Permanent refusals fail the
+message at once. A broken connection puts the rest of the batch back
+without using up their attempts, which only count messages actually handed
+to the server, and the sender waits longer and longer before trying an
+unreachable server again.
+"""
+
+import smtplib
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import get_connection
+from django.db.models import F, Q
+from django.utils import timezone
+
+from jobs.queue import backoff, lease_seconds, refresh_connections, worker_name
+from outbox.models import OutgoingEmail
+
+
+SMTP_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
+
+
+def batch_size():
+    """Messages claimed at a time."""
+    return getattr(settings, 'OUTBOX_BATCH_SIZE', 50)
+
+
+def send_rate():
+    """Messages sent a second at most, or 0 for no limit."""
+    return getattr(settings, 'OUTBOX_RATE', 10)
+
+
+class Throttle(object):
+    """Space calls to ``wait`` at least ``1 / rate`` seconds apart."""
+
+    def __init__(self, rate, clock=time.time, sleep=time.sleep):
+        """Start with nothing to wait for."""
+        self.interval = 1.0 / rate if rate else 0
+        self.clock = clock
+        self.sleep = sleep
+        self.next_at = None
+
+    def wait(self):
+        """Sleep until the next call is allowed."""
+        if not self.interval:
+            return
+        now = self.clock()
+        if self.next_at is not None and self.next_at > now:
+            self.sleep(self.next_at - now)
+            now = self.next_at
+        self.next_at = now + self.interval
+
+
+def claimable(now):
+    """Filter for messages that are due or were abandoned by a sender."""
+    stale = now - timedelta(seconds=lease_seconds())
+    return (Q(status=OutgoingEmail.QUEUED, send_after__lte=now) |
+            Q(status=OutgoingEmail.SENDING, locked_at__lt=stale))
+
+
+def claim_batch(worker, size, now=None):
+    """Mark up to ``size`` due messages as sending for ``worker``."""
+    now = now or timezone.now()
+    emails = OutgoingEmail.objects.order_by('send_after', 'id')
+    ids = list(emails.filter(claimable(now)).values_list(
+        'id', flat=True)[:size])
+    if not ids:
+        return []
+    OutgoingEmail.objects.filter(claimable(now), pk__in=ids).update(
+        status=OutgoingEmail.SENDING, locked_by=worker, locked_at=now,
+        attempts=F('attempts') + 1)
+    return list(emails.filter(pk__in=ids, status=OutgoingEmail.SENDING,
+                              locked_by=worker, locked_at=now))
+
+
+def finish(email, **values):
+    """Store the outcome of a message unless another sender took it over."""
+    values['locked_at'] = None
+    return OutgoingEmail.objects.filter(
+        pk=email.pk, status=OutgoingEmail.SENDING,
+        locked_by=email.locked_by).update(**values)
+
+
+def retry(email, error):
+    """Queue a message again after a temporary failure, if it has tries."""
+    if email.attempts >= email.max_attempts:
+        return finish(email, status=OutgoingEmail.FAILED, error=error)
+    return finish(email, status=OutgoingEmail.QUEUED, error=error,
+                  send_after=timezone.now() + timedelta(
+                      seconds=backoff(email.attempts)))
+
+
+def requeue(emails, error):
+    """Put claimed messages back untried, giving back their attempts."""
+    if not emails:
+        return 0
+    return OutgoingEmail.objects.filter(
+        pk__in=[email.pk for email in emails],
+        status=OutgoingEmail.SENDING, locked_by=emails[0].locked_by).update(
+        status=OutgoingEmail.QUEUED, error=error, locked_at=None,
+        attempts=F('attempts') - 1)
+
+
+def permanent(codes):
+    """Return whether every SMTP reply code in ``codes`` is final."""
+    return all(code >= 500 for code in codes)
+
+
+def reset(backend):
+    """Drop a broken SMTP connection so the next send opens a new one."""
+    try:
+        backend.close()
+    except (smtplib.SMTPException, OSError):
+        pass
+    backend.connection = None
+
+
+def deliver(backend, email):
+    """Send one message, returning the recipients the server refused."""
+    return backend.connection.sendmail(email.sender, email.recipient_list(),
+                                       bytes(email.message))
+
+
+def send_batch(backend, emails, throttle):
+    """
+    Send claimed messages over one connection.
+
+    Returns how many went and the error that broke the connection, if any.
+    """
+    sent = 0
+    for index, email in enumerate(emails):
+        throttle.wait()
+        try:
+            if backend.connection is None:
+                backend.open()
+        except (smtplib.SMTPException, OSError) as error:
+            reset(backend)
+            requeue(emails[index:], str(error))
+            return sent, error
+        try:
+            refused = deliver(backend, email)
+        except smtplib.SMTPRecipientsRefused as error:
+            codes = [code for code, reply in error.recipients.values()]
+            if permanent(codes):
+                finish(email, status=OutgoingEmail.FAILED, error=str(error))
+            else:
+                retry(email, str(error))
+            continue
+        except smtplib.SMTPResponseException as error:
+            if permanent([error.smtp_code]):
+                finish(email, status=OutgoingEmail.FAILED, error=str(error))
+            else:
+                retry(email, str(error))
+            continue
+        except (smtplib.SMTPException, OSError) as error:
+            reset(backend)
+            retry(email, str(error))
+            requeue(emails[index + 1:], str(error))
+            return sent, error
+        finish(email, status=OutgoingEmail.SENT, sent=timezone.now(),
+               error='; '.join('{} refused with {}'.format(address, code)
+                               for address, (code, reply) in sorted(
+                                   refused.items())))
+        sent += 1
+    return sent, None
+
+
+def drain(worker=None, burst=False, poll_interval=1.0, size=None, rate=None,
+          max_batches=None):
+    """
+    Send batches of queued messages until stopped, returning how many went.
+
+    With ``burst`` the sender returns once nothing is due, or once the
+    server cannot be reached, instead of polling for more. Otherwise it
+    backs off after every batch the connection broke in, so an outage
+    costs a few reconnections rather than every message its attempts. The
+    SMTP connection is closed while idle.
+    """
+    worker = worker or worker_name()
+    size = size or batch_size()
+    throttle = Throttle(send_rate() if rate is None else rate)
+    backend = get_connection(SMTP_BACKEND, fail_silently=False)
+    sent = batches = outages = 0
+    try:
+        while max_batches is None or batches < max_batches:
+            refresh_connections()
+            emails = claim_batch(worker, size)
+            if not emails:
+                reset(backend)
+                if burst:
+                    break
+                time.sleep(poll_interval)
+                continue
+            went, error = send_batch(backend, emails, throttle)
+            sent += went
+            batches += 1
+            if error is None:
+                outages = 0
+                continue
+            outages += 1
+            if burst:
+                break
+            time.sleep(backoff(outages))
+    finally:
+        reset(backend)
+    return sent
@@ -0,0 +1,253 @@
+"""Tests for the outbox app."""
+
+import asyncore
+import smtpd
+import smtplib
+import threading
+from django.contrib.auth.models import Group
+from django.core import mail
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.six import StringIO
+from jobs.queue import backoff
+from outbox import sender
+from outbox.models import OutgoingEmail
+
+
+class FakeSMTPServer(smtpd.SMTPServer, threading.Thread):
+    """A local SMTP stand-in that keeps what it is sent."""
+
+    def __init__(self):
+        """Listen on a free local port."""
+        threading.Thread.__init__(self)
+        smtpd.SMTPServer.__init__(self, ('127.0.0.1', 0), None,
+                                  decode_data=False)
+        self.daemon = True
+        self.port = self.socket.getsockname()[1]
+        self.messages = []
+        self.connections = 0
+        self.replies = {}
+        self.stopping = threading.Event()
+
+    def handle_accepted(self, conn, addr):
+        """Count connections as they are made."""
+        self.connections += 1
+        smtpd.SMTPServer.handle_accepted(self, conn, addr)
+
+    def process_message(self, peer, mailfrom, rcpttos, data, **kwargs):
+        """Keep a message, or answer with the reply set for a recipient."""
+        for address in rcpttos:
+            if address in self.replies:
+                return self.replies[address]
+        self.messages.append((mailfrom, rcpttos, data))
+
+    def run(self):
+        """Serve until stopped."""
+        while not self.stopping.is_set():
+            asyncore.loop(timeout=0.05, count=1)
+
+    def stop(self):
+        """Stop serving and close the listening socket."""
+        self.stopping.set()
+        self.join()
+        self.close()
+
+
+def queue_mail(count, recipient='user_{}@cbt.com'):
+    """Queue ``count`` messages through the outbox backend."""
+    connection = mail.get_connection('outbox.backends.OutboxBackend')
+    messages = [mail.EmailMessage('Activate {}'.format(i), 'Welcome.',
+                                  'site@cbt.com', [recipient.format(i)])
+                for i in range(count)]
+    return connection.send_messages(messages)
+
+
+class OutboxBackendTestCase(TestCase):
+    """Test that sending mail only queues it."""
+
+    def test_messages_are_queued_not_sent(self):
+        """Test the backend stores each message with its recipients."""
+        self.assertTrue(queue_mail(3) == 3)
+        emails = OutgoingEmail.objects.order_by('id')
+        self.assertTrue(emails.count() == 3)
+        self.assertTrue(emails[0].recipient_list() == ['user_0@cbt.com'])
+        self.assertTrue(b'Subject: Activate 0' in bytes(emails[0].message))
+        self.assertTrue(emails[0].status == OutgoingEmail.QUEUED)
+
+    @override_settings(EMAIL_BACKEND='outbox.backends.OutboxBackend')
+    def test_signup_queues_activation_email(self):
+        """Test registering an account leaves its activation mail queued."""
+        Group.objects.get_or_create(name='user')
+        response = self.client.post(reverse('registration_register'), {
+            'username': 'newcomer', 'email': 'newcomer@cbt.com',
+            'password1': 'rutabega-salad', 'password2': 'rutabega-salad'})
+        self.assertTrue(response.status_code == 302)
+        email = OutgoingEmail.objects.get()
+        self.assertTrue(email.recipient_list() == ['newcomer@cbt.com'])
+        self.assertTrue(len(mail.outbox) == 0)
+
+    def test_messages_without_recipients_are_skipped(self):
+        """Test a message nobody would receive is not queued."""
+        connection = mail.get_connection('outbox.backends.OutboxBackend')
+        message = mail.EmailMessage('Nobody', 'Hi.', 'site@cbt.com', [])
+        self.assertTrue(connection.send_messages([message]) == 0)
+        self.assertTrue(OutgoingEmail.objects.count() == 0)
+
+
+class SenderTestCase(TestCase):
+    """Test draining the outbox against a local SMTP server."""
+
+    def setUp(self):
+        """Start a local SMTP server and point the sender at it."""
+        self.server = FakeSMTPServer()
+        self.server.start()
+        self.settings = override_settings(EMAIL_HOST='127.0.0.1',
+                                          EMAIL_PORT=self.server.port,
+                                          EMAIL_USE_TLS=False,
+                                          EMAIL_HOST_USER='',
+                                          EMAIL_HOST_PASSWORD='')
+        self.settings.enable()
+
+    def tearDown(self):
+        """Stop the server."""
+        self.settings.disable()
+        self.server.stop()
+
+    def test_batch_is_sent_over_one_connection(self):
+        """Test a batch of messages shares a single SMTP connection."""
+        queue_mail(5)
+        self.assertTrue(sender.drain(burst=True, size=10, rate=0) == 5)
+        self.assertTrue(len(self.server.messages) == 5)
+        self.assertTrue(self.server.connections == 1)
+        self.assertTrue(OutgoingEmail.objects.filter(
+            status=OutgoingEmail.SENT, sent__isnull=False).count() == 5)
+
+    def test_non_ascii_message_is_sent_as_rendered(self):
+        """Test encoded headers and an 8-bit body reach the server intact."""
+        connection = mail.get_connection('outbox.backends.OutboxBackend')
+        connection.send_messages([mail.EmailMessage(
+            'Café', 'Grüße aus München.', 'site@cbt.com',
+            ['user_0@cbt.com'])])
+        stored = bytes(OutgoingEmail.objects.get().message)
+        self.assertTrue(sender.drain(burst=True, rate=0) == 1)
+        data = self.server.messages[0][2]
+        body = 'Grüße aus München.'.encode('utf-8')
+        self.assertTrue(b'Content-Transfer-Encoding: 8bit' in stored)
+        self.assertTrue(b'Subject: =?utf-8?b?Q2Fmw6k=?=' in data)
+        self.assertTrue(stored.endswith(body) and data.endswith(body))
+
+    def test_messages_are_sent_in_batches(self):
+        """Test the sender claims at most a batch at a time."""
+        queue_mail(5)
+        self.assertTrue(sender.drain(burst=True, size=2, rate=0,
+                                     max_batches=2) == 4)
+        self.assertTrue(OutgoingEmail.objects.filter(
+            status=OutgoingEmail.QUEUED).count() == 1)
+
+    def test_temporary_failure_is_retried_later(self):
+        """Test a 4xx reply queues the message again with backoff."""
+        queue_mail(2)
+        self.server.replies['user_0@cbt.com'] = '451 Try again later'
+        self.assertTrue(sender.drain(burst=True, rate=0) == 1)
+        email = OutgoingEmail.objects.get(recipients='user_0@cbt.com')
+        self.assertTrue(email.status == OutgoingEmail.QUEUED)
+        self.assertTrue(email.attempts == 1)
+        self.assertTrue(email.send_after > timezone.now())
+        self.assertTrue('451' in email.error)
+
+    def test_permanent_failure_is_not_retried(self):
+        """Test a 5xx reply fails the message at once."""
+        queue_mail(1)
+        self.server.replies['user_0@cbt.com'] = '550 No such user'
+        self.assertTrue(sender.drain(burst=True, rate=0) == 0)
+        email = OutgoingEmail.objects.get()
+        self.assertTrue(email.status == OutgoingEmail.FAILED)
+        self.assertTrue(email.attempts == 1)
+
+    def test_last_attempt_fails_the_message(self):
+        """Test a message out of attempts is failed instead of retried."""
+        queue_mail(1)
+        OutgoingEmail.objects.update(attempts=4)
+        self.server.replies['user_0@cbt.com'] = '451 Try again later'
+        sender.drain(burst=True, rate=0)
+        self.assertTrue(OutgoingEmail.objects.get().status ==
+                        OutgoingEmail.FAILED)
+
+    def test_unreachable_server_puts_batch_back(self):
+        """Test a refused connection requeues the batch untried."""
+        queue_mail(3)
+        with override_settings(EMAIL_PORT=1):
+            self.assertTrue(sender.drain(burst=True, rate=0) == 0)
+        self.assertTrue(OutgoingEmail.objects.filter(
+            status=OutgoingEmail.QUEUED, attempts=0,
+            send_after__lte=timezone.now()).count() == 3)
+
+    def test_outage_backs_off_without_using_attempts(self):
+        """Test a sender waits longer each time the server is down."""
+        queue_mail(2)
+        sleeps = []
+        original = sender.time.sleep
+        sender.time.sleep = sleeps.append
+        try:
+            with override_settings(EMAIL_PORT=1):
+                sender.drain(rate=0, max_batches=3)
+        finally:
+            sender.time.sleep = original
+        self.assertTrue(sleeps == [backoff(1), backoff(2), backoff(3)])
+        self.assertTrue(OutgoingEmail.objects.filter(
+            status=OutgoingEmail.QUEUED, attempts=0).count() == 2)
+
+    def test_dropped_connection_spends_one_attempt(self):
+        """Test only the message being sent when the link broke is retried."""
+        queue_mail(3)
+        original = sender.deliver
+
+        def drop_second(backend, email):
+            """Lose the connection while sending the second message."""
+            if email.recipients == 'user_1@cbt.com':
+                raise smtplib.SMTPServerDisconnected('Connection lost')
+            return original(backend, email)
+
+        sender.deliver = drop_second
+        try:
+            self.assertTrue(sender.drain(burst=True, rate=0) == 1)
+        finally:
+            sender.deliver = original
+        attempts = dict(OutgoingEmail.objects.filter(
+            status=OutgoingEmail.QUEUED).values_list('recipients',
+                                                      'attempts'))
+        self.assertTrue(attempts == {'user_1@cbt.com': 1,
+                                     'user_2@cbt.com': 0})
+
+    def test_command_sends_queued_mail(self):
+        """Test send_outbox drains the outbox and reports the count."""
+        queue_mail(2)
+        out = StringIO()
+        call_command('send_outbox', '--burst', '--rate', '0', stdout=out)
+        self.assertTrue('Sent 2 emails.' in out.getvalue())
+
+
+class ThrottleTestCase(TestCase):
+    """Test spacing out sends."""
+
+    def test_sends_are_spaced_to_the_rate(self):
+        """Test waits make up the time left until the next slot."""
+        now, slept = [100.0], []
+
+        def sleep(seconds):
+            """Pretend to sleep."""
+            slept.append(seconds)
+            now[0] += seconds
+
+        throttle = sender.Throttle(4, clock=lambda: now[0], sleep=sleep)
+        for i in range(3):
+            throttle.wait()
+        self.assertTrue(slept == [0.25, 0.25])
+
+    def test_no_rate_never_waits(self):
+        """Test a rate of zero sends as fast as possible."""
+        throttle = sender.Throttle(0, sleep=self.fail)
+        throttle.wait()
+        throttle.wait()
@@ -0,0 +1,78 @@
+"""Move long finished todos out of the live todo table.
+
+Todos completed before a cutoff are copied to ``ArchivedTodo`` and deleted
+from ``Todo`` a batch at a time, each batch in its own transaction, so the
+live table and its indexes only grow with the open work of a profile and
+not with its whole history.
+
+Finished todos no longer count towards summaries and were taken out of
+current plans when they were completed, so the rows are deleted with one
+statement instead of loading every todo to send delete signals.
+"""
+
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connections, router, transaction
+from django.utils import timezone
+
+from neuropy.cache import bump_user_version
+from todo.models import ArchivedTodo, PlanEntry, Todo
+from userprofile.models import Profile
+
+
+ARCHIVE_FIELDS = ('id', 'title', 'description', 'date', 'duration', 'ease',
+                  'priority', 'owner_id', 'completed')
+DEFAULT_BATCH_SIZE = 1000
+
+
+def archive_after_days():
+    """Days a completed todo stays in the live table."""
+    return getattr(settings, 'TODO_ARCHIVE_AFTER_DAYS', 30)
+
+
+def delete_todos(ids):
+    """Delete todo rows by id without loading them or sending signals."""
+    connection = connections[router.db_for_write(Todo)]
+    table = connection.ops.quote_name(Todo._meta.db_table)
+    with connection.cursor() as cursor:
+        cursor.execute('DELETE FROM {} WHERE id IN ({})'.format(
+            table, ', '.join(['%s'] * len(ids))), ids)
+
+
+def archive_batch(cutoff, batch_size=DEFAULT_BATCH_SIZE, now=None):
+    """Archive up to ``batch_size`` todos completed before ``cutoff``."""
+    now = now or timezone.now()
+    with transaction.atomic():
+        rows = list(Todo.objects.finished_before(cutoff).select_for_update()
+                    .order_by('id').values(*ARCHIVE_FIELDS)[:batch_size])
+        if not rows:
+            return 0
+        ids = [row['id'] for row in rows]
+        ArchivedTodo.objects.bulk_create(
+            [ArchivedTodo(archived=now, **row) for row in rows])
+        PlanEntry.objects.filter(todo_id__in=ids).delete()
+        delete_todos(ids)
+    owners = set(row['owner_id'] for row in rows) - set([None])
+    for user_id in Profile.objects.filter(pk__in=owners).values_list(
+            'user_id', flat=True):
+        bump_user_version(user_id)
+    return len(rows)
+
+
+def archive_todos(days=None, batch_size=DEFAULT_BATCH_SIZE, now=None):
+    """
+    Archive every todo completed more than ``days`` days ago.
+
+    ``days`` defaults to ``archive_after_days()``. Returns the number of
+    todos archived.
+    """
+    now = now or timezone.now()
+    days = archive_after_days() if days is None else days
+    cutoff = now - timedelta(days=days)
+    archived = 0
+    while True:
+        moved = archive_batch(cutoff, batch_size, now)
+        archived += moved
+        if moved < batch_size:
+            return archived
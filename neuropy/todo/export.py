@@ -0,0 +1,66 @@
+"""Export of todos as CSV or JSON lines.
+
+Rows are read in primary key order a chunk at a time and turned into text
+one line at a time, so the same generators can feed a streaming response
+or a file written by a background job without holding every todo.
+"""
+
+import csv
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+from todo.models import Todo
+from todo.pagination import iter_values
+
+
+EXPORT_FIELDS = ('id', 'title', 'description', 'date', 'duration', 'ease',
+                 'priority', 'completed')
+CONTENT_TYPES = {
+    'csv': 'text/csv',
+    'json': 'application/json',
+}
+CHUNK_SIZE = 1000
+
+
+class Echo(object):
+    """File-like object that hands back what is written to it."""
+
+    def write(self, value):
+        """Return the value instead of storing it."""
+        return value
+
+
+def export_rows(profile, chunk_size=CHUNK_SIZE):
+    """Yield the ``EXPORT_FIELDS`` of every todo of ``profile``."""
+    return iter_values(Todo.objects.filter(owner=profile), EXPORT_FIELDS,
+                       chunk_size)
+
+
+def csv_lines(rows):
+    """Yield a header and one CSV line per row."""
+    writer = csv.writer(Echo())
+    yield writer.writerow(EXPORT_FIELDS)
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def json_lines(rows):
+    """Yield a JSON array one object at a time."""
+    separator = '[\n'
+    for row in rows:
+        yield separator + json.dumps(dict(zip(EXPORT_FIELDS, row)),
+                                     cls=DjangoJSONEncoder)
+        separator = ',\n'
+    yield '[]\n' if separator == '[\n' else '\n]\n'
+
+
+WRITERS = {
+    'csv': csv_lines,
+    'json': json_lines,
+}
+
+
+def export_lines(profile, fmt, chunk_size=CHUNK_SIZE):
+    """Yield the lines of an export of ``profile``'s todos in ``fmt``."""
+    return WRITERS[fmt](export_rows(profile, chunk_size))
@@ -0,0 +1,128 @@
+"""iCalendar feeds of a profile's stored plans.
+
+Feeds are fetched by calendar clients that cannot log in, so each profile
+gets a URL carrying a signed token instead. Tokens are signed with the
+profile's feed key, so resetting the key revokes a leaked URL. The ETag of
+a feed is derived from the ids and versions of the plans in it, which lets
+a poll be answered from the plan table alone. Plans are bumped whenever a
+todo they list changes, including its title and description.
+"""
+
+import hashlib
+
+from django.core import signing
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.crypto import get_random_string
+
+from todo.models import Plan, PlanEntry
+from userprofile.models import Profile
+
+
+FEED_SALT = 'todo.feed'
+PRODUCT_ID = '-//neuropy//plans//EN'
+LINE_OCTETS = 75
+
+
+def feed_signer(feed_key):
+    """Signer for the feed tokens of a profile with ``feed_key``."""
+    return signing.Signer(salt=FEED_SALT + feed_key)
+
+
+def feed_token(profile):
+    """Return the signed token naming a profile's feed."""
+    return feed_signer(profile.feed_key).sign(str(profile.pk))
+
+
+def token_profile_id(token):
+    """Return the profile id a token names, raising BadSignature."""
+    value = token.rpartition(':')[0]
+    if not value.isdigit():
+        raise signing.BadSignature('Invalid feed token.')
+    feed_key = Profile.objects.filter(pk=int(value)).values_list(
+        'feed_key', flat=True).first()
+    if feed_key is None:
+        raise signing.BadSignature('No such profile.')
+    return int(feed_signer(feed_key).unsign(token))
+
+
+def reset_feed(profile):
+    """Give a profile a new feed key, revoking every earlier feed URL."""
+    profile.feed_key = get_random_string(32)
+    profile.save(update_fields=['feed_key'])
+
+
+def feed_url(profile):
+    """Path of a profile's calendar feed."""
+    return reverse('plan-feed', args=[feed_token(profile)])
+
+
+def feed_plans(profile_id, now=None):
+    """Plans of today and later that a profile's feed lists."""
+    now = now or timezone.now()
+    return Plan.objects.filter(owner_id=profile_id,
+                               day__gte=timezone.localtime(now).date())
+
+
+def feed_etag(profile_id, now=None):
+    """Strong ETag for the plans currently in a profile's feed."""
+    versions = feed_plans(profile_id, now).order_by('day').values_list(
+        'id', 'version')
+    digest = hashlib.sha1(str(profile_id).encode('utf-8'))
+    for plan_id, version in versions:
+        digest.update('|{}:{}'.format(plan_id, version).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def escape(value):
+    """Escape an iCalendar text value."""
+    return (value.replace('\\', '\\\\').replace(';', '\\;')
+            .replace(',', '\\,').replace('\r\n', '\\n').replace('\n', '\\n'))
+
+
+def fold(line):
+    """Fold a content line into CRLF terminated lines of 75 octets."""
+    encoded = line.encode('utf-8')
+    if len(encoded) <= LINE_OCTETS:
+        return line + '\r\n'
+    parts, start, limit = [], 0, LINE_OCTETS
+    while start < len(encoded):
+        end = min(start + limit, len(encoded))
+        while end < len(encoded) and encoded[end] & 0xC0 == 0x80:
+            end -= 1
+        parts.append(encoded[start:end].decode('utf-8'))
+        start, limit = end, LINE_OCTETS - 1
+    return '\r\n '.join(parts) + '\r\n'
+
+
+def stamp(value):
+    """Format an aware datetime as a UTC iCalendar date-time."""
+    return value.astimezone(timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+
+
+def feed_lines(profile_id, host, now=None):
+    """Yield the feed of a profile one VEVENT at a time."""
+    yield fold('BEGIN:VCALENDAR')
+    yield fold('VERSION:2.0')
+    yield fold('PRODID:' + PRODUCT_ID)
+    yield fold('CALSCALE:GREGORIAN')
+    entries = PlanEntry.objects.filter(
+        plan__in=feed_plans(profile_id, now)).order_by('start')
+    for todo_id, day, generated, start, end, title, description in (
+            entries.values_list('todo', 'plan__day', 'plan__generated',
+                                'start', 'end', 'todo__title',
+                                'todo__description').iterator()):
+        event = [
+            'BEGIN:VEVENT',
+            'UID:todo-{}-{}@{}'.format(todo_id, day.strftime('%Y%m%d'),
+                                       host),
+            'DTSTAMP:' + stamp(generated),
+            'DTSTART:' + stamp(start),
+            'DTEND:' + stamp(end),
+            'SUMMARY:' + escape(title),
+        ]
+        if description:
+            event.append('DESCRIPTION:' + escape(description))
+        event.append('END:VEVENT')
+        yield ''.join(fold(line) for line in event)
+    yield fold('END:VCALENDAR')
@@ -0,0 +1,186 @@
+"""Bulk import of todos from CSV or JSON streams.
+
+Rows are read incrementally, validated a batch at a time with NumPy and
+inserted with ``bulk_create`` inside a single transaction. Rows that fail
+validation are reported back and skipped without aborting the import.
+"""
+
+import codecs
+import csv
+import json
+from collections import namedtuple
+
+import numpy as np
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from neuropy.cache import bump_user_version
+from todo.models import Todo
+from todo.summary import count_created
+
+
+IMPORT_FIELDS = ('title', 'description', 'date', 'duration', 'ease',
+                 'priority')
+INTEGER_FIELDS = ('duration', 'ease', 'priority')
+DEFAULT_BATCH_SIZE = 1000
+READ_SIZE = 64 * 1024
+
+EASE_VALUES = np.array([value for value, label in Todo.EASE_CHOICES])
+PRIORITY_VALUES = np.array([value for value, label in Todo.PRIORITY_CHOICES])
+TITLE_LENGTH = Todo._meta.get_field('title').max_length
+
+ImportResult = namedtuple('ImportResult', 'created errors')
+
+
+def read_csv(stream):
+    """Yield a dict per row of a UTF-8 CSV byte stream with a header."""
+    return csv.DictReader(codecs.getreader('utf-8')(stream))
+
+
+def read_json(stream):
+    """
+    Yield objects from a JSON array or JSON lines byte stream.
+
+    Objects are decoded as soon as they have been read, so the whole
+    document is never held in memory.
+    """
+    decoder = json.JSONDecoder()
+    reader = codecs.getreader('utf-8')(stream)
+    buffer = ''
+    while True:
+        chunk = reader.read(READ_SIZE)
+        buffer += chunk
+        position = 0
+        while True:
+            while position < len(buffer) and buffer[position] in '[], \t\r\n':
+                position += 1
+            if position == len(buffer):
+                break
+            try:
+                value, position = decoder.raw_decode(buffer, position)
+            except ValueError:
+                if not chunk:
+                    raise ValueError('Invalid JSON near: {!r}'.format(
+                        buffer[position:position + 40]))
+                break
+            yield value
+        buffer = buffer[position:]
+        if not chunk:
+            return
+
+
+READERS = {
+    'csv': read_csv,
+    'json': read_json,
+}
+
+
+def parse_row(row):
+    """Convert a raw row to Todo field values, raising ValueError."""
+    if not isinstance(row, dict):
+        raise ValueError('Row is not an object.')
+    values = {}
+    for name in IMPORT_FIELDS:
+        value = row.get(name)
+        if value is None or value == '':
+            values[name] = Todo._meta.get_field(name).get_default()
+        elif name in INTEGER_FIELDS:
+            try:
+                values[name] = int(value)
+            except (TypeError, ValueError):
+                raise ValueError('{} must be a whole number.'.format(name))
+        elif name == 'date':
+            parsed = parse_datetime(str(value))
+            if parsed is None:
+                raise ValueError('date must be an ISO 8601 datetime.')
+            if timezone.is_naive(parsed):
+                parsed = timezone.make_aware(parsed)
+            values[name] = parsed
+        else:
+            values[name] = str(value)
+    if len(values['title']) > TITLE_LENGTH:
+        raise ValueError('title is longer than {} characters.'.format(
+            TITLE_LENGTH))
+    return values
+
+
+def validate_batch(rows, first_row):
+    """
+    Validate a batch of rows numbered from ``first_row``.
+
+    Returns the valid rows as field dicts and a list of
+    ``(row number, message)`` errors. Choice and range checks run over the
+    whole batch at once.
+    """
+    parsed, numbers, errors = [], [], []
+    for number, row in enumerate(rows, first_row):
+        try:
+            parsed.append(parse_row(row))
+            numbers.append(number)
+        except ValueError as error:
+            errors.append((number, str(error)))
+    if not parsed:
+        return [], errors
+
+    def column(name):
+        """Array of one integer field across the batch."""
+        return np.array([values[name] for values in parsed], dtype=np.int64)
+
+    checks = (
+        (~np.in1d(column('ease'), EASE_VALUES),
+         'ease is not a valid choice.'),
+        (~np.in1d(column('priority'), PRIORITY_VALUES),
+         'priority is not a valid choice.'),
+        (column('duration') < 1, 'duration must be positive.'),
+    )
+    invalid = np.zeros(len(parsed), dtype=bool)
+    for failed, message in checks:
+        for index in np.flatnonzero(failed & ~invalid):
+            errors.append((numbers[index], message))
+        invalid |= failed
+    errors.sort()
+    valid = [values for values, bad in zip(parsed, invalid) if not bad]
+    return valid, errors
+
+
+def batches(rows, size):
+    """Yield lists of up to ``size`` rows."""
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def import_todos(profile, rows, batch_size=DEFAULT_BATCH_SIZE):
+    """Insert ``rows`` as todos owned by ``profile`` in one transaction."""
+    created, errors = 0, []
+    first_row = 1
+    with transaction.atomic():
+        for batch in batches(rows, max(batch_size, 1)):
+            valid, batch_errors = validate_batch(batch, first_row)
+            todos = [Todo(owner=profile, **values) for values in valid]
+            Todo.objects.bulk_create(todos)
+            count_created(todos)
+            created += len(valid)
+            errors.extend(batch_errors)
+            first_row += len(batch)
+    if created:
+        bump_user_version(profile.user_id)
+    return ImportResult(created, errors)
+
+
+def import_stream(profile, stream, fmt, batch_size=DEFAULT_BATCH_SIZE):
+    """Import a CSV or JSON byte stream, raising ValueError if unreadable."""
+    if fmt not in READERS:
+        raise ValueError('Unknown format {!r}.'.format(fmt))
+    try:
+        return import_todos(profile, READERS[fmt](stream), batch_size)
+    except UnicodeDecodeError:
+        raise ValueError('The file is not UTF-8 encoded.')
+    except csv.Error as error:
+        raise ValueError('Invalid CSV: {}'.format(error))
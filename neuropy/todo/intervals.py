@@ -0,0 +1,59 @@
+"""Sorted-array interval index for busy time.
+
+Intervals are half-open ``[start, end)`` pairs of epoch seconds kept sorted
+by start, together with a running maximum of their ends. Both arrays are
+monotonic, so the candidates for an overlap query are found with two binary
+searches and only the intervals in between are looked at.
+"""
+
+import numpy as np
+
+
+class IntervalIndex(object):
+    """Answer overlap and free window queries over a set of intervals."""
+
+    def __init__(self, starts, ends):
+        """Index intervals given as arrays of start and end seconds."""
+        starts = np.asarray(starts, dtype=np.float64)
+        ends = np.asarray(ends, dtype=np.float64)
+        order = np.argsort(starts, kind='mergesort')
+        self.starts = starts[order]
+        self.ends = ends[order]
+        self.reach = (np.maximum.accumulate(self.ends) if len(self.ends)
+                      else self.ends)
+
+    def __len__(self):
+        """Number of intervals indexed."""
+        return len(self.starts)
+
+    def candidates(self, start, end):
+        """Index range that holds every interval overlapping the window."""
+        first = int(np.searchsorted(self.reach, start, side='right'))
+        last = int(np.searchsorted(self.starts, end, side='left'))
+        return first, max(first, last)
+
+    def overlapping(self, start, end):
+        """Return the start and end arrays of intervals overlapping."""
+        first, last = self.candidates(start, end)
+        hit = self.ends[first:last] > start
+        return self.starts[first:last][hit], self.ends[first:last][hit]
+
+    def overlaps(self, start, end):
+        """Return whether anything overlaps the window."""
+        first, last = self.candidates(start, end)
+        return bool((self.ends[first:last] > start).any())
+
+    def free_windows(self, start, end):
+        """Return the ``(start, end)`` gaps between intervals in a window."""
+        starts, ends = self.overlapping(start, end)
+        windows = []
+        cursor = start
+        for busy_start, busy_end in zip(starts, ends):
+            if busy_start > cursor:
+                windows.append((cursor, min(busy_start, end)))
+            cursor = max(cursor, busy_end)
+            if cursor >= end:
+                break
+        if cursor < end:
+            windows.append((cursor, end))
+        return windows
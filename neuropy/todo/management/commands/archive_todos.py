@@ -0,0 +1,29 @@
+"""Move long completed todos to the archive table."""
+
+from django.core.management.base import BaseCommand
+
+from todo.archive import DEFAULT_BATCH_SIZE, archive_todos
+
+
+class Command(BaseCommand):
+    """Archive completed todos in batched transactions."""
+
+    help = ('Move todos completed more than --days days ago out of the live '
+            'todo table into the archive.')
+
+    def add_arguments(self, parser):
+        """Command line options."""
+        parser.add_argument(
+            '--days', type=int, default=None,
+            help='Archive todos completed this many days ago or earlier; '
+                 'TODO_ARCHIVE_AFTER_DAYS by default.')
+        parser.add_argument(
+            '--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+            help='Todos moved per transaction.')
+
+    def handle(self, *args, **options):
+        """Archive and report how many todos were moved."""
+        archived = archive_todos(options['days'],
+                                 max(options['batch_size'], 1))
+        self.stdout.write(self.style.SUCCESS(
+            'Archived {} todos.'.format(archived)))
@@ -0,0 +1,215 @@
+"""Load test the main user flows and write machine readable results.
+
+Unless ``--in-place`` is given, every configured database is swapped for a
+throwaway test database, replicas becoming mirrors of the primary, the way
+the test runner does it. The cache is always a private in-memory one, so
+clearing it never touches a shared cache.
+"""
+
+import json
+import random
+import resource
+import sys
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+
+import django
+import numpy as np
+from django.conf import settings
+from django.contrib.auth.models import Group
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.test import Client
+from django.test.runner import DiscoverRunner
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from todo import scheduler
+from todo.models import Todo
+from todo.summary import count_created
+from todo.tests import TodoFactory, UserFactory
+from userprofile.models import Profile, USER_GROUP_NAME
+from userprofile.provisioning import provision_users
+
+
+PERCENTILES = (50, 95, 99)
+BENCHMARK_CACHE = {
+    'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    'LOCATION': 'benchmark',
+}
+
+
+def peak_rss_kb():
+    """Peak resident set size of this process in kilobytes."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+
+@contextmanager
+def capture_queries():
+    """Capture the queries run on every database, yielding the captures."""
+    captures = [CaptureQueriesContext(connections[alias])
+                for alias in connections]
+    for captured in captures:
+        captured.__enter__()
+    try:
+        yield captures
+    finally:
+        for captured in reversed(captures):
+            captured.__exit__(None, None, None)
+
+
+class Command(BaseCommand):
+    """Seed users and todos in bulk, then time each flow."""
+
+    help = ('Seed users and todos with the test factories, time signup, '
+            'profile views and edits, todo listing, plan generation and '
+            'exports, and write percentiles as JSON.')
+
+    def add_arguments(self, parser):
+        """Command line options."""
+        parser.add_argument('--users', type=int, default=100,
+                            help='Users to seed.')
+        parser.add_argument('--todos', type=int, default=50,
+                            help='Todos to seed per user.')
+        parser.add_argument('--requests', type=int, default=50,
+                            help='Timed runs per scenario.')
+        parser.add_argument('--output',
+                            help='File to write results to instead of '
+                                 'standard output.')
+        parser.add_argument('--in-place', action='store_true',
+                            help='Seed the configured database instead of '
+                                 'a throwaway test database.')
+
+    def handle(self, *args, **options):
+        """Run the benchmark, in throwaway databases unless asked not to."""
+        runner = DiscoverRunner(verbosity=0, interactive=False)
+        old_config = None
+        if not options['in_place']:
+            old_config = runner.setup_databases()
+        caches = dict((alias, BENCHMARK_CACHE) for alias in settings.CACHES)
+        try:
+            with override_settings(ALLOWED_HOSTS=['testserver'],
+                                   CACHES=caches):
+                results = self.run(options)
+        finally:
+            if old_config is not None:
+                runner.teardown_databases(old_config)
+        output = json.dumps(results, indent=2, sort_keys=True)
+        if options['output']:
+            with open(options['output'], 'w') as result_file:
+                result_file.write(output + '\n')
+        else:
+            self.stdout.write(output)
+
+    def run(self, options):
+        """Seed data and time every scenario."""
+        cache.clear()
+        Group.objects.get_or_create(name=USER_GROUP_NAME)
+        started = time.time()
+        profiles = self.seed(options['users'], options['todos'])
+        seconds = time.time() - started
+        runs = max(options['requests'], 1)
+        scenarios = (
+            ('signup', self.signup),
+            ('profile_view', self.profile_view),
+            ('edit_profile', self.edit_profile),
+            ('todo_list', self.todo_list),
+            ('plan_generation', self.plan_generation),
+            ('export_csv', self.export_csv),
+        )
+        return {
+            'django': django.get_version(),
+            'users': options['users'],
+            'todos_per_user': options['todos'],
+            'seed_seconds': round(seconds, 3),
+            'scenarios': dict(
+                (name, self.measure(scenario, profiles, runs))
+                for name, scenario in scenarios),
+            'peak_rss_kb': peak_rss_kb(),
+            'timestamp': timezone.now().isoformat(),
+        }
+
+    def seed(self, users, todos):
+        """Create users and their todos in bulk, returning the profiles."""
+        accounts = [{'username': user.username, 'email': user.email}
+                    for user in UserFactory.build_batch(users)]
+        provision_users(accounts)
+        profiles = list(Profile.objects.select_related('user').filter(
+            user__username__in=[account['username']
+                                for account in accounts]))
+        now = timezone.now()
+        for profile in profiles:
+            batch = TodoFactory.build_batch(todos, owner=profile)
+            for todo in batch:
+                todo.priority = random.randint(1, 4)
+                todo.ease = random.randint(1, 3)
+                todo.duration = random.randint(5, 120)
+                todo.date = now + timedelta(hours=random.randint(1, 240))
+            Todo.objects.bulk_create(batch)
+            count_created(batch)
+        return profiles
+
+    def measure(self, scenario, profiles, runs):
+        """Time a scenario, returning percentiles and queries per run."""
+        latencies, queries = [], []
+        for run in range(runs):
+            profile = profiles[run % len(profiles)] if profiles else None
+            client = Client()
+            if profile is not None:
+                client.force_login(profile.user)
+            with capture_queries() as captures:
+                started = time.time()
+                scenario(client, profile)
+                latencies.append((time.time() - started) * 1000)
+            queries.append(sum(len(captured) for captured in captures))
+        result = dict(
+            ('p{}_ms'.format(percentile), round(value, 3))
+            for percentile, value in zip(
+                PERCENTILES, np.percentile(latencies, PERCENTILES)))
+        result.update({
+            'runs': runs,
+            'mean_ms': round(float(np.mean(latencies)), 3),
+            'queries_per_request': float(np.mean(queries)),
+        })
+        return result
+
+    def signup(self, client, profile):
+        """Create a user through build_profile."""
+        UserFactory.create()
+
+    def profile_view(self, client, profile):
+        """Render the profile page."""
+        client.get(reverse('profile'))
+
+    def edit_profile(self, client, profile):
+        """Load and submit the edit profile form."""
+        client.get(reverse('edit-profile'))
+        client.post(reverse('edit-profile'), {
+            'First Name': 'Bench',
+            'Last Name': 'Mark',
+            'Email': profile.user.email or 'bench@cbt.com',
+            'active_period_start': '08:00:00',
+            'active_period_end': '22:00:00',
+            'peak_period': random.choice(Profile.PEAK_PERIOD_CHOICES)[0],
+            'dose_time': '08:00:00',
+        })
+
+    def todo_list(self, client, profile):
+        """Fetch the first page of todos by priority."""
+        client.get(reverse('todo-list'), {'order': 'priority'})
+
+    def plan_generation(self, client, profile):
+        """Plan tomorrow for the profile."""
+        now = timezone.now()
+        scheduler.plan_day(profile, timezone.localtime(now).date() +
+                           timedelta(days=1), now)
+
+    def export_csv(self, client, profile):
+        """Stream the CSV export to the end."""
+        response = client.get(reverse('todo-export', args=['csv']))
+        for chunk in response.streaming_content:
+            pass
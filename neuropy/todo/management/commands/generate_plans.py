@@ -0,0 +1,110 @@
+"""Generate the next day's plan for every profile."""
+
+import multiprocessing
+import time
+from datetime import datetime, timedelta
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.utils import timezone
+
+from todo import scheduler
+from userprofile.models import Profile
+
+
+def init_worker():
+    """Make sure Django is set up in a pool process."""
+    django.setup()
+
+
+def plan_profile(task):
+    """Schedule one profile; runs in a pool process without the database."""
+    profile_id, curve, todos, busy, day, now = task
+    return profile_id, scheduler.schedule_day(
+        todos, curve, day, now, scheduler.busy_slots(busy, day))
+
+
+class Command(BaseCommand):
+    """Build and store day plans for all profiles in chunks."""
+
+    help = "Generate the next day's plan for every profile."
+
+    def add_arguments(self, parser):
+        """Command line options."""
+        parser.add_argument(
+            '--day',
+            help='Day to plan as YYYY-MM-DD. Defaults to tomorrow.')
+        parser.add_argument(
+            '--processes', type=int, default=multiprocessing.cpu_count(),
+            help='Scoring processes to use; 1 scores in this process.')
+        parser.add_argument(
+            '--chunk-size', type=int, default=500,
+            help='Profiles loaded, scored and written per chunk.')
+        parser.add_argument(
+            '--force', action='store_true',
+            help='Regenerate plans that already exist for the day. Without '
+                 'this a rerun resumes where an interrupted run stopped.')
+
+    def handle(self, *args, **options):
+        """Stream profiles, score them on the pool and bulk-write plans."""
+        now = timezone.now()
+        if options['day']:
+            try:
+                day = datetime.strptime(options['day'], '%Y-%m-%d').date()
+            except ValueError:
+                raise CommandError('--day must be given as YYYY-MM-DD.')
+        else:
+            day = timezone.localtime(now).date() + timedelta(days=1)
+        chunk_size = max(options['chunk_size'], 1)
+
+        profiles = Profile.objects.order_by('pk')
+        if not options['force']:
+            profiles = profiles.exclude(plans__day=day)
+
+        pool = None
+        if options['processes'] > 1:
+            connections.close_all()
+            pool = multiprocessing.Pool(options['processes'],
+                                        initializer=init_worker)
+        started = time.time()
+        done = 0
+        try:
+            chunk = []
+            for profile in profiles.iterator():
+                chunk.append(profile)
+                if len(chunk) == chunk_size:
+                    done += self.plan_chunk(chunk, day, now, pool)
+                    self.report(done, started)
+                    chunk = []
+            if chunk:
+                done += self.plan_chunk(chunk, day, now, pool)
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+        self.report(done, started, final=True)
+
+    def plan_chunk(self, profiles, day, now, pool):
+        """Plan and store one chunk of profiles, returning how many."""
+        profile_ids = [p.pk for p in profiles]
+        todos = scheduler.load_todos_by_owner(profile_ids)
+        busy = scheduler.load_busy_by_owner(profile_ids, day)
+        tasks = [(p.pk, scheduler.energy_curve(p), todos[p.pk], busy[p.pk],
+                  day, now) for p in profiles]
+        if pool is None:
+            results = map(plan_profile, tasks)
+        else:
+            results = pool.imap_unordered(plan_profile, tasks, chunksize=16)
+        scheduler.store_plans(day, dict(results))
+        return len(profiles)
+
+    def report(self, done, started, final=False):
+        """Write progress and throughput."""
+        elapsed = max(time.time() - started, 1e-6)
+        message = '{} {} profiles in {:.1f}s ({:.1f} profiles/sec)'.format(
+            'Planned' if final else 'Progress:', done, elapsed,
+            done / elapsed)
+        if final:
+            message = self.style.SUCCESS(message)
+        self.stdout.write(message)
@@ -0,0 +1,45 @@
+"""Import todos for a user from a CSV or JSON file."""
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from todo.importer import DEFAULT_BATCH_SIZE, READERS, import_stream
+
+
+class Command(BaseCommand):
+    """Bulk import a file of todos into a user's profile."""
+
+    help = 'Import todos for a user from a CSV or JSON file.'
+
+    def add_arguments(self, parser):
+        """Command line options."""
+        parser.add_argument('username', help='User to import todos for.')
+        parser.add_argument('path', help='CSV or JSON file to import.')
+        parser.add_argument(
+            '--format', choices=sorted(READERS),
+            help='File format. Defaults to the file extension.')
+        parser.add_argument(
+            '--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+            help='Rows validated and inserted per batch.')
+
+    def handle(self, *args, **options):
+        """Run the import and list rows that were skipped."""
+        try:
+            profile = User.objects.get(username=options['username']).profile
+        except User.DoesNotExist:
+            raise CommandError('No user named {!r}.'.format(
+                options['username']))
+        fmt = options['format'] or options['path'].rsplit('.', 1)[-1].lower()
+        if fmt not in READERS:
+            raise CommandError('Use --format to give the file format.')
+        try:
+            with open(options['path'], 'rb') as stream:
+                result = import_stream(profile, stream, fmt,
+                                       options['batch_size'])
+        except (IOError, ValueError) as error:
+            raise CommandError(str(error))
+        for row, message in result.errors:
+            self.stderr.write('Row {}: {}'.format(row, message))
+        self.stdout.write(self.style.SUCCESS(
+            'Imported {} todos, skipped {} rows.'.format(
+                result.created, len(result.errors))))
@@ -0,0 +1,18 @@
+"""Rebuild the per-profile todo counters from the todo table."""
+
+from django.core.management.base import BaseCommand
+
+from todo.summary import rebuild_summaries
+
+
+class Command(BaseCommand):
+    """Recount every profile's todos in one grouped query."""
+
+    help = ("Rebuild every profile's todo counters from the todo table, for "
+            "instance after todos were changed with raw SQL.")
+
+    def handle(self, *args, **options):
+        """Recount and report how many summaries were written."""
+        written = rebuild_summaries()
+        self.stdout.write(self.style.SUCCESS(
+            'Rebuilt {} todo summaries.'.format(written)))
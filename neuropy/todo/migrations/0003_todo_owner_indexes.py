@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.5 on 2026-10-18 20:11
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('userprofile', '0001_initial'),
+        ('todo', '0002_plan'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='todo',
+            index_together=set([('owner', 'date'), ('owner', 'priority', 'date')]),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.5 on 2026-10-18 20:25
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('todo', '0003_todo_owner_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='plan',
+            name='occupancy',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+    ]
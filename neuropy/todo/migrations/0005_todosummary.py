@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.5 on 2026-10-18 20:30
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('userprofile', '0002_busyblock'),
+        ('todo', '0004_plan_occupancy'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TodoSummary',
+            fields=[
+                ('owner', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='todo_summary', serialize=False, to='userprofile.Profile')),
+                ('total', models.IntegerField(default=0)),
+                ('total_duration', models.IntegerField(default=0)),
+                ('priority_1', models.IntegerField(default=0)),
+                ('priority_2', models.IntegerField(default=0)),
+                ('priority_3', models.IntegerField(default=0)),
+                ('priority_4', models.IntegerField(default=0)),
+                ('ease_1', models.IntegerField(default=0)),
+                ('ease_2', models.IntegerField(default=0)),
+                ('ease_3', models.IntegerField(default=0)),
+            ],
+        ),
+    ]
@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.5 on 2026-10-18 20:41
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('userprofile', '0003_profile_medication_half_life'),
+        ('todo', '0005_todosummary'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedTodo',
+            fields=[
+                ('id', models.IntegerField(primary_key=True, serialize=False)),
+                ('title', models.CharField(blank=True, max_length=255)),
+                ('description', models.TextField(blank=True)),
+                ('date', models.DateTimeField(blank=True, null=True)),
+                ('duration', models.PositiveIntegerField(default=1)),
+                ('ease', models.PositiveIntegerField(choices=[(1, 'Easy'), (2, 'Medium'), (3, 'Difficult')], default=1)),
+                ('priority', models.PositiveIntegerField(choices=[(1, 'Now'), (2, 'Urgent'), (3, 'Semi Urgent'), (4, 'Non Urgent')], default=4)),
+                ('completed', models.DateTimeField()),
+                ('archived', models.DateTimeField(default=django.utils.timezone.now)),
+                ('owner', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='archived_todos', to='userprofile.Profile')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='todo',
+            name='completed',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AlterIndexTogether(
+            name='todo',
+            index_together=set([('owner', 'completed', 'date'), ('owner', 'completed', 'priority', 'date')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='archivedtodo',
+            index_together=set([('owner', 'completed')]),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.5 on 2026-10-18 20:54
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('userprofile', '0003_profile_medication_half_life'),
+        ('todo', '0006_todo_completion'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='todo',
+            index_together=set([('owner', 'completed', 'date', 'id'), ('owner', 'completed', 'priority', 'date', 'id')]),
+        ),
+    ]
@@ -1,8 +1,24 @@
 """Model for users todos."""
 
-from django.db import models
+from django.db import models, router, transaction
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+from django.utils import timezone
 from django.utils.encoding import python_2_unicode_compatible
-from userprofile.models import Profile
+from neuropy.cache import bump_user_version
+from userprofile.models import BusyBlock, Profile, busy_blocks_replaced
+
+
+class TodoQuerySet(models.QuerySet):
+    """Queries over todos."""
+
+    def live(self):
+        """Todos that are still open."""
+        return self.filter(completed__isnull=True)
+
+    def finished_before(self, cutoff):
+        """Todos completed before ``cutoff``."""
+        return self.filter(completed__lt=cutoff)
 
 
 @python_2_unicode_compatible
@@ -33,7 +49,232 @@ class Todo(models.Model):
                               blank=True,
                               null=True
                               )
+    completed = models.DateTimeField(blank=True, null=True, db_index=True)
+
+    objects = TodoQuerySet.as_manager()
+
+    class Meta:
+        """Indexes for listing a profile's open todos in order."""
+
+        index_together = [
+            ('owner', 'completed', 'date', 'id'),
+            ('owner', 'completed', 'priority', 'date', 'id'),
+        ]
+
+    TRACKED_FIELDS = ('owner_id', 'duration', 'priority', 'ease', 'date',
+                      'completed', 'title', 'description')
 
     def __str__(self):
         """String representation of Todo."""
         return self.title
+
+    def save(self, *args, **kwargs):
+        """
+        Save the todo and move its owner's counters in one transaction.
+
+        The counters are moved by a ``post_save`` receiver, so a summary
+        rebuild cannot count the saved row and then have it added again.
+        """
+        using = kwargs.get('using') or router.db_for_write(
+            type(self), instance=self)
+        with transaction.atomic(using=using):
+            super(Todo, self).save(*args, **kwargs)
+
+    def complete(self, when=None):
+        """Mark the todo as done, now unless ``when`` is given."""
+        self.completed = when or timezone.now()
+        self.save()
+
+    def reopen(self):
+        """Mark a done todo as open again."""
+        self.completed = None
+        self.save()
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        """Remember the values a todo was loaded with."""
+        instance = super(Todo, cls).from_db(db, field_names, values)
+        instance.remember_values()
+        return instance
+
+    def remember_values(self):
+        """Remember the current values of the tracked fields."""
+        self._loaded_values = dict(
+            (name, getattr(self, name)) for name in self.TRACKED_FIELDS
+            if name in self.__dict__)
+
+    def changed_fields(self):
+        """Return tracked fields changed since loading, None if unknown."""
+        loaded = getattr(self, '_loaded_values', None)
+        if loaded is None:
+            return None
+        return set(name for name, value in loaded.items()
+                   if getattr(self, name) != value)
+
+
+@receiver([post_save, post_delete], sender=Todo)
+def expire_owner_pages(sender, instance, **kwargs):
+    """Expire cached pages of the user owning a changed todo."""
+    if kwargs.get('raw'):
+        return
+    try:
+        owner = instance.owner
+    except Profile.DoesNotExist:
+        return
+    if owner is not None:
+        bump_user_version(owner.user_id)
+
+
+@python_2_unicode_compatible
+class TodoSummary(models.Model):
+    """Counts of a profile's open todos, kept up to date on every write."""
+
+    owner = models.OneToOneField(Profile,
+                                 related_name='todo_summary',
+                                 primary_key=True,
+                                 on_delete=models.CASCADE
+                                 )
+    total = models.IntegerField(default=0)
+    total_duration = models.IntegerField(default=0)
+    priority_1 = models.IntegerField(default=0)
+    priority_2 = models.IntegerField(default=0)
+    priority_3 = models.IntegerField(default=0)
+    priority_4 = models.IntegerField(default=0)
+    ease_1 = models.IntegerField(default=0)
+    ease_2 = models.IntegerField(default=0)
+    ease_3 = models.IntegerField(default=0)
+
+    def __str__(self):
+        """String representation of TodoSummary."""
+        return '{} todos for profile {}'.format(self.total, self.owner_id)
+
+
+@receiver(post_delete, sender=Todo)
+def count_deleted_todo(sender, instance, **kwargs):
+    """Take a deleted todo out of its owner's counts."""
+    from todo.summary import count_delete
+    count_delete(instance)
+
+
+@receiver(post_save, sender=Todo)
+def patch_plans(sender, instance, created, raw=False, **kwargs):
+    """
+    Move a saved todo's counts and patch its owner's current plans.
+
+    Both need the values the todo was loaded with, which are reset at the
+    end, so they run here in order rather than in receivers of their own.
+    """
+    if raw:
+        return
+    from todo.replanning import (SHOWN_FIELDS, reschedule_todo, touch_plans,
+                                 unplan)
+    from todo.summary import count_change
+    count_change(instance, created)
+    changed = None if created else instance.changed_fields()
+    previous_owner = getattr(instance, '_loaded_values', {}).get('owner_id')
+    if previous_owner is not None and previous_owner != instance.owner_id:
+        unplan(instance.pk, previous_owner)
+    if instance.completed is None:
+        reschedule_todo(instance, changed)
+    elif instance.owner_id is not None:
+        unplan(instance.pk, instance.owner_id)
+    shown = changed is None or bool(changed & set(SHOWN_FIELDS))
+    if not created and shown and instance.owner_id is not None:
+        touch_plans(instance.pk, instance.owner_id)
+    instance.remember_values()
+
+
+@receiver(pre_delete, sender=Todo)
+def unplan_todo(sender, instance, **kwargs):
+    """Take a todo out of its owner's current plans before it is deleted."""
+    from todo.replanning import unplan
+    if instance.owner_id is not None:
+        unplan(instance.pk, instance.owner_id)
+
+
+@python_2_unicode_compatible
+class Plan(models.Model):
+    """A generated day plan for a profile."""
+
+    owner = models.ForeignKey(Profile,
+                              related_name='plans',
+                              on_delete=models.CASCADE
+                              )
+    day = models.DateField()
+    version = models.PositiveIntegerField(default=1)
+    generated = models.DateTimeField(default=timezone.now)
+    occupancy = models.BinaryField(blank=True, null=True)
+
+    class Meta:
+        """One plan per profile and day."""
+
+        unique_together = ('owner', 'day')
+
+    def __str__(self):
+        """String representation of Plan."""
+        return 'Plan {} for profile {}'.format(self.day, self.owner_id)
+
+
+@python_2_unicode_compatible
+class PlanEntry(models.Model):
+    """A todo placed in a plan."""
+
+    plan = models.ForeignKey(Plan,
+                             related_name='entries',
+                             on_delete=models.CASCADE
+                             )
+    todo = models.ForeignKey(Todo,
+                             related_name='plan_entries',
+                             on_delete=models.CASCADE
+                             )
+    start = models.DateTimeField()
+    end = models.DateTimeField()
+
+    def __str__(self):
+        """String representation of PlanEntry."""
+        return '{} at {}'.format(self.todo_id, self.start)
+
+
+@receiver(busy_blocks_replaced, sender=BusyBlock)
+def forget_occupancy(sender, profile, **kwargs):
+    """Drop the occupancy bitmaps of plans after busy time was replaced."""
+    Plan.objects.filter(owner=profile).update(occupancy=None)
+
+
+@receiver(post_save, sender=BusyBlock)
+def forget_block_occupancy(sender, instance, raw=False, **kwargs):
+    """Drop the occupancy bitmaps of plans after a busy block was saved."""
+    if not raw:
+        Plan.objects.filter(owner_id=instance.owner_id).update(occupancy=None)
+
+
+@python_2_unicode_compatible
+class ArchivedTodo(models.Model):
+    """A completed todo moved out of the live table, keeping its id."""
+
+    id = models.IntegerField(primary_key=True)
+    title = models.CharField(max_length=255, blank=True)
+    description = models.TextField(blank=True)
+    date = models.DateTimeField(blank=True, null=True)
+    duration = models.PositiveIntegerField(default=1)
+    ease = models.PositiveIntegerField(choices=Todo.EASE_CHOICES, default=1)
+    priority = models.PositiveIntegerField(choices=Todo.PRIORITY_CHOICES,
+                                           default=4)
+    owner = models.ForeignKey(Profile,
+                              related_name='archived_todos',
+                              blank=True,
+                              null=True,
+                              on_delete=models.CASCADE
+                              )
+    completed = models.DateTimeField()
+    archived = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        """Index for a profile's history in order of completion."""
+
+        index_together = [('owner', 'completed')]
+
+    def __str__(self):
+        """String representation of ArchivedTodo."""
+        return self.title
+
@@ -0,0 +1,159 @@
+"""Keyset pagination and chunked iteration for todo querysets.
+
+Pages and chunks start after the last row seen rather than at an OFFSET.
+The condition is spelled out as ``a > x OR (a = x AND b > y) ...`` over
+the ordering columns, not as a row value comparison, so that NULL dates
+sort the way the database sorts them. Databases do not turn such an OR
+into an index range, so it is ANDed with ``a >= x`` on the leading column,
+which they do. The ``(owner, completed, ...)`` indexes end with the same
+columns as the orderings, ``id`` included, so a page is read in index
+order starting from that bound instead of walking every earlier row.
+"""
+
+import base64
+import json
+import operator
+from functools import reduce
+
+from django.db import connections
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+
+ORDERINGS = {
+    'date': ('date', 'id'),
+    'priority': ('priority', 'date', 'id'),
+}
+DATETIME_FIELDS = ('date',)
+
+
+def encode_cursor(values):
+    """Encode the ordering values of a row as an opaque cursor."""
+    values = [value.isoformat() if hasattr(value, 'isoformat') else value
+              for value in values]
+    raw = json.dumps(values, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii')
+
+
+def decode_cursor(cursor, fields):
+    """Decode a cursor for ``fields``, raising ValueError if it is bad."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode('ascii'))
+        values = json.loads(raw.decode('utf-8'))
+    except (TypeError, UnicodeError, ValueError):
+        raise ValueError('Invalid cursor.')
+    if not isinstance(values, list) or len(values) != len(fields):
+        raise ValueError('Invalid cursor.')
+    decoded = []
+    for field, value in zip(fields, values):
+        if value is not None and field in DATETIME_FIELDS:
+            value = parse_datetime(value)
+            if value is None:
+                raise ValueError('Invalid cursor.')
+        elif value is not None and not isinstance(value, int):
+            raise ValueError('Invalid cursor.')
+        decoded.append(value)
+    return decoded
+
+
+def equal_to(field, value):
+    """Filter for ``field`` equal to ``value``, which may be NULL."""
+    if value is None:
+        return Q(**{field + '__isnull': True})
+    return Q(**{field: value})
+
+
+def greater_than(field, value, nulls_largest):
+    """Filter for ``field`` sorting after ``value``, or None if nothing can."""
+    if value is None:
+        return None if nulls_largest else Q(**{field + '__isnull': False})
+    greater = Q(**{field + '__gt': value})
+    if nulls_largest:
+        greater |= Q(**{field + '__isnull': True})
+    return greater
+
+
+def at_least(field, value, nulls_largest, nullable=True):
+    """Filter for ``field`` sorting at or after ``value``, None if any can."""
+    if value is None:
+        return Q(**{field + '__isnull': True}) if nulls_largest else None
+    bound = Q(**{field + '__gte': value})
+    if nulls_largest and nullable:
+        bound |= Q(**{field + '__isnull': True})
+    return bound
+
+
+def after(fields, values, nulls_largest, nullable=None):
+    """
+    Build a filter for rows ordered after ``values`` on ``fields``.
+
+    NULLs sort the way the database sorts them, last when
+    ``nulls_largest`` is set and first otherwise. ``nullable`` lists the
+    fields that can be NULL, all of them by default. Returns None when no
+    row can follow.
+    """
+    nullable = fields if nullable is None else nullable
+    terms = []
+    for position, (field, value) in enumerate(zip(fields, values)):
+        greater = greater_than(field, value, nulls_largest)
+        if greater is None:
+            continue
+        for field_before, value_before in zip(fields[:position],
+                                              values[:position]):
+            greater &= equal_to(field_before, value_before)
+        terms.append(greater)
+    if not terms:
+        return None
+    condition = reduce(operator.or_, terms)
+    bound = at_least(fields[0], values[0], nulls_largest,
+                     fields[0] in nullable)
+    return condition if bound is None else bound & condition
+
+
+def keyset_page(queryset, ordering, cursor=None, limit=50, fields=()):
+    """
+    Return one page of ``queryset`` as dicts and the cursor of the next.
+
+    ``ordering`` names an entry of ``ORDERINGS``. The next cursor is None
+    on the last page.
+    """
+    keys = ORDERINGS[ordering]
+    nulls_largest = connections[queryset.db].features.nulls_order_largest
+    nullable = [key for key in keys
+                if queryset.model._meta.get_field(key).null]
+    queryset = queryset.order_by(*keys)
+    if cursor:
+        condition = after(keys, decode_cursor(cursor, keys), nulls_largest,
+                          nullable)
+        if condition is None:
+            return [], None
+        queryset = queryset.filter(condition)
+    names = list(fields) + [key for key in keys if key not in fields]
+    rows = list(queryset.values(*names)[:limit + 1])
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode_cursor([rows[-1][key] for key in keys])
+
+
+def iter_values(queryset, fields, chunk_size=1000):
+    """
+    Yield ``values_list`` rows of ``fields`` in primary key order.
+
+    Rows are fetched ``chunk_size`` at a time with a keyset condition on
+    the primary key, so neither model instances nor the whole result are
+    ever held in memory.
+    """
+    fields = tuple(fields)
+    names = fields if 'pk' in fields else fields + ('pk',)
+    position = names.index('pk')
+    queryset = queryset.order_by('pk').values_list(*names)
+    last = None
+    while True:
+        chunk = queryset if last is None else queryset.filter(pk__gt=last)
+        rows = list(chunk[:chunk_size])
+        for row in rows:
+            yield row[:len(fields)]
+        if len(rows) < chunk_size:
+            return
+        last = rows[-1][position]
@@ -0,0 +1,119 @@
+"""Pick the todos best suited to the current moment.
+
+Scores are computed by the database with ``Case``/``When`` over priority,
+ease, duration and deadline, so only a few rows ever leave it. The
+deadline term can only be bucketed in SQL, and each bucket is worth what
+its nearest deadline would be, so the database score is an upper bound of
+the exact one. Rows are fetched a batch at a time in that order and the
+exact scores choose among them with a heap rather than a full sort, until
+no row left could beat the ones chosen.
+"""
+
+import heapq
+from datetime import timedelta
+
+from django.db.models import Case, FloatField, Value, When
+from django.utils import timezone
+
+from todo.models import Todo
+from todo.scheduler import (DEADLINE_WEIGHT, MAX_EASE, MAX_PRIORITY,
+                            SLOT_MINUTES, SLOTS_PER_DAY, energy_curve)
+from userprofile.energy import slot_of
+
+
+FIT_WEIGHT = 2.0
+TOO_LONG_PENALTY = 5.0
+DEADLINE_BUCKET_DAYS = (0, 1, 2, 3, 7, 14)
+CANDIDATES_PER_RESULT = 3
+RANK_FIELDS = ('id', 'title', 'priority', 'ease', 'duration', 'date')
+
+
+def demand(ease):
+    """How much energy a todo of ``ease`` asks for, from 0 to 1."""
+    return (ease - 1) / float(max(MAX_EASE - 1, 1))
+
+
+def moment(profile, now):
+    """Energy level at ``now`` and minutes left before it runs out."""
+    curve = energy_curve(profile)
+    slot = slot_of(timezone.localtime(now).time())
+    if curve[slot] <= 0:
+        return 0.0, 0
+    rest = curve[slot:]
+    empty = (rest <= 0).nonzero()[0]
+    left = int(empty[0]) if len(empty) else SLOTS_PER_DAY - slot
+    return float(curve[slot]), left * SLOT_MINUTES
+
+
+def float_case(*whens):
+    """A ``Case`` of float values defaulting to zero."""
+    return Case(*whens, default=Value(0.0), output_field=FloatField())
+
+
+def score_expression(level, minutes_left, now):
+    """SQL expression bounding a todo's score for the current moment."""
+    priority = float_case(*[
+        When(priority=value, then=Value(float(MAX_PRIORITY + 1 - value)))
+        for value, label in Todo.PRIORITY_CHOICES])
+    fit = float_case(*[
+        When(ease=value, then=Value(-FIT_WEIGHT * abs(demand(value) - level)))
+        for value, label in Todo.EASE_CHOICES])
+    too_long = float_case(When(duration__gt=minutes_left,
+                               then=Value(-TOO_LONG_PENALTY)))
+    nearest = (0,) + DEADLINE_BUCKET_DAYS
+    deadline = float_case(*[
+        When(date__lte=now + timedelta(days=days),
+             then=Value(DEADLINE_WEIGHT / (1 + near)))
+        for near, days in zip(nearest, DEADLINE_BUCKET_DAYS)] + [
+        When(date__isnull=False,
+             then=Value(DEADLINE_WEIGHT / (1 + DEADLINE_BUCKET_DAYS[-1])))])
+    return priority + fit + too_long + deadline
+
+
+def exact_score(row, level, minutes_left, now):
+    """Score of a ``RANK_FIELDS`` row dict, with a continuous deadline."""
+    score = float(MAX_PRIORITY + 1 - row['priority'])
+    score -= FIT_WEIGHT * abs(demand(row['ease']) - level)
+    if row['duration'] > minutes_left:
+        score -= TOO_LONG_PENALTY
+    if row['date'] is not None:
+        hours_left = max((row['date'] - now).total_seconds() / 3600.0, 0)
+        score += DEADLINE_WEIGHT / (1 + hours_left / 24)
+    return score
+
+
+def top_rows(rows, k, score):
+    """The ``k`` best rows by ``score``, using a heap of size ``k``."""
+    return heapq.nlargest(k, rows, key=lambda row: (score(row), -row['id']))
+
+
+def best_todos(profile, k, now=None):
+    """
+    Return the ``k`` todos of ``profile`` best to start at ``now``.
+
+    Returns the energy level and a list of row dicts with a ``score``.
+    """
+    now = now or timezone.now()
+    level, minutes_left = moment(profile, now)
+    candidates = Todo.objects.live().filter(owner=profile).annotate(
+        rank=score_expression(level, minutes_left, now)).order_by(
+        '-rank', 'id').values('rank', *RANK_FIELDS)
+
+    def score(row):
+        """Exact score of a candidate."""
+        return exact_score(row, level, minutes_left, now)
+
+    batch = k * CANDIDATES_PER_RESULT
+    best = []
+    offset = 0
+    while batch > 0:
+        rows = list(candidates[offset:offset + batch])
+        best = top_rows(best + rows, k, score)
+        offset += len(rows)
+        if len(rows) < batch or (
+                len(best) == k and score(best[-1]) >= rows[-1]['rank']):
+            break
+    for row in best:
+        del row['rank']
+        row['score'] = round(score(row), 4)
+    return level, best
@@ -0,0 +1,322 @@
+"""Patch stored plans in place when a single todo changes.
+
+Rather than rescheduling a whole profile, only the slots of the changed todo
+and the todos it now overlaps are placed again. A todo whose urgency or
+ease changed is placed again from scratch. Either way a todo only pushes
+todos scoring no more than it out of its way, and only when that gains
+more than it loses. Saves changing nothing placement depends on leave
+plans alone. The stored plan is then brought up to date with the smallest
+set of entry deletes, updates and inserts. Plans that kept their occupancy
+bitmap are patched without loading busy time again.
+"""
+
+from datetime import datetime, time
+
+import numpy as np
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from todo import slots
+from todo.models import Plan, PlanEntry, Todo
+from todo.scheduler import (MAX_EASE, SLOT_MINUTES, SLOTS_PER_DAY,
+                            TODO_FIELDS, TodoArrays, busy_slots,
+                            energy_curve, free_slots, load_busy, place_todos,
+                            score_todos, slot_datetime, slots_for,
+                            todo_arrays)
+
+
+PLACEMENT_FIELDS = ('priority', 'ease', 'date')
+RESCHEDULE_FIELDS = PLACEMENT_FIELDS + ('duration', 'completed', 'owner_id')
+SHOWN_FIELDS = ('title', 'description')
+
+
+def datetime_slot(day, value):
+    """Return the slot of ``day`` an aware datetime falls on."""
+    local = timezone.localtime(value).replace(tzinfo=None)
+    minutes = (local - datetime.combine(day, time())).total_seconds() / 60
+    return int(round(minutes / SLOT_MINUTES))
+
+
+def occupancy(placed):
+    """Boolean slot mask of ``{todo_id: (start, width)}`` placements."""
+    occupied = np.zeros(SLOTS_PER_DAY, dtype=bool)
+    for start, width in placed.values():
+        occupied[start:start + width] = True
+    return occupied
+
+
+def fits(free, start, width):
+    """Return whether ``width`` slots from ``start`` are all free."""
+    return start + width <= SLOTS_PER_DAY and bool(
+        free[start:start + width].all())
+
+
+def place_more(placed, todo_ids, free, curve, now):
+    """Place ``todo_ids`` into ``free`` slots, most urgent first."""
+    if not todo_ids:
+        return
+    todos = todo_arrays(Todo.objects.filter(
+        id__in=todo_ids).values_list(*TODO_FIELDS))
+    indices, starts = place_todos(todos, score_todos(todos, now), curve,
+                                  free)
+    widths = slots_for(todos.duration)
+    for index, start in zip(indices, starts):
+        placed[int(todos.id[index])] = (int(start), int(widths[index]))
+
+
+def overlapping(placed, start, width):
+    """Todos in ``placed`` taking any of ``width`` slots from ``start``."""
+    return [other for other, (other_start, other_width) in placed.items()
+            if other_start < start + width and
+            start < other_start + other_width]
+
+
+def fit_at(todo, curve, start):
+    """How well the single todo in ``todo`` suits the slots at ``start``."""
+    width = int(slots_for(todo.duration)[0])
+    demand = (todo.ease[0] - 1) / float(max(MAX_EASE - 1, 1))
+    return -abs(curve[start:start + width].mean() - demand)
+
+
+def best_start(todo, curve, free, old=None):
+    """
+    Best start for the single todo in ``todo``, or None if it cannot fit.
+
+    An ``old`` placement that is still free and suits the todo as well as
+    the best start is kept, so an unchanged plan does not shuffle.
+    """
+    indices, starts = place_todos(todo, np.zeros(1), curve, free)
+    if not len(indices):
+        return None
+    start = int(starts[0])
+    width = int(slots_for(todo.duration)[0])
+    if (old is not None and fits(free & (curve > 0), old[0], width) and
+            fit_at(todo, curve, old[0]) >= fit_at(todo, curve, start)):
+        return old[0]
+    return start
+
+
+def scored(todo_ids, todo_id, now):
+    """
+    Load the single todo ``todo_id`` and the scores of ``todo_ids``.
+
+    Returns the todo's arrays, or None when it is gone, and the scores of
+    it and the others by id.
+    """
+    todos = todo_arrays(Todo.objects.filter(
+        id__in=list(todo_ids) + [todo_id]).values_list(*TODO_FIELDS))
+    scores = dict(zip(todos.id.tolist(), score_todos(todos, now).tolist()))
+    found = np.flatnonzero(todos.id == todo_id)
+    if not len(found):
+        return None, scores
+    return TodoArrays(*(column[found[0]:found[0] + 1]
+                        for column in todos)), scores
+
+
+def make_room(placed, todo_id, start, width, available, curve, now,
+              scores):
+    """
+    Return placements with ``todo_id`` at ``start``, or None if not worth it.
+
+    The todos in its way are moved elsewhere, and whatever no longer fits
+    drops out of the plan. Todos scoring more than the todo are never moved,
+    and the todos dropped must score less than it in all.
+    """
+    displaced = overlapping(placed, start, width)
+    score = scores.get(todo_id, 0)
+    if any(scores.get(other, 0) > score for other in displaced):
+        return None
+    after = dict(placed)
+    for other in displaced:
+        del after[other]
+    if not fits(available & ~occupancy(after), start, width):
+        return None
+    after[todo_id] = (start, width)
+    place_more(after, displaced, available & ~occupancy(after), curve, now)
+    lost = sum(scores.get(other, 0) for other in displaced
+               if other not in after)
+    return after if lost < score else None
+
+
+def place_again(placed, todo, scores, old, available, curve, now):
+    """
+    Return placements with the single todo in ``todo`` placed as if new.
+
+    The todo may take any slots but those of todos scoring at least as
+    much, and otherwise only goes where there is room. It drops out of the
+    plan when it fits nowhere.
+    """
+    todo_id = int(todo.id[0])
+    score = scores[todo_id]
+    kept = dict((other, place) for other, place in placed.items()
+                if scores.get(other, score) >= score)
+    width = int(slots_for(todo.duration)[0])
+    for free in (available & ~occupancy(kept),
+                 available & ~occupancy(placed)):
+        start = best_start(todo, curve, free, old)
+        if start is None:
+            continue
+        after = make_room(placed, todo_id, start, width, available, curve,
+                          now, scores)
+        if after is not None:
+            return after
+    return placed
+
+
+def replace_placement(placed, todo_id, available, curve, now):
+    """
+    Return placements with ``todo_id`` placed again as if it were new.
+
+    Less urgent todos in its way are moved elsewhere, and whatever no
+    longer fits drops out of the plan, as long as the dropped todos score
+    less than the todo.
+    """
+    placed = dict(placed)
+    old = placed.pop(todo_id, None)
+    todo, scores = scored(placed, todo_id, now)
+    if todo is None:
+        return placed
+    return place_again(placed, todo, scores, old, available, curve, now)
+
+
+def patch_placements(placed, todo_id, width, available, curve, now):
+    """
+    Return placements with ``todo_id`` resized to ``width`` slots.
+
+    The todo keeps its start when it still fits there, or when the todos
+    it now overlaps score no more than it and can be moved out of its way
+    without dropping as much as it is worth. Otherwise it is placed again
+    around the todos scoring more than it.
+    """
+    placed = dict(placed)
+    start, old_width = placed.pop(todo_id)
+    if fits(available & ~occupancy(placed), start, width):
+        placed[todo_id] = (start, width)
+        return placed
+    todo, scores = scored(placed, todo_id, now)
+    if todo is None:
+        return placed
+    after = make_room(placed, todo_id, start, width, available, curve, now,
+                      scores)
+    if after is not None:
+        return after
+    return place_again(placed, todo, scores, (start, old_width), available,
+                       curve, now)
+
+
+def write_diff(plan, before, after, entry_ids, blocked):
+    """
+    Store the changes between two placements, returning if any.
+
+    ``blocked`` masks the slots taken by anything but the plan's todos, and
+    is stored with the new placements as the plan's occupancy.
+    """
+    removed = [entry_ids[todo_id] for todo_id in before
+               if todo_id not in after]
+    moved = [todo_id for todo_id in after
+             if todo_id in before and after[todo_id] != before[todo_id]]
+    added = [todo_id for todo_id in after if todo_id not in before]
+    if not (removed or moved or added):
+        return False
+
+    def bounds(todo_id):
+        """Start and end datetimes of a placement."""
+        start, width = after[todo_id]
+        return (slot_datetime(plan.day, start),
+                slot_datetime(plan.day, start + width))
+
+    with transaction.atomic():
+        if removed:
+            PlanEntry.objects.filter(pk__in=removed).delete()
+        for todo_id in moved:
+            start, end = bounds(todo_id)
+            PlanEntry.objects.filter(pk=entry_ids[todo_id]).update(
+                start=start, end=end)
+        PlanEntry.objects.bulk_create(
+            [PlanEntry(plan=plan, todo_id=todo_id, start=bounds(todo_id)[0],
+                       end=bounds(todo_id)[1]) for todo_id in added])
+        Plan.objects.filter(pk=plan.pk).update(
+            version=F('version') + 1,
+            occupancy=slots.pack(blocked | occupancy(after)))
+    return True
+
+
+def unplan(todo_id, owner_id, now=None):
+    """Drop a todo from its owner's current plans, leaving a gap."""
+    now = now or timezone.now()
+    plans = Plan.objects.filter(owner_id=owner_id,
+                                day__gte=timezone.localtime(now).date(),
+                                entries__todo_id=todo_id)
+    plan_ids = list(plans.values_list('id', flat=True))
+    if plan_ids:
+        PlanEntry.objects.filter(plan_id__in=plan_ids,
+                                 todo_id=todo_id).delete()
+        Plan.objects.filter(pk__in=plan_ids).update(
+            version=F('version') + 1, occupancy=None)
+
+
+def touch_plans(todo_id, owner_id, now=None):
+    """Bump the versions of the owner's current plans listing a todo."""
+    now = now or timezone.now()
+    Plan.objects.filter(
+        owner_id=owner_id, day__gte=timezone.localtime(now).date(),
+        entries__todo_id=todo_id).update(version=F('version') + 1)
+
+
+def reschedule_todo(todo, changed=None, now=None):
+    """
+    Patch the current plans of ``todo``'s owner after it was saved.
+
+    ``changed`` names the fields that changed, or is None when unknown. A
+    todo already in a plan is resized in place when only its duration
+    changed, and placed again when anything its placement depends on did.
+    A todo not in any plan is put in the first current plan it fits in.
+    Nothing happens when none of ``RESCHEDULE_FIELDS`` changed.
+    """
+    now = now or timezone.now()
+    if todo.owner_id is None or (
+            changed is not None and not set(changed) & set(RESCHEDULE_FIELDS)):
+        return
+    plans = list(Plan.objects.filter(
+        owner_id=todo.owner_id,
+        day__gte=timezone.localtime(now).date()).order_by('day'))
+    if not plans:
+        return
+    entries = {}
+    for entry_id, plan_id, todo_id, start, end in PlanEntry.objects.filter(
+            plan__in=plans).values_list('id', 'plan', 'todo', 'start',
+                                        'end'):
+        entries.setdefault(plan_id, []).append((entry_id, todo_id, start,
+                                                end))
+    holding = [plan for plan in plans
+               if any(entry[1] == todo.pk for entry in entries.get(
+                   plan.pk, ()))]
+    replace = changed is None or bool(set(changed) & set(PLACEMENT_FIELDS))
+    if holding and not replace and 'duration' not in changed:
+        return
+
+    curve = energy_curve(todo.owner)
+    width = int(slots_for(todo.duration))
+    busy = None
+    for plan in holding or plans:
+        before, entry_ids = {}, {}
+        for entry_id, todo_id, start, end in entries.get(plan.pk, ()):
+            first = datetime_slot(plan.day, start)
+            before[todo_id] = (first, datetime_slot(plan.day, end) - first)
+            entry_ids[todo_id] = entry_id
+        if plan.occupancy is not None:
+            blocked = slots.unpack(plan.occupancy) & ~occupancy(before)
+        else:
+            if busy is None:
+                busy = load_busy(todo.owner_id, plans[0].day, plans[-1].day)
+            blocked = slots.taken(curve, busy_slots(busy, plan.day))
+        available = free_slots(plan.day, now) & ~blocked
+        if todo.pk in before and not replace:
+            after = patch_placements(before, todo.pk, width, available,
+                                     curve, now)
+        else:
+            after = replace_placement(before, todo.pk, available, curve, now)
+        changed_plan = write_diff(plan, before, after, entry_ids, blocked)
+        if not holding and changed_plan:
+            return
@@ -0,0 +1,299 @@
+"""Day plan scheduling for a profile's todos.
+
+Todos are loaded straight into NumPy arrays with ``values_list`` and the day
+is modelled as a fixed grid of slots, so scoring and placement never touch
+ORM instances.
+"""
+
+from collections import defaultdict, namedtuple
+from datetime import datetime, time, timedelta
+
+import numpy as np
+from django.db import transaction
+from django.utils import timezone
+
+from todo import slots
+from todo.intervals import IntervalIndex
+from todo.models import Plan, PlanEntry, Todo
+from userprofile.energy import (SLOT_MINUTES, SLOTS_PER_DAY, active_mask,
+                                energy_curve)
+from userprofile.models import BusyBlock
+
+
+DEADLINE_WEIGHT = 2.0
+
+MAX_PRIORITY = max(value for value, label in Todo.PRIORITY_CHOICES)
+MAX_EASE = max(value for value, label in Todo.EASE_CHOICES)
+
+TODO_FIELDS = ('id', 'priority', 'ease', 'duration', 'date')
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+class TodoArrays(namedtuple('TodoArrays', TODO_FIELDS)):
+    """Column arrays for a set of todos, one entry per todo."""
+
+    __slots__ = ()
+
+    def __len__(self):
+        """Number of todos held."""
+        return len(self.id)
+
+
+PlannedTodo = namedtuple('PlannedTodo', 'todo_id start end')
+DayPlan = namedtuple('DayPlan', 'entries occupancy')
+
+
+def slots_for(duration):
+    """Return the number of slots needed for durations given in minutes."""
+    return np.maximum(-(-np.asarray(duration) // SLOT_MINUTES), 1)
+
+
+def to_epoch(value):
+    """Seconds since the epoch for an aware datetime, NaN for None."""
+    if value is None:
+        return np.nan
+    return (value - EPOCH).total_seconds()
+
+
+def todo_arrays(rows):
+    """Build ``TodoArrays`` from ``values_list`` rows of ``TODO_FIELDS``."""
+    rows = list(rows)
+    columns = list(zip(*rows)) if rows else [()] * len(TODO_FIELDS)
+    return TodoArrays(
+        id=np.array(columns[0], dtype=np.int64),
+        priority=np.array(columns[1], dtype=np.int64),
+        ease=np.array(columns[2], dtype=np.int64),
+        duration=np.array(columns[3], dtype=np.int64),
+        date=np.array([to_epoch(value) for value in columns[4]],
+                      dtype=np.float64),
+    )
+
+
+def load_todos(profile):
+    """Load a profile's todos as ``TodoArrays`` without building models."""
+    rows = Todo.objects.live().filter(owner=profile).values_list(
+        *TODO_FIELDS)
+    return todo_arrays(rows)
+
+
+def load_todos_by_owner(profile_ids):
+    """Load ``TodoArrays`` for many profiles in a single query."""
+    rows = defaultdict(list)
+    todos = Todo.objects.live().filter(owner__in=profile_ids)
+    for row in todos.values_list('owner', *TODO_FIELDS).iterator():
+        rows[row[0]].append(row[1:])
+    return dict((owner, todo_arrays(rows[owner])) for owner in profile_ids)
+
+
+def day_bounds(first_day, last_day=None):
+    """Aware datetimes at which ``first_day`` starts and ``last_day`` ends."""
+    return (slot_datetime(first_day, 0),
+            slot_datetime(last_day or first_day, SLOTS_PER_DAY))
+
+
+def busy_index(rows):
+    """Build an ``IntervalIndex`` from ``(start, end)`` datetime rows."""
+    rows = list(rows)
+    return IntervalIndex([to_epoch(start) for start, end in rows],
+                         [to_epoch(end) for start, end in rows])
+
+
+def busy_blocks(first_day, last_day=None):
+    """Busy blocks overlapping the days from ``first_day`` to ``last_day``."""
+    start, end = day_bounds(first_day, last_day)
+    return BusyBlock.objects.filter(start__lt=end, end__gt=start)
+
+
+def load_busy(profile, first_day, last_day=None):
+    """Index a profile's busy time over a range of days."""
+    blocks = busy_blocks(first_day, last_day).filter(owner=profile)
+    return busy_index(blocks.values_list('start', 'end'))
+
+
+def load_busy_by_owner(profile_ids, day):
+    """Index the busy time on ``day`` of many profiles in one query."""
+    rows = defaultdict(list)
+    blocks = busy_blocks(day).filter(owner__in=profile_ids)
+    for owner, start, end in blocks.values_list('owner', 'start', 'end'):
+        rows[owner].append((start, end))
+    return dict((owner, busy_index(rows[owner])) for owner in profile_ids)
+
+
+def busy_slots(index, day):
+    """Boolean mask of the slots of ``day`` that overlap busy time."""
+    day_start, day_end = (to_epoch(value) for value in day_bounds(day))
+    starts, ends = index.overlapping(day_start, day_end)
+    slot_seconds = SLOT_MINUTES * 60.0
+    first = np.floor((starts - day_start) / slot_seconds)
+    last = np.ceil((ends - day_start) / slot_seconds)
+    edges = np.zeros(SLOTS_PER_DAY + 1, dtype=np.int64)
+    np.add.at(edges, np.clip(first, 0, SLOTS_PER_DAY).astype(np.int64), 1)
+    np.add.at(edges, np.clip(last, 0, SLOTS_PER_DAY).astype(np.int64), -1)
+    return np.cumsum(edges[:-1]) > 0
+
+
+def free_windows(profile, index, day):
+    """
+    Return the free ``(start, end)`` datetimes of ``profile`` on ``day``.
+
+    Windows lie inside the profile's active period and between the busy
+    blocks of ``index``, which are found with binary searches.
+    """
+    active = np.concatenate(([False], active_mask(
+        profile.active_period_start, profile.active_period_end), [False]))
+    changes = np.flatnonzero(active[1:] != active[:-1])
+    windows = []
+    for first, last in zip(changes[::2], changes[1::2]):
+        for start, end in index.free_windows(
+                to_epoch(slot_datetime(day, first)),
+                to_epoch(slot_datetime(day, last))):
+            windows.append((EPOCH + timedelta(seconds=start),
+                            EPOCH + timedelta(seconds=end)))
+    return windows
+
+
+def score_todos(todos, now):
+    """Return an urgency score per todo; higher is more pressing."""
+    scores = (MAX_PRIORITY + 1 - todos.priority).astype(np.float64)
+    dated = ~np.isnan(todos.date)
+    hours_left = (todos.date[dated] - to_epoch(now)) / 3600.0
+    scores[dated] += DEADLINE_WEIGHT / (1 + np.clip(hours_left, 0, None) / 24)
+    return scores
+
+
+def window_sums(values, width):
+    """Sum of every run of ``width`` consecutive values."""
+    totals = np.concatenate(([0], np.cumsum(values)))
+    return totals[width:] - totals[:-width]
+
+
+def place_todos(todos, scores, curve, free=None):
+    """
+    Place todos into free slots, most urgent first.
+
+    Each todo takes the free run of slots whose mean energy best matches
+    how demanding it is, so difficult work lands on high energy and easy
+    work on low energy. Returns the placed todo indices and start slots.
+    """
+    free = curve > 0 if free is None else free & (curve > 0)
+    needed = slots_for(todos.duration)
+    demand = (todos.ease - 1) / float(max(MAX_EASE - 1, 1))
+    order = np.lexsort((todos.id, -scores))
+
+    placed, starts = [], []
+    remaining = int(free.sum())
+    smallest_miss = SLOTS_PER_DAY + 1
+    for index in order:
+        width = int(needed[index])
+        if width > remaining or width >= smallest_miss:
+            continue
+        open_run = slots.run_starts(free, width)[:SLOTS_PER_DAY - width + 1]
+        if not open_run.any():
+            smallest_miss = width
+            continue
+        fit = -np.abs(window_sums(curve, width) / width - demand[index])
+        fit[~open_run] = -np.inf
+        start = int(np.argmax(fit))
+        free[start:start + width] = False
+        remaining -= width
+        placed.append(index)
+        starts.append(start)
+        if not remaining:
+            break
+    return np.array(placed, dtype=np.int64), np.array(starts, dtype=np.int64)
+
+
+def slot_datetime(day, slot):
+    """Return the aware datetime at which a slot of ``day`` starts."""
+    naive = datetime.combine(day, time()) + timedelta(
+        minutes=int(slot) * SLOT_MINUTES)
+    return timezone.make_aware(naive, is_dst=False)
+
+
+def free_slots(day, now):
+    """Slots of ``day`` that have not already passed at ``now``."""
+    free = np.ones(SLOTS_PER_DAY, dtype=bool)
+    local_now = timezone.localtime(now)
+    if day < local_now.date():
+        free[:] = False
+    elif day == local_now.date():
+        elapsed = (local_now.hour * 60 + local_now.minute +
+                   local_now.second / 60.0 + local_now.microsecond / 6e7)
+        free[:int(np.ceil(elapsed / SLOT_MINUTES))] = False
+    return free
+
+
+def schedule_day(todos, curve, day, now, busy=None):
+    """
+    Score and place ``todos`` on ``day``, returning a ``DayPlan``.
+
+    ``busy`` is an optional slot mask of busy time to plan around. The
+    plan's occupancy is the packed bitmap of the slots it leaves taken.
+    """
+    free = free_slots(day, now)
+    if busy is not None:
+        free &= ~busy
+    if len(todos):
+        placed, starts = place_todos(todos, score_todos(todos, now), curve,
+                                     free)
+    else:
+        placed = starts = np.zeros(0, dtype=np.int64)
+    needed = slots_for(todos.duration[placed])
+    order = np.argsort(starts, kind='mergesort')
+    entries = [
+        PlannedTodo(int(todos.id[placed[i]]),
+                    slot_datetime(day, starts[i]),
+                    slot_datetime(day, starts[i] + needed[i]))
+        for i in order
+    ]
+    return DayPlan(entries, slots.pack(slots.taken(curve, busy, starts,
+                                                   needed)))
+
+
+def schedule(todos, curve, day, now, busy=None):
+    """Score and place ``todos`` on ``day``, returning ``PlannedTodo``s."""
+    return schedule_day(todos, curve, day, now, busy).entries
+
+
+def day_plan(profile, day=None, now=None):
+    """Build the ``DayPlan`` of ``profile`` for ``day``, by default today."""
+    now = now or timezone.now()
+    day = day or timezone.localtime(now).date()
+    busy = busy_slots(load_busy(profile, day), day)
+    return schedule_day(load_todos(profile), energy_curve(profile), day, now,
+                        busy)
+
+
+def plan_day(profile, day=None, now=None):
+    """Build the plan for ``profile`` on ``day``, defaulting to today."""
+    return day_plan(profile, day, now).entries
+
+
+def store_plans(day, plans, batch_size=None):
+    """
+    Replace the plans for ``day`` with ``plans``, keyed by profile id.
+
+    Values are ``DayPlan``s, or lists of ``PlannedTodo`` when there is no
+    occupancy to keep. Everything is written with ``bulk_create`` in one
+    transaction, and a replaced plan keeps counting up its version.
+    """
+    plans = dict((owner, plan if isinstance(plan, DayPlan)
+                  else DayPlan(plan, None))
+                 for owner, plan in plans.items())
+    owners = list(plans)
+    with transaction.atomic():
+        existing = Plan.objects.filter(owner__in=owners, day=day)
+        versions = dict(existing.values_list('owner', 'version'))
+        existing.delete()
+        Plan.objects.bulk_create(
+            [Plan(owner_id=owner, day=day, version=versions.get(owner, 0) + 1,
+                  occupancy=plans[owner].occupancy)
+             for owner in owners],
+            batch_size=batch_size)
+        plan_ids = dict(Plan.objects.filter(
+            owner__in=owners, day=day).values_list('owner', 'id'))
+        PlanEntry.objects.bulk_create(
+            [PlanEntry(plan_id=plan_ids[owner], todo_id=item.todo_id,
+                       start=item.start, end=item.end)
+             for owner in owners for item in plans[owner].entries],
+            batch_size=batch_size)
@@ -0,0 +1,60 @@
+"""Bitmaps of the slots of a day.
+
+A day is a boolean mask of ``SLOTS_PER_DAY`` slots. Stored plans keep the
+slots that are taken, whether by inactive hours, busy time or planned
+todos, packed eight to a byte, so a plan can be patched later without
+rebuilding its energy curve or loading busy time again.
+"""
+
+import numpy as np
+
+from userprofile.energy import SLOTS_PER_DAY
+
+
+SLOT_BYTES = -(-SLOTS_PER_DAY // 8)
+
+
+def pack(mask):
+    """Pack a slot mask into ``SLOT_BYTES`` bytes."""
+    return np.packbits(np.asarray(mask, dtype=bool)).tobytes()
+
+
+def unpack(blob):
+    """Unpack bytes made by ``pack`` into a slot mask."""
+    bits = np.unpackbits(np.frombuffer(bytes(blob), dtype=np.uint8))
+    return bits[:SLOTS_PER_DAY].astype(bool)
+
+
+def taken(curve, busy=None, starts=(), widths=()):
+    """
+    Mask of the slots unavailable for new work.
+
+    Slots without energy, slots in ``busy`` and the runs of ``widths``
+    slots from ``starts`` are taken.
+    """
+    mask = curve <= 0
+    if busy is not None:
+        mask |= busy
+    for start, width in zip(starts, widths):
+        mask[start:start + width] = True
+    return mask
+
+
+def run_starts(free, width):
+    """
+    Mask of the slots starting ``width`` consecutive free slots.
+
+    Runs are found by repeatedly doubling their length with a shifted
+    AND, so only about log2(width) passes over the day are made. A two
+    dimensional mask is treated as one day per row, and runs never cross
+    from one row into the next.
+    """
+    runs = np.asarray(free, dtype=bool)
+    length = 1
+    while length < width:
+        step = min(length, width - length)
+        runs = np.concatenate((runs[..., :-step] & runs[..., step:],
+                               np.zeros(runs.shape[:-1] + (step,),
+                                        dtype=bool)), axis=-1)
+        length += step
+    return runs
@@ -0,0 +1,152 @@
+"""Per-profile counters of open todos.
+
+Every todo write moves the counters of its owner's ``TodoSummary`` with a
+single ``UPDATE`` of ``F()`` expressions in the transaction of the write,
+so concurrent writers never lose each other's changes and reading a
+summary is one primary key lookup.
+``rebuild_summaries`` recounts everything in one grouped query when the
+counters need repairing.
+"""
+
+from collections import Counter
+
+from django.db import transaction
+from django.db.models import Case, Count, F, IntegerField, Sum, When
+
+from todo.models import Todo, TodoSummary
+
+
+PRIORITIES = [value for value, label in Todo.PRIORITY_CHOICES]
+EASES = [value for value, label in Todo.EASE_CHOICES]
+COUNTED_FIELDS = ('owner_id', 'duration', 'priority', 'ease', 'completed')
+
+
+def counts(priority, ease, duration, sign=1):
+    """Counter changes for one todo, negative when ``sign`` is -1."""
+    change = Counter({'total': sign, 'total_duration': sign * duration})
+    if priority in PRIORITIES:
+        change['priority_{}'.format(priority)] += sign
+    if ease in EASES:
+        change['ease_{}'.format(ease)] += sign
+    return change
+
+
+def apply_counts(owner_id, change, create=True):
+    """Add ``change`` to an owner's counters, creating them if asked."""
+    updates = dict((name, F(name) + value)
+                   for name, value in change.items() if value)
+    if owner_id is None or not updates:
+        return
+    summaries = TodoSummary.objects.filter(owner_id=owner_id)
+    if not summaries.update(**updates) and create:
+        TodoSummary.objects.get_or_create(owner_id=owner_id)
+        summaries.update(**updates)
+
+
+def open_counts(todo):
+    """Counter changes for a todo that is open, nothing if it is done."""
+    if todo.completed is not None:
+        return Counter()
+    return counts(todo.priority, todo.ease, todo.duration)
+
+
+def count_change(todo, created):
+    """Move the counters for a saved todo."""
+    if created:
+        apply_counts(todo.owner_id, open_counts(todo))
+        return
+    loaded = getattr(todo, '_loaded_values', None)
+    if loaded is None or not all(name in loaded for name in COUNTED_FIELDS):
+        rebuild_summaries([todo.owner_id])
+        return
+    old = Counter()
+    if loaded['completed'] is None:
+        old = counts(loaded['priority'], loaded['ease'], loaded['duration'],
+                     -1)
+    new = open_counts(todo)
+    if loaded['owner_id'] == todo.owner_id:
+        new.update(old)
+        apply_counts(todo.owner_id, new)
+    else:
+        apply_counts(loaded['owner_id'], old)
+        apply_counts(todo.owner_id, new)
+
+
+def count_delete(todo):
+    """
+    Take a deleted todo out of its owner's counters.
+
+    Missing counters are left alone, as the owner may be being deleted.
+    """
+    loaded = getattr(todo, '_loaded_values', None) or {}
+    if loaded.get('completed', todo.completed) is not None:
+        return
+    apply_counts(
+        loaded.get('owner_id', todo.owner_id),
+        counts(loaded.get('priority', todo.priority),
+               loaded.get('ease', todo.ease),
+               loaded.get('duration', todo.duration), -1),
+        create=False)
+
+
+def count_created(todos):
+    """Add todos inserted with ``bulk_create`` to their owners' counters."""
+    changes = {}
+    for todo in todos:
+        changes.setdefault(todo.owner_id, Counter()).update(
+            open_counts(todo))
+    for owner_id, change in changes.items():
+        apply_counts(owner_id, change)
+
+
+def summary_columns():
+    """Aggregates computing every counter of a group of todos."""
+    def count_where(**condition):
+        """Number of todos in the group matching ``condition``."""
+        return Sum(Case(When(then=1, **condition), default=0,
+                        output_field=IntegerField()))
+
+    columns = {
+        'total': Count('id'),
+        'total_duration': Sum('duration'),
+    }
+    for priority in PRIORITIES:
+        columns['priority_{}'.format(priority)] = count_where(
+            priority=priority)
+    for ease in EASES:
+        columns['ease_{}'.format(ease)] = count_where(ease=ease)
+    return columns
+
+
+def rebuild_summaries(owner_ids=None):
+    """
+    Recount the summaries of ``owner_ids``, or of every profile.
+
+    The owners' summaries are locked before their todos are counted in one
+    query grouped by owner, so counter updates made meanwhile wait for the
+    new counts instead of being overwritten by them. Returns the number of
+    summaries written.
+    """
+    todos = Todo.objects.live().filter(owner__isnull=False)
+    summaries = TodoSummary.objects.all()
+    if owner_ids is not None:
+        owner_ids = [owner_id for owner_id in owner_ids
+                     if owner_id is not None]
+        todos = todos.filter(owner__in=owner_ids)
+        summaries = summaries.filter(owner__in=owner_ids)
+    with transaction.atomic():
+        list(summaries.select_for_update().values_list('pk', flat=True))
+        rows = todos.order_by().values('owner').annotate(**summary_columns())
+        fresh = [TodoSummary(owner_id=row.pop('owner'), **row)
+                 for row in rows]
+        summaries.delete()
+        TodoSummary.objects.bulk_create(fresh)
+    return len(fresh)
+
+
+def summary_for(profile):
+    """Return a profile's summary, all zeros if it has no todos yet."""
+    try:
+        return TodoSummary.objects.get(owner=profile)
+    except TodoSummary.DoesNotExist:
+        return TodoSummary(owner=profile)
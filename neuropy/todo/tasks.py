@@ -0,0 +1,79 @@
+"""Background jobs for planning, importing and exporting todos."""
+
+import tempfile
+import uuid
+
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.utils.dateparse import parse_date
+
+from jobs.queue import JobFailed, task
+from todo import scheduler, week
+from todo.export import CONTENT_TYPES, export_lines
+from todo.importer import import_stream
+from userprofile.models import Profile
+
+
+def get_profile(profile_id):
+    """Return a profile, failing the job if it was deleted."""
+    try:
+        return Profile.objects.get(pk=profile_id)
+    except Profile.DoesNotExist:
+        raise JobFailed('The profile no longer exists.')
+
+
+@task('todo.plan_day')
+def plan_day(profile_id, day):
+    """Plan and store a profile's day."""
+    profile = get_profile(profile_id)
+    day = parse_date(day)
+    plan = scheduler.day_plan(profile, day)
+    scheduler.store_plans(day, {profile.pk: plan})
+    return {'day': str(day), 'planned': len(plan.entries)}
+
+
+@task('todo.plan_week')
+def plan_week(profile_id, day, days):
+    """Plan and store several days of a profile, starting on ``day``."""
+    profile = get_profile(profile_id)
+    plans = week.week_plans(profile, parse_date(day), days)
+    week.store_week(profile, plans)
+    return {'days': [str(each) for each in sorted(plans)],
+            'planned': sum(len(plan.entries) for plan in plans.values())}
+
+
+def delete_upload(path, **payload):
+    """Delete the upload of an import job that failed for good."""
+    if default_storage.exists(path):
+        default_storage.delete(path)
+
+
+@task('todo.import_todos', on_failure=delete_upload)
+def import_todos(profile_id, path, fmt, batch_size):
+    """Import an uploaded file of todos, then delete the upload."""
+    profile = get_profile(profile_id)
+    try:
+        with default_storage.open(path, 'rb') as stream:
+            result = import_stream(profile, stream, fmt, batch_size)
+    except ValueError as error:
+        raise JobFailed(str(error))
+    default_storage.delete(path)
+    return {
+        'created': result.created,
+        'errors': [{'row': row, 'error': message}
+                   for row, message in result.errors],
+    }
+
+
+@task('todo.export_todos')
+def export_todos(profile_id, fmt):
+    """Write all of a profile's todos to a file for download."""
+    profile = get_profile(profile_id)
+    with tempfile.TemporaryFile() as export:
+        for line in export_lines(profile, fmt):
+            export.write(line.encode('utf-8'))
+        export.seek(0)
+        name = default_storage.save(
+            'exports/{}.{}'.format(uuid.uuid4().hex, fmt), File(export))
+    return {'file': name, 'filename': 'todos.{}'.format(fmt),
+            'content_type': CONTENT_TYPES[fmt]}
@@ -1,10 +1,35 @@
 """Test for todo app."""
 
+import json
+import shutil
+import tempfile
+from datetime import date, datetime, time, timedelta
+from io import BytesIO
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.db import DatabaseError, connection
 from django.test import TestCase
-from todo.models import Todo
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.six import StringIO
+from jobs.models import Job
+from jobs.queue import work
+from todo.archive import archive_todos
+from todo.models import ArchivedTodo, Plan, PlanEntry, Todo, TodoSummary
+from todo import scheduler, slots, summary, tasks, week
+from todo.feed import feed_url
+from todo.intervals import IntervalIndex
+from todo.pagination import iter_values, keyset_page
+from todo.ranking import best_todos, top_rows
+from todo.summary import rebuild_summaries, summary_for
 from django.contrib.auth.models import User, Group
-from userprofile.models import Profile
+from userprofile.energy import slot_of
+from userprofile.ics import import_calendar
+from userprofile.models import BusyBlock, Profile
 import factory
+import numpy as np
 
 
 class TodoFactory(factory.django.DjangoModelFactory):
@@ -90,3 +115,1231 @@ class UserTestCase(TestCase):
         """Test str method on todo returns the title."""
         todo = Todo.objects.first()
         self.assertTrue(str(todo) == todo.title)
+
+
+class SchedulerTestCase(TestCase):
+    """Test the day plan scheduler."""
+
+    def setUp(self):
+        """Make a profile with a spread of todos."""
+        add_user_group()
+        self.profile = UserFactory.create().profile
+        self.day = date(2017, 3, 1)
+        self.now = timezone.make_aware(datetime(2017, 2, 28, 20, 0))
+        self.hard = TodoFactory.create(owner=self.profile, ease=3,
+                                       priority=1, duration=60)
+        self.easy = TodoFactory.create(owner=self.profile, ease=1,
+                                       priority=1, duration=60)
+        self.later = TodoFactory.create(owner=self.profile, ease=2,
+                                        priority=4, duration=30)
+
+    def test_energy_curve_is_zero_outside_active_period(self):
+        """Test no energy is available before or after the active period."""
+        curve = scheduler.energy_curve(self.profile)
+        self.assertTrue(len(curve) == scheduler.SLOTS_PER_DAY)
+        self.assertTrue(curve[:slot_of(time(8))].max() == 0)
+        self.assertTrue(curve[slot_of(time(22)):].max() == 0)
+        self.assertTrue(curve[slot_of(time(9))] > 0)
+
+    def test_energy_curve_peaks_in_peak_period(self):
+        """Test the curve is higher in the peak period than the evening."""
+        curve = scheduler.energy_curve(self.profile)
+        morning = curve[slot_of(time(9, 30))]
+        evening = curve[slot_of(time(20))]
+        self.assertTrue(morning > evening)
+
+    def test_load_todos_builds_arrays(self):
+        """Test todos are loaded as column arrays."""
+        todos = scheduler.load_todos(self.profile)
+        self.assertTrue(len(todos) == 3)
+        self.assertTrue(sorted(todos.id) == sorted(
+            [self.hard.id, self.easy.id, self.later.id]))
+        self.assertTrue(np.isnan(todos.date).all())
+
+    def test_plan_day_places_every_todo_without_overlap(self):
+        """Test planned todos all fit and never overlap."""
+        plan = scheduler.plan_day(self.profile, self.day, self.now)
+        self.assertTrue(len(plan) == 3)
+        for first, second in zip(plan, plan[1:]):
+            self.assertTrue(first.end <= second.start)
+
+    def test_hard_todo_gets_more_energy_than_easy_todo(self):
+        """Test difficult todos are placed at higher energy times."""
+        curve = scheduler.energy_curve(self.profile)
+        plan = dict((item.todo_id, item) for item in
+                    scheduler.plan_day(self.profile, self.day, self.now))
+
+        def energy(todo):
+            start = timezone.localtime(plan[todo.id].start).time()
+            return curve[slot_of(start)]
+
+        self.assertTrue(energy(self.hard) > energy(self.easy))
+
+    def test_todo_longer_than_the_day_is_not_placed(self):
+        """Test a todo that cannot fit is left out of the plan."""
+        TodoFactory.create(owner=self.profile, priority=1, duration=24 * 60)
+        plan = scheduler.plan_day(self.profile, self.day, self.now)
+        self.assertTrue(len(plan) == 3)
+
+    def test_passed_slots_are_not_used_today(self):
+        """Test nothing is planned before the current time."""
+        now = timezone.make_aware(datetime(2017, 3, 1, 13, 2))
+        plan = scheduler.plan_day(self.profile, self.day, now)
+        self.assertTrue(all(item.start >= now for item in plan))
+
+    def test_busy_blocks_are_planned_around(self):
+        """Test nothing is planned during busy time."""
+        start = scheduler.slot_datetime(self.day, slot_of(time(8)))
+        end = scheduler.slot_datetime(self.day, slot_of(time(12)))
+        BusyBlock.objects.create(owner=self.profile, start=start, end=end)
+        plan = scheduler.plan_day(self.profile, self.day, self.now)
+        self.assertTrue(len(plan) == 3)
+        self.assertTrue(all(item.end <= start or item.start >= end
+                            for item in plan))
+
+    def test_busy_slots_cover_partly_busy_slots(self):
+        """Test a block marks every slot it touches on its own day."""
+        start = scheduler.slot_datetime(self.day, 10) + timedelta(minutes=1)
+        BusyBlock.objects.create(owner=self.profile, start=start,
+                                 end=start + timedelta(minutes=10))
+        BusyBlock.objects.create(
+            owner=self.profile, start=start - timedelta(days=2),
+            end=start - timedelta(days=1))
+        busy = scheduler.busy_slots(
+            scheduler.load_busy(self.profile, self.day), self.day)
+        self.assertTrue(list(np.flatnonzero(busy)) == [10, 11, 12])
+
+    def test_free_windows_are_inside_active_period(self):
+        """Test free windows skip busy time and inactive hours."""
+        BusyBlock.objects.create(
+            owner=self.profile,
+            start=scheduler.slot_datetime(self.day, slot_of(
+                time(12))),
+            end=scheduler.slot_datetime(self.day, slot_of(
+                time(13))))
+        windows = [(timezone.localtime(start).time(),
+                    timezone.localtime(end).time())
+                   for start, end in scheduler.free_windows(
+                       self.profile,
+                       scheduler.load_busy(self.profile, self.day),
+                       self.day)]
+        self.assertTrue(windows == [(time(8), time(12)),
+                                    (time(13), time(22))])
+
+
+class SlotBitmapTestCase(TestCase):
+    """Test the packed slot bitmaps."""
+
+    def test_pack_round_trip(self):
+        """Test a day packs into a few bytes and back."""
+        mask = np.random.RandomState(3).rand(scheduler.SLOTS_PER_DAY) > 0.5
+        blob = slots.pack(mask)
+        self.assertTrue(len(blob) == 36)
+        self.assertTrue((slots.unpack(blob) == mask).all())
+
+    def test_run_starts_match_window_sums(self):
+        """Test bit doubling finds the same runs as summing windows."""
+        free = np.random.RandomState(7).rand(scheduler.SLOTS_PER_DAY) > 0.2
+        for width in (1, 2, 3, 5, 8, 13):
+            expected = scheduler.window_sums(free, width) == width
+            found = slots.run_starts(free, width)
+            self.assertTrue((found[:len(expected)] == expected).all())
+            self.assertTrue(not found[len(expected):].any())
+
+    def test_run_starts_stay_within_a_day(self):
+        """Test runs in a mask of several days never cross midnight."""
+        free = np.zeros((2, scheduler.SLOTS_PER_DAY), dtype=bool)
+        free[0, -3:] = True
+        free[1, :3] = True
+        self.assertTrue(not slots.run_starts(free, 4).any())
+        self.assertTrue(slots.run_starts(free, 3)[0, -3])
+
+
+class IntervalIndexTestCase(TestCase):
+    """Test the sorted-array interval index."""
+
+    def setUp(self):
+        """Index a few intervals, one of them long."""
+        self.index = IntervalIndex([50, 0, 10, 30], [60, 100, 20, 40])
+
+    def test_overlapping_finds_long_and_short_intervals(self):
+        """Test every interval crossing a window is found."""
+        starts, ends = self.index.overlapping(15, 35)
+        self.assertTrue(list(starts) == [0, 10, 30])
+        self.assertTrue(list(ends) == [100, 20, 40])
+
+    def test_touching_intervals_do_not_overlap(self):
+        """Test intervals are half open."""
+        index = IntervalIndex([0, 20], [10, 30])
+        self.assertTrue(not index.overlaps(10, 20))
+        self.assertTrue(index.overlaps(5, 15))
+
+    def test_free_windows_between_intervals(self):
+        """Test the gaps between intervals are returned."""
+        index = IntervalIndex([10, 15, 40], [20, 25, 50])
+        self.assertTrue(index.free_windows(0, 45) == [(0, 10), (25, 40)])
+        self.assertTrue(self.index.free_windows(0, 100) == [])
+
+    def test_empty_index(self):
+        """Test an empty index leaves the whole window free."""
+        index = IntervalIndex([], [])
+        self.assertTrue(len(index) == 0)
+        self.assertTrue(index.free_windows(0, 10) == [(0, 10)])
+
+
+class GeneratePlansTestCase(TestCase):
+    """Test the generate_plans management command."""
+
+    def setUp(self):
+        """Make profiles with todos."""
+        self.day = timezone.localtime(timezone.now()).date() + timedelta(1)
+        add_user_group()
+        self.users = [UserFactory.create() for i in range(5)]
+        for user in self.users:
+            TodoFactory.create(owner=user.profile, duration=30)
+            TodoFactory.create(owner=user.profile, duration=45)
+
+    def generate(self, **options):
+        """Run the command for a fixed day in this process."""
+        out = StringIO()
+        call_command('generate_plans', day=str(self.day), processes=1,
+                     chunk_size=2, stdout=out, **options)
+        return out.getvalue()
+
+    def test_plan_made_for_every_profile(self):
+        """Test every profile gets a plan with its todos placed."""
+        self.generate()
+        self.assertTrue(Plan.objects.filter(day=self.day).count() == 5)
+        self.assertTrue(PlanEntry.objects.count() == 10)
+
+    def test_reports_throughput(self):
+        """Test the command reports profiles per second."""
+        output = self.generate()
+        self.assertTrue('Planned 5 profiles' in output)
+        self.assertTrue('profiles/sec' in output)
+
+    def test_rerun_resumes_without_replanning(self):
+        """Test profiles that already have a plan are skipped."""
+        self.generate()
+        Plan.objects.filter(owner=self.users[0].profile).delete()
+        output = self.generate()
+        self.assertTrue('Planned 1 profiles' in output)
+        self.assertTrue(PlanEntry.objects.count() == 10)
+
+    def test_force_replans_and_bumps_version(self):
+        """Test forcing a rerun replaces plans with a new version."""
+        self.generate()
+        self.generate(force=True)
+        self.assertTrue(Plan.objects.count() == 5)
+        self.assertTrue(PlanEntry.objects.count() == 10)
+        self.assertTrue(set(Plan.objects.values_list('version', flat=True))
+                        == set([2]))
+
+    def test_plans_keep_occupancy_bitmap(self):
+        """Test a plan stores the slots its todos and idle hours take."""
+        self.generate()
+        plan = Plan.objects.get(owner=self.users[0].profile)
+        self.assertTrue(len(bytes(plan.occupancy)) == slots.SLOT_BYTES)
+        taken = slots.unpack(plan.occupancy)
+        self.assertTrue(taken[:slot_of(time(8))].all())
+        for entry in plan.entries.all():
+            first = slot_of(timezone.localtime(entry.start).time())
+            self.assertTrue(taken[first])
+        self.assertTrue(taken.sum() == scheduler.SLOTS_PER_DAY - 14 * 12 +
+                        6 + 9)
+
+
+class TodoListTestCase(TestCase):
+    """Test the keyset paginated todo listing."""
+
+    def setUp(self):
+        """Make a logged in user with dated and undated todos."""
+        add_user_group()
+        self.user = UserFactory.create()
+        start = timezone.make_aware(datetime(2017, 3, 1, 9))
+        for i in range(7):
+            TodoFactory.create(owner=self.user.profile, priority=i % 4 + 1,
+                               date=start + timedelta(hours=i % 3))
+        for i in range(3):
+            TodoFactory.create(owner=self.user.profile, priority=i + 1)
+        TodoFactory.create(owner=UserFactory.create().profile)
+        self.client.force_login(self.user)
+
+    def fetch_all(self, order, limit=3):
+        """Follow cursors until the last page."""
+        ids, pages, cursor = [], 0, None
+        while True:
+            params = {'order': order, 'limit': limit}
+            if cursor:
+                params['cursor'] = cursor
+            data = self.client.get(reverse('todo-list'), params).json()
+            ids.extend(row['id'] for row in data['results'])
+            pages += 1
+            cursor = data['next']
+            if not cursor:
+                return ids, pages
+
+    def test_pages_cover_every_todo_once_by_date(self):
+        """Test paging by date returns each todo once, in order."""
+        ids, pages = self.fetch_all('date')
+        expected = Todo.objects.filter(owner=self.user.profile).order_by(
+            'date', 'id').values_list('id', flat=True)
+        self.assertTrue(ids == list(expected))
+        self.assertTrue(pages == 4)
+
+    def test_pages_cover_every_todo_once_by_priority(self):
+        """Test paging by priority returns each todo once, in order."""
+        ids, pages = self.fetch_all('priority', limit=4)
+        expected = Todo.objects.filter(owner=self.user.profile).order_by(
+            'priority', 'date', 'id').values_list('id', flat=True)
+        self.assertTrue(ids == list(expected))
+
+    def test_next_page_is_bounded_on_the_leading_column(self):
+        """Test a cursor adds a range the index can start from."""
+        queryset = Todo.objects.filter(owner=self.user.profile)
+        rows, cursor = keyset_page(queryset, 'priority', limit=4)
+        with CaptureQueriesContext(connection) as queries:
+            keyset_page(queryset, 'priority', cursor, limit=4)
+        sql = queries.captured_queries[-1]['sql']
+        self.assertTrue('"todo_todo"."priority" >= {}'.format(
+            rows[-1]['priority']) in sql)
+        rows, cursor = keyset_page(queryset, 'date', limit=5)
+        with CaptureQueriesContext(connection) as queries:
+            keyset_page(queryset, 'date', cursor, limit=5)
+        self.assertTrue('"todo_todo"."date" >= ' in
+                        queries.captured_queries[-1]['sql'])
+
+    def test_only_own_todos_listed(self):
+        """Test other users' todos are not listed."""
+        ids, pages = self.fetch_all('date', limit=100)
+        self.assertTrue(len(ids) == 10)
+        self.assertTrue(pages == 1)
+
+    def test_bad_cursor_is_rejected(self):
+        """Test a malformed cursor gives a bad request."""
+        response = self.client.get(reverse('todo-list'), {'cursor': 'nope'})
+        self.assertTrue(response.status_code == 400)
+
+    def test_listing_requires_login(self):
+        """Test anonymous users are redirected to log in."""
+        self.client.logout()
+        response = self.client.get(reverse('todo-list'))
+        self.assertTrue(response.status_code == 302)
+
+
+class TodoExportTestCase(TestCase):
+    """Test the streaming todo export."""
+
+    def setUp(self):
+        """Make a logged in user with todos."""
+        add_user_group()
+        self.user = UserFactory.create()
+        self.todos = [TodoFactory.create(owner=self.user.profile)
+                      for i in range(5)]
+        TodoFactory.create(owner=UserFactory.create().profile)
+        self.client.force_login(self.user)
+
+    def export(self, fmt):
+        """Fetch an export and join the streamed content."""
+        response = self.client.get(reverse('todo-export', args=[fmt]))
+        self.assertTrue(response.streaming)
+        return response, b''.join(response.streaming_content).decode('utf-8')
+
+    def test_csv_export_has_header_and_rows(self):
+        """Test the CSV export has a header and one line per todo."""
+        response, content = self.export('csv')
+        lines = content.strip().splitlines()
+        self.assertTrue(response['Content-Type'] == 'text/csv')
+        self.assertTrue(lines[0].startswith('id,title,description'))
+        self.assertTrue(len(lines) == 6)
+
+    def test_json_export_is_valid_json(self):
+        """Test the JSON export parses to the user's todos."""
+        response, content = self.export('json')
+        rows = json.loads(content)
+        self.assertTrue([row['id'] for row in rows] ==
+                        [todo.id for todo in self.todos])
+        self.assertTrue(rows[0]['title'] == self.todos[0].title)
+
+    def test_empty_json_export(self):
+        """Test a user without todos gets an empty array."""
+        self.client.force_login(UserFactory.create())
+        response, content = self.export('json')
+        self.assertTrue(json.loads(content) == [])
+
+    def test_export_reads_in_chunks(self):
+        """Test rows are fetched a chunk at a time."""
+        rows = list(iter_values(Todo.objects.filter(owner=self.user.profile),
+                                ('title',), chunk_size=2))
+        self.assertTrue(rows == [(todo.title,) for todo in self.todos])
+
+
+class PlanFeedTestCase(TestCase):
+    """Test the iCalendar feed of stored plans."""
+
+    def setUp(self):
+        """Store a plan for tomorrow with two todos."""
+        add_user_group()
+        self.profile = UserFactory.create().profile
+        self.day = timezone.localtime(timezone.now()).date() + timedelta(1)
+        self.todos = [
+            TodoFactory.create(owner=self.profile, title='Write, report'),
+            TodoFactory.create(owner=self.profile, title='x' * 200),
+        ]
+        scheduler.store_plans(self.day, {self.profile.pk: [
+            scheduler.PlannedTodo(
+                todo.pk,
+                scheduler.slot_datetime(self.day, 100 + index * 12),
+                scheduler.slot_datetime(self.day, 106 + index * 12))
+            for index, todo in enumerate(self.todos)]})
+        self.url = feed_url(self.profile)
+
+    def fetch(self, **headers):
+        """Fetch the feed, joining streamed content."""
+        response = self.client.get(self.url, **headers)
+        content = b''
+        if response.streaming:
+            content = b''.join(response.streaming_content)
+        return response, content.decode('utf-8')
+
+    def test_feed_lists_planned_todos(self):
+        """Test each planned todo is a VEVENT of a valid calendar."""
+        response, content = self.fetch()
+        self.assertTrue(response.status_code == 200)
+        self.assertTrue(response['Content-Type'].startswith('text/calendar'))
+        self.assertTrue(content.startswith('BEGIN:VCALENDAR\r\n'))
+        self.assertTrue(content.endswith('END:VCALENDAR\r\n'))
+        self.assertTrue(content.count('BEGIN:VEVENT') == 2)
+        self.assertTrue('SUMMARY:Write\\, report\r\n' in content)
+        self.assertTrue(all(len(line.encode('utf-8')) <= 75
+                            for line in content.split('\r\n')))
+
+    def test_matching_etag_gets_not_modified_without_todo_queries(self):
+        """Test a poll with the current ETag is answered from plans."""
+        etag = self.fetch()[0]['ETag']
+        with CaptureQueriesContext(connection) as queries:
+            response, content = self.fetch(HTTP_IF_NONE_MATCH=etag)
+        self.assertTrue(response.status_code == 304)
+        self.assertTrue(content == '')
+        self.assertTrue(not any('todo_todo' in query['sql']
+                                for query in queries.captured_queries))
+
+    def test_etag_changes_with_plan_version(self):
+        """Test a patched plan invalidates the feed's ETag."""
+        etag = self.fetch()[0]['ETag']
+        todo = Todo.objects.get(pk=self.todos[0].pk)
+        todo.duration = 20
+        todo.save()
+        response = self.fetch(HTTP_IF_NONE_MATCH=etag)[0]
+        self.assertTrue(response.status_code == 200)
+        self.assertTrue(response['ETag'] != etag)
+
+    def test_etag_changes_with_todo_title(self):
+        """Test renaming a planned todo invalidates the feed's ETag."""
+        etag = self.fetch()[0]['ETag']
+        todo = Todo.objects.get(pk=self.todos[0].pk)
+        todo.title = 'Write the summary'
+        todo.save()
+        response, content = self.fetch(HTTP_IF_NONE_MATCH=etag)
+        self.assertTrue(response.status_code == 200)
+        self.assertTrue('SUMMARY:Write the summary\r\n' in content)
+
+    def test_reset_revokes_the_old_feed_url(self):
+        """Test a new feed key makes the old URL stop working."""
+        self.client.force_login(self.profile.user)
+        response = self.client.post(reverse('plan-feed-reset'))
+        self.assertTrue(response.status_code == 302)
+        self.assertTrue(self.client.get(self.url).status_code == 404)
+        profile = Profile.objects.get(pk=self.profile.pk)
+        self.assertTrue(self.client.get(feed_url(profile)).status_code ==
+                        200)
+
+    def test_bad_token_is_not_found(self):
+        """Test a tampered feed URL is refused."""
+        response = self.client.get(self.url.replace('.ics', 'x.ics'))
+        self.assertTrue(response.status_code == 404)
+
+
+class TodoImportTestCase(TestCase):
+    """Test the bulk todo import."""
+
+    def setUp(self):
+        """Make a logged in user."""
+        add_user_group()
+        self.user = UserFactory.create()
+        self.client.force_login(self.user)
+
+    def post(self, body, fmt, batch_size=2):
+        """Post a raw import body."""
+        return self.client.post(
+            '{}?format={}&batch_size={}&inline=1'.format(
+                reverse('todo-import'), fmt, batch_size),
+            body, content_type='text/plain')
+
+    def test_csv_import_creates_todos_and_reports_bad_rows(self):
+        """Test valid rows are imported and invalid rows reported."""
+        body = ('title,ease,priority,duration,date\n'
+                'Read,1,2,30,2017-03-01T09:00:00\n'
+                'Write,5,2,30,\n'
+                'Call,2,,15,\n'
+                'Walk,x,1,10,\n'
+                'Run,3,9,0,\n')
+        data = self.post(body, 'csv').json()
+        self.assertTrue(data['created'] == 2)
+        self.assertTrue([error['row'] for error in data['errors']] ==
+                        [2, 4, 5])
+        titles = set(Todo.objects.filter(
+            owner=self.user.profile).values_list('title', flat=True))
+        self.assertTrue(titles == set(['Read', 'Call']))
+        self.assertTrue(Todo.objects.get(title='Call').priority == 4)
+
+    def test_json_array_import(self):
+        """Test a JSON array of todos is imported."""
+        body = json.dumps([{'title': 'Todo {}'.format(i), 'ease': 2}
+                           for i in range(5)])
+        data = self.post(body, 'json').json()
+        self.assertTrue(data == {'created': 5, 'errors': []})
+        self.assertTrue(Todo.objects.filter(ease=2).count() == 5)
+
+    def test_json_lines_import(self):
+        """Test JSON lines are imported one object per line."""
+        body = '{"title": "One"}\n{"title": "Two", "priority": 0}\n'
+        data = self.post(body, 'json').json()
+        self.assertTrue(data['created'] == 1)
+        self.assertTrue(data['errors'][0]['row'] == 2)
+
+    def test_broken_json_imports_nothing(self):
+        """Test an unreadable file is rejected as a whole."""
+        response = self.post('[{"title": "One"}, {"title": ', 'json')
+        self.assertTrue(response.status_code == 400)
+        self.assertFalse(Todo.objects.exists())
+
+    def test_import_command(self):
+        """Test the import_todos management command."""
+        with tempfile.NamedTemporaryFile(suffix='.csv') as upload:
+            upload.write(b'title,ease\nOne,1\nTwo,4\nThree,3\n')
+            upload.flush()
+            out, err = StringIO(), StringIO()
+            call_command('import_todos', self.user.username, upload.name,
+                         batch_size=2, stdout=out, stderr=err)
+        self.assertTrue('Imported 2 todos, skipped 1 rows.' in out.getvalue())
+        self.assertTrue('Row 2: ease' in err.getvalue())
+
+
+class BackgroundJobTestCase(TestCase):
+    """Test imports, exports and planning queued as background jobs."""
+
+    def setUp(self):
+        """Make a logged in user and a media root for files."""
+        add_user_group()
+        self.user = UserFactory.create()
+        self.client.force_login(self.user)
+        self.media = tempfile.mkdtemp()
+        self.settings = override_settings(MEDIA_ROOT=self.media)
+        self.settings.enable()
+
+    def tearDown(self):
+        """Remove stored files."""
+        self.settings.disable()
+        shutil.rmtree(self.media)
+
+    def run_job(self, response):
+        """Run the job a response queued and return its status."""
+        self.assertTrue(response.status_code == 202)
+        self.assertTrue(Job.objects.get(pk=response.json()['id']).status ==
+                        Job.QUEUED)
+        work(burst=True)
+        return self.client.get(response['Location']).json()
+
+    def test_background_import(self):
+        """Test an upload is imported by a worker, not the request."""
+        response = self.client.post(
+            '{}?format=csv'.format(reverse('todo-import')),
+            'title\nOne\nTwo\n', content_type='text/plain')
+        self.assertTrue(Todo.objects.count() == 0)
+        status = self.run_job(response)
+        self.assertTrue(status['status'] == 'done')
+        self.assertTrue(status['result'] == {'created': 2, 'errors': []})
+        self.assertTrue(Todo.objects.filter(
+            owner=self.user.profile).count() == 2)
+
+    def test_background_export_can_be_downloaded(self):
+        """Test an export job writes a file its owner can download."""
+        TodoFactory.create(owner=self.user.profile, title='Exported')
+        status = self.run_job(self.client.post(
+            reverse('todo-export', args=['csv'])))
+        response = self.client.get(status['download'])
+        content = b''.join(response.streaming_content).decode('utf-8')
+        self.assertTrue(content.splitlines()[0].startswith('id,title'))
+        self.assertTrue('Exported' in content)
+
+    def test_export_is_not_queued_by_a_get(self):
+        """Test a GET streams the export and only a POST queues a job."""
+        response = self.client.get(reverse('todo-export', args=['csv']))
+        self.assertTrue(response.streaming)
+        self.assertTrue(not Job.objects.exists())
+
+    def test_failed_import_deletes_its_upload(self):
+        """Test an import out of attempts leaves no upload behind."""
+        response = self.client.post(
+            '{}?format=csv'.format(reverse('todo-import')),
+            'title\nOne\n', content_type='text/plain')
+        job = Job.objects.get(pk=response.json()['id'])
+        path = json.loads(job.payload)['path']
+        self.assertTrue(default_storage.exists(path))
+        Job.objects.filter(pk=job.pk).update(max_attempts=1)
+
+        def import_stream(*args):
+            """Fail the way a lost database connection would."""
+            raise RuntimeError('Connection lost.')
+
+        original, tasks.import_stream = tasks.import_stream, import_stream
+        try:
+            work(burst=True)
+        finally:
+            tasks.import_stream = original
+        job.refresh_from_db()
+        self.assertTrue(job.status == Job.FAILED)
+        self.assertFalse(default_storage.exists(path))
+
+    def test_plan_request_plans_tomorrow(self):
+        """Test asking for a plan queues one for tomorrow."""
+        TodoFactory.create(owner=self.user.profile, duration=30)
+        status = self.run_job(self.client.post(reverse('plan-request')))
+        tomorrow = timezone.localtime(timezone.now()).date() + timedelta(1)
+        self.assertTrue(status['result'] == {'day': str(tomorrow),
+                                             'planned': 1})
+        self.assertTrue(Plan.objects.get(
+            owner=self.user.profile).day == tomorrow)
+
+    def test_plan_request_plans_several_days(self):
+        """Test asking for several days queues one plan for all of them."""
+        TodoFactory.create(owner=self.user.profile, duration=30)
+        status = self.run_job(self.client.post(reverse('plan-request'),
+                                               {'days': 3}))
+        self.assertTrue(len(status['result']['days']) == 3)
+        self.assertTrue(status['result']['planned'] == 1)
+        self.assertTrue(Plan.objects.filter(
+            owner=self.user.profile).count() == 3)
+
+    def test_plan_request_rejects_bad_days(self):
+        """Test a number of days out of range is refused."""
+        response = self.client.post(reverse('plan-request'), {'days': 99})
+        self.assertTrue(response.status_code == 400)
+        self.assertTrue(not Job.objects.exists())
+
+    def test_plan_request_rejects_bad_day(self):
+        """Test an unreadable day is refused without queueing."""
+        response = self.client.post(reverse('plan-request'),
+                                    {'day': '2017-02-30'})
+        self.assertTrue(response.status_code == 400)
+        self.assertTrue(not Job.objects.exists())
+
+
+class NextTodosTestCase(TestCase):
+    """Test the top-k todos for the current moment."""
+
+    def setUp(self):
+        """Make a profile with easy and hard todos of equal priority."""
+        add_user_group()
+        self.user = UserFactory.create()
+        self.profile = self.user.profile
+        self.easy = TodoFactory.create(owner=self.profile, priority=2,
+                                       ease=1, duration=30)
+        self.hard = TodoFactory.create(owner=self.profile, priority=2,
+                                       ease=3, duration=30)
+        for i in range(20):
+            TodoFactory.create(owner=self.profile, priority=4, ease=2)
+        self.day = date(2017, 3, 1)
+
+    def at(self, hour, minute=0):
+        """An aware time on the test day."""
+        return timezone.make_aware(datetime.combine(self.day,
+                                                    time(hour, minute)))
+
+    def ids(self, k, now):
+        """Ids of the best ``k`` todos at ``now``."""
+        return [row['id'] for row in best_todos(self.profile, k, now)[1]]
+
+    def test_energy_decides_between_easy_and_hard(self):
+        """Test hard work comes first at peak energy, easy work later."""
+        self.assertTrue(self.ids(2, self.at(9, 30)) ==
+                        [self.hard.pk, self.easy.pk])
+        self.assertTrue(self.ids(2, self.at(21, 0)) ==
+                        [self.easy.pk, self.hard.pk])
+
+    def test_deadline_and_length_move_todos(self):
+        """Test a due todo rises and one too long for the day sinks."""
+        now = self.at(21, 0)
+        due = TodoFactory.create(owner=self.profile, priority=4, ease=2,
+                                 date=now + timedelta(hours=1))
+        self.assertTrue(self.ids(1, now) == [due.pk])
+        Todo.objects.filter(pk=due.pk).update(duration=120)
+        self.assertFalse(due.pk in self.ids(2, now))
+
+    def test_due_todo_beats_more_than_a_batch_of_others(self):
+        """Test a todo due soon is found behind a full batch of others."""
+        now = self.at(21, 0)
+        for i in range(10):
+            TodoFactory.create(owner=self.profile, priority=2, ease=1,
+                               duration=30)
+        due = TodoFactory.create(owner=self.profile, priority=3, ease=1,
+                                 duration=30, date=now + timedelta(hours=1))
+        self.assertTrue(self.ids(1, now) == [due.pk])
+
+    def test_only_a_few_rows_are_fetched(self):
+        """Test the database scores, orders and limits the rows."""
+        with CaptureQueriesContext(connection) as queries:
+            level, rows = best_todos(self.profile, 2, self.at(10))
+        sql = queries.captured_queries[-1]['sql']
+        self.assertTrue('CASE WHEN' in sql and 'LIMIT 6' in sql)
+        self.assertTrue(len(rows) == 2)
+        self.assertTrue(rows[0]['score'] >= rows[1]['score'])
+
+    def test_heap_selection_matches_full_sort(self):
+        """Test partial selection returns what a full sort would."""
+        rows = [{'id': i, 'value': (i * 37) % 11} for i in range(100)]
+        best = top_rows(iter(rows), 5, lambda row: row['value'])
+        expected = sorted(rows, key=lambda row: (-row['value'], row['id']))
+        self.assertTrue(best == expected[:5])
+
+    def test_endpoint_returns_level_and_todos(self):
+        """Test the endpoint lists k todos with scores."""
+        self.client.force_login(self.user)
+        data = self.client.get(reverse('todo-next'), {'k': 3}).json()
+        self.assertTrue(len(data['results']) == 3)
+        self.assertTrue(0 <= data['energy'] <= 1)
+        self.assertTrue('score' in data['results'][0])
+
+
+class TodoSummaryTestCase(TestCase):
+    """Test the per-profile todo counters."""
+
+    def setUp(self):
+        """Make a profile with a few todos."""
+        add_user_group()
+        self.user = UserFactory.create()
+        self.profile = self.user.profile
+        self.todo = TodoFactory.create(owner=self.profile, priority=1,
+                                       ease=3, duration=30)
+        TodoFactory.create(owner=self.profile, priority=4, ease=1,
+                           duration=10)
+
+    def counters(self, profile=None):
+        """Stored counters of a profile as a dict."""
+        summary = summary_for(profile or self.profile)
+        return dict((name, getattr(summary, name))
+                    for name in ('total', 'total_duration', 'priority_1',
+                                 'priority_4', 'ease_1', 'ease_3'))
+
+    def recounted(self):
+        """Counters rebuilt from the todo table."""
+        rebuild_summaries()
+        return self.counters()
+
+    def test_created_todos_are_counted(self):
+        """Test creating todos moves the counters."""
+        self.assertTrue(self.counters() == {
+            'total': 2, 'total_duration': 40, 'priority_1': 1,
+            'priority_4': 1, 'ease_1': 1, 'ease_3': 1})
+
+    def test_changed_todo_moves_counts(self):
+        """Test an edit moves counts between buckets."""
+        todo = Todo.objects.get(pk=self.todo.pk)
+        todo.priority, todo.ease, todo.duration = 4, 1, 5
+        todo.save()
+        counters = self.counters()
+        self.assertTrue(counters['priority_1'] == 0)
+        self.assertTrue(counters['priority_4'] == 2)
+        self.assertTrue(counters['ease_1'] == 2)
+        self.assertTrue(counters['total_duration'] == 15)
+        self.assertTrue(counters == self.recounted())
+
+    def test_saving_twice_counts_the_change_once(self):
+        """Test a resaved todo is counted from the values it was saved with."""
+        todo = Todo.objects.get(pk=self.todo.pk)
+        todo.priority = 4
+        todo.save()
+        todo.title = 'Renamed'
+        todo.save()
+        self.assertTrue(self.counters()['priority_4'] == 2)
+        self.assertTrue(self.counters() == self.recounted())
+
+    def test_counts_move_in_the_saving_transaction(self):
+        """Test a rebuild cannot fall between a save and its counts."""
+        original = summary.count_change
+
+        def rebuild_then_fail(todo, created):
+            """Rebuild where a concurrent one could, then fail the save."""
+            self.assertTrue(Todo.objects.filter(priority=2).exists())
+            rebuild_summaries([todo.owner_id])
+            raise DatabaseError('Counters locked.')
+
+        summary.count_change = rebuild_then_fail
+        try:
+            with self.assertRaises(DatabaseError):
+                TodoFactory.create(owner=self.profile, priority=2)
+        finally:
+            summary.count_change = original
+        self.assertFalse(Todo.objects.filter(priority=2).exists())
+        self.assertTrue(summary_for(self.profile).total == 2)
+        self.assertTrue(self.counters() == self.recounted())
+
+    def test_moved_and_deleted_todos(self):
+        """Test changing owner and deleting update both profiles."""
+        other = UserFactory.create().profile
+        todo = Todo.objects.get(pk=self.todo.pk)
+        todo.owner = other
+        todo.save()
+        self.assertTrue(self.counters()['total'] == 1)
+        self.assertTrue(self.counters(other)['total'] == 1)
+        todo.delete()
+        self.assertTrue(self.counters(other)['total'] == 0)
+        self.assertTrue(self.counters() == self.recounted())
+
+    def test_bulk_import_is_counted(self):
+        """Test rows imported with bulk_create are counted."""
+        self.client.force_login(self.user)
+        self.client.post(
+            '{}?format=csv&inline=1'.format(reverse('todo-import')),
+            'title,priority,duration\nA,1,5\nB,1,5\n',
+            content_type='text/plain')
+        self.assertTrue(self.counters()['priority_1'] == 3)
+        self.assertTrue(self.counters() == self.recounted())
+
+    def test_summary_endpoint_reads_one_row(self):
+        """Test the dashboard counts come from the summary alone."""
+        self.client.force_login(self.user)
+        self.client.get(reverse('todo-summary'))
+        with CaptureQueriesContext(connection) as queries:
+            data = self.client.get(reverse('todo-summary')).json()
+        self.assertTrue(data['total'] == 2)
+        self.assertTrue(data['ease_3'] == 1)
+        self.assertTrue(not any('todo_todo"' in query['sql']
+                                for query in queries.captured_queries))
+
+    def test_rebuild_command_repairs_counters(self):
+        """Test the repair command recounts drifted counters."""
+        Todo.objects.filter(pk=self.todo.pk).update(priority=2)
+        out = StringIO()
+        call_command('rebuild_todo_summaries', stdout=out)
+        self.assertTrue(summary_for(self.profile).priority_2 == 1)
+        self.assertTrue('Rebuilt 1 todo summaries' in out.getvalue())
+
+    def test_deleting_profile_deletes_summary(self):
+        """Test a profile's todos and counters go away together."""
+        self.user.delete()
+        self.assertTrue(not Todo.objects.exists())
+        self.assertTrue(not TodoSummary.objects.exists())
+
+
+class BenchmarkTestCase(TestCase):
+    """Test the benchmark management command."""
+
+    def test_benchmark_writes_percentiles(self):
+        """Test every scenario is timed and written as JSON."""
+        with tempfile.NamedTemporaryFile(suffix='.json') as output:
+            call_command('benchmark', users=2, todos=3, requests=2,
+                         in_place=True, output=output.name)
+            results = json.loads(open(output.name).read())
+        self.assertTrue(results['users'] == 2)
+        self.assertTrue(set(results['scenarios']) == set([
+            'signup', 'profile_view', 'edit_profile', 'todo_list',
+            'plan_generation', 'export_csv']))
+        for scenario in results['scenarios'].values():
+            self.assertTrue(scenario['p50_ms'] <= scenario['p99_ms'])
+            self.assertTrue(scenario['runs'] == 2)
+        self.assertTrue(results['peak_rss_kb'] > 0)
+
+    def test_benchmark_leaves_the_configured_cache_alone(self):
+        """Test the run clears a private cache, not the configured one."""
+        cache.set('benchmark-canary', 'kept')
+        call_command('benchmark', users=1, todos=1, requests=1,
+                     in_place=True, stdout=StringIO())
+        self.assertTrue(cache.get('benchmark-canary') == 'kept')
+
+
+class ReplanningTestCase(TestCase):
+    """Test plans are patched when a single todo changes."""
+
+    def setUp(self):
+        """Store a plan for tomorrow with three todos."""
+        add_user_group()
+        self.profile = UserFactory.create().profile
+        self.day = timezone.localtime(timezone.now()).date() + timedelta(1)
+        self.first = TodoFactory.create(owner=self.profile, duration=30)
+        self.second = TodoFactory.create(owner=self.profile, duration=30)
+        self.third = TodoFactory.create(owner=self.profile, duration=60)
+        scheduler.store_plans(self.day, {self.profile.pk: [
+            self.planned(self.first, time(9), time(9, 30)),
+            self.planned(self.second, time(9, 30), time(10)),
+            self.planned(self.third, time(14), time(15)),
+        ]})
+        self.plan = Plan.objects.get(owner=self.profile)
+
+    def planned(self, todo, start, end):
+        """A planned todo on the test day."""
+        return scheduler.PlannedTodo(
+            todo.pk,
+            timezone.make_aware(datetime.combine(self.day, start)),
+            timezone.make_aware(datetime.combine(self.day, end)))
+
+    def entries(self):
+        """Map todo ids to (entry id, local start, local end)."""
+        return dict(
+            (todo_id, (pk, timezone.localtime(start).time(),
+                       timezone.localtime(end).time()))
+            for pk, todo_id, start, end in PlanEntry.objects.values_list(
+                'id', 'todo', 'start', 'end'))
+
+    def version(self):
+        """Current version of the plan."""
+        return Plan.objects.get(pk=self.plan.pk).version
+
+    def test_growing_todo_displaces_only_the_overlapped_todo(self):
+        """Test a longer todo keeps its start and pushes its neighbour."""
+        before = self.entries()
+        todo = Todo.objects.get(pk=self.first.pk)
+        todo.duration = 60
+        todo.save()
+        after = self.entries()
+        self.assertTrue(after[self.first.pk][1:] == (time(9), time(10)))
+        self.assertFalse(after[self.second.pk][1] == time(9, 30))
+        self.assertTrue(after[self.third.pk] == before[self.third.pk])
+        self.assertTrue(after[self.first.pk][0] == before[self.first.pk][0])
+        self.assertTrue(self.version() == 2)
+
+    def test_growing_todo_leaves_more_urgent_neighbours_alone(self):
+        """Test a longer todo moves itself rather than a more urgent one."""
+        Todo.objects.filter(pk=self.second.pk).update(priority=1)
+        before = self.entries()
+        todo = Todo.objects.get(pk=self.first.pk)
+        todo.duration = 60
+        todo.save()
+        after = self.entries()
+        self.assertTrue(after[self.second.pk] == before[self.second.pk])
+        self.assertTrue(after[self.third.pk] == before[self.third.pk])
+        start, end = after[self.first.pk][1:]
+        self.assertTrue(end <= time(9, 30) or start >= time(10))
+
+    def test_renaming_an_unplanned_todo_leaves_plans_alone(self):
+        """Test a todo is not planned because its title changed."""
+        Todo.objects.bulk_create([Todo(owner=self.profile, title='Later',
+                                       duration=30)])
+        todo = Todo.objects.get(title='Later')
+        todo.title = 'Much later'
+        todo.save()
+        self.assertFalse(todo.pk in self.entries())
+        self.assertTrue(self.version() == 1)
+
+    def test_shrinking_todo_is_resized_in_place(self):
+        """Test a shorter todo keeps its slot and nothing else moves."""
+        before = self.entries()
+        todo = Todo.objects.get(pk=self.third.pk)
+        todo.duration = 15
+        todo.save()
+        after = self.entries()
+        self.assertTrue(after[self.third.pk][1:] == (time(14), time(14, 15)))
+        self.assertTrue(after[self.first.pk] == before[self.first.pk])
+        self.assertTrue(after[self.second.pk] == before[self.second.pk])
+
+    def test_unscheduled_change_leaves_plan_alone(self):
+        """Test saving a todo without changing it writes nothing."""
+        Todo.objects.get(pk=self.first.pk).save()
+        self.assertTrue(self.version() == 1)
+
+    def test_renamed_todo_keeps_its_slot(self):
+        """Test a new title only bumps the plan's version."""
+        before = self.entries()
+        todo = Todo.objects.get(pk=self.first.pk)
+        todo.title = 'Renamed'
+        todo.save()
+        self.assertTrue(self.entries() == before)
+        self.assertTrue(self.version() == 2)
+
+    def only_planned_slots(self):
+        """Leave the plan no room but the slots its todos take."""
+        Plan.objects.filter(pk=self.plan.pk).update(occupancy=slots.pack(
+            np.ones(scheduler.SLOTS_PER_DAY, dtype=bool)))
+
+    def test_raised_priority_takes_a_better_slot(self):
+        """Test a more urgent todo moves less urgent ones out of its way."""
+        self.only_planned_slots()
+        todo = Todo.objects.get(pk=self.third.pk)
+        todo.priority = 1
+        todo.ease = 3
+        todo.save()
+        after = self.entries()
+        self.assertTrue(after[self.third.pk][1:] == (time(9), time(10)))
+        self.assertTrue(after[self.first.pk][1] >= time(14))
+        self.assertTrue(after[self.second.pk][1] >= time(14))
+
+    def test_urgent_new_todo_displaces_less_urgent_ones(self):
+        """Test a new todo takes a full plan's slots when it scores more."""
+        self.only_planned_slots()
+        new = TodoFactory.create(owner=self.profile, duration=60,
+                                 priority=1)
+        after = self.entries()
+        self.assertTrue(new.pk in after)
+        self.assertTrue(len(after) < 4)
+
+    def test_unimportant_new_todo_leaves_a_full_plan_alone(self):
+        """Test a todo no more urgent than the plan's does not displace."""
+        self.only_planned_slots()
+        new = TodoFactory.create(owner=self.profile, duration=60)
+        self.assertFalse(new.pk in self.entries())
+        self.assertTrue(self.version() == 1)
+
+    def test_fixture_loading_leaves_plans_alone(self):
+        """Test raw saves from loaddata do not patch plans."""
+        todo = Todo.objects.get(pk=self.first.pk)
+        todo.duration = 60
+        todo.save_base(raw=True)
+        self.assertTrue(self.version() == 1)
+
+    def test_new_todo_is_added_to_a_free_slot(self):
+        """Test a created todo gets one new entry without moving others."""
+        before = self.entries()
+        new = TodoFactory.create(owner=self.profile, duration=45)
+        after = self.entries()
+        self.assertTrue(new.pk in after)
+        for todo in (self.first, self.second, self.third):
+            self.assertTrue(after[todo.pk] == before[todo.pk])
+        self.assertTrue(self.version() == 2)
+
+    def test_stored_occupancy_is_planned_around(self):
+        """Test a plan's bitmap is used instead of rebuilding the day."""
+        taken = np.ones(scheduler.SLOTS_PER_DAY, dtype=bool)
+        taken[slot_of(time(16)):slot_of(time(17))] = False
+        Plan.objects.filter(pk=self.plan.pk).update(
+            occupancy=slots.pack(taken))
+        new = TodoFactory.create(owner=self.profile, duration=45)
+        after = self.entries()
+        self.assertTrue(after[new.pk][1] >= time(16))
+        self.assertTrue(after[new.pk][2] <= time(17))
+        stored = slots.unpack(Plan.objects.get(pk=self.plan.pk).occupancy)
+        self.assertTrue(stored.sum() == scheduler.SLOTS_PER_DAY - 3)
+
+    def test_calendar_import_drops_stored_occupancy(self):
+        """Test replacing busy time makes plans rebuild their bitmap."""
+        Plan.objects.filter(pk=self.plan.pk).update(occupancy=slots.pack(
+            np.zeros(scheduler.SLOTS_PER_DAY, dtype=bool)))
+        import_calendar(self.profile, BytesIO(b''))
+        self.assertTrue(Plan.objects.get(pk=self.plan.pk).occupancy is None)
+
+    def test_deleted_todo_leaves_a_gap(self):
+        """Test deleting a planned todo only removes its entry."""
+        before = self.entries()
+        Todo.objects.get(pk=self.second.pk).delete()
+        after = self.entries()
+        self.assertFalse(self.second.pk in after)
+        self.assertTrue(after[self.first.pk] == before[self.first.pk])
+        self.assertTrue(self.version() == 2)
+
+
+class WeekPlanTestCase(TestCase):
+    """Test planning several days at once."""
+
+    def setUp(self):
+        """Make a profile active from 8 to 22 and plan from March 1st."""
+        add_user_group()
+        self.profile = UserFactory.create().profile
+        self.day = date(2017, 3, 1)
+        self.now = timezone.make_aware(datetime(2017, 2, 28, 20, 0))
+
+    def planned(self, plans):
+        """All planned todos by todo id."""
+        return dict((item.todo_id, item) for plan in plans.values()
+                    for item in plan.entries)
+
+    def test_todos_spill_over_into_later_days(self):
+        """Test more work than a day holds is spread without overlap."""
+        for i in range(20):
+            TodoFactory.create(owner=self.profile, priority=2,
+                               duration=60)
+        plans = week.week_plans(self.profile, self.day, 3, self.now)
+        self.assertTrue(len(self.planned(plans)) == 20)
+        self.assertTrue(len(plans[self.day].entries) == 14)
+        for day, plan in plans.items():
+            for first, second in zip(plan.entries, plan.entries[1:]):
+                self.assertTrue(first.end <= second.start)
+            for item in plan.entries:
+                start = timezone.localtime(item.start)
+                end = timezone.localtime(item.end)
+                self.assertTrue(start.date() == day == end.date())
+                self.assertTrue(start.time() >= time(8))
+                self.assertTrue(end.time() <= time(22))
+
+    def test_deadline_is_met_by_moving_more_urgent_work(self):
+        """Test local search makes room for a due todo on a full day."""
+        for i in range(28):
+            TodoFactory.create(owner=self.profile, priority=1,
+                               duration=60)
+        due = timezone.make_aware(datetime(2017, 3, 1, 21, 0))
+        urgent = TodoFactory.create(owner=self.profile, priority=4,
+                                    duration=60, date=due)
+        plans = week.week_plans(self.profile, self.day, 3, self.now)
+        planned = self.planned(plans)
+        self.assertTrue(len(planned) == 29)
+        self.assertTrue(planned[urgent.id].end <= due)
+
+    def test_busy_time_is_planned_around_on_every_day(self):
+        """Test busy blocks on later days are respected."""
+        second = self.day + timedelta(1)
+        start = scheduler.slot_datetime(second, slot_of(time(8)))
+        end = scheduler.slot_datetime(second, slot_of(time(20)))
+        BusyBlock.objects.create(owner=self.profile, start=start, end=end)
+        for i in range(20):
+            TodoFactory.create(owner=self.profile, duration=60)
+        plans = week.week_plans(self.profile, self.day, 3, self.now)
+        self.assertTrue(len(plans[second].entries) == 2)
+        self.assertTrue(all(item.start >= end
+                            for item in plans[second].entries))
+
+    def test_ten_thousand_todos_plan_within_a_second(self):
+        """Test a large backlog is packed well inside the time budget."""
+        random = np.random.RandomState(3)
+        count = 10000
+        todos = scheduler.TodoArrays(
+            id=np.arange(count, dtype=np.int64),
+            priority=random.randint(1, 5, count),
+            ease=random.randint(1, 4, count),
+            duration=random.choice([15, 30, 60, 90, 240], count),
+            date=np.where(random.rand(count) < 0.5,
+                          scheduler.to_epoch(self.now) +
+                          random.rand(count) * 14 * 86400, np.nan))
+        curve = scheduler.energy_curve(self.profile)
+        days = [self.day + timedelta(i) for i in range(7)]
+        started = timezone.now()
+        plans = week.plan_week(todos, curve, days, self.now, budget=0.2)
+        elapsed = (timezone.now() - started).total_seconds()
+        self.assertTrue(elapsed < 1.0)
+        for plan in plans:
+            self.assertTrue(plan.entries)
+            for first, second in zip(plan.entries, plan.entries[1:]):
+                self.assertTrue(first.end <= second.start)
+
+    def test_stored_week_bumps_each_day(self):
+        """Test storing a week writes one plan per day."""
+        TodoFactory.create(owner=self.profile, duration=30)
+        week.store_week(self.profile, week.week_plans(
+            self.profile, self.day, 2, self.now))
+        self.assertTrue(sorted(Plan.objects.filter(
+            owner=self.profile).values_list('day', flat=True)) ==
+            [self.day, self.day + timedelta(1)])
+
+
+    def test_failed_day_leaves_the_week_unstored(self):
+        """Test a week is stored whole or not at all."""
+        TodoFactory.create(owner=self.profile, duration=30)
+        plans = week.week_plans(self.profile, self.day, 3, self.now)
+        original = week.store_plans
+        stored = []
+
+        def fail_on_last_day(day, plans):
+            """Store days until the last one, then fail."""
+            if len(stored) == 2:
+                raise DatabaseError('Connection lost.')
+            stored.append(day)
+            return original(day, plans)
+
+        week.store_plans = fail_on_last_day
+        try:
+            with self.assertRaises(DatabaseError):
+                week.store_week(self.profile, plans)
+        finally:
+            week.store_plans = original
+        self.assertTrue(len(stored) == 2)
+        self.assertFalse(Plan.objects.filter(owner=self.profile).exists())
+
+
+class TodoCompletionTestCase(TestCase):
+    """Test completing todos and archiving finished ones."""
+
+    def setUp(self):
+        """Log in a user with three todos planned for tomorrow."""
+        add_user_group()
+        self.user = UserFactory.create()
+        self.profile = self.user.profile
+        self.client.force_login(self.user)
+        self.day = timezone.localtime(timezone.now()).date() + timedelta(1)
+        self.todos = [TodoFactory.create(owner=self.profile, duration=30,
+                                         priority=2) for i in range(3)]
+        scheduler.store_plans(self.day, {self.profile.pk: scheduler.day_plan(
+            self.profile, self.day)})
+
+    def test_completed_todos_leave_live_queries(self):
+        """Test listing, scheduling, top-k and counts skip done todos."""
+        done = self.todos[0]
+        done.complete()
+        listed = self.client.get(reverse('todo-list')).json()['results']
+        self.assertTrue(done.pk not in [row['id'] for row in listed])
+        self.assertTrue(done.pk not in scheduler.load_todos(self.profile).id)
+        level, rows = best_todos(self.profile, 5)
+        self.assertTrue(done.pk not in [row['id'] for row in rows])
+        self.assertTrue(summary_for(self.profile).total == 2)
+        rebuild_summaries()
+        self.assertTrue(summary_for(self.profile).total == 2)
+
+    def test_completing_a_todo_takes_it_out_of_plans(self):
+        """Test a finished todo no longer holds a place in current plans."""
+        done = self.todos[0]
+        done.complete()
+        self.assertTrue(not PlanEntry.objects.filter(todo=done).exists())
+        self.assertTrue(PlanEntry.objects.count() == 2)
+
+    def test_reopened_todo_is_counted_and_planned_again(self):
+        """Test reopening a todo restores its counts and plan entry."""
+        done = self.todos[0]
+        done.complete()
+        done.reopen()
+        self.assertTrue(summary_for(self.profile).total == 3)
+        self.assertTrue(PlanEntry.objects.filter(todo=done).exists())
+
+    def test_complete_view_marks_only_own_todos(self):
+        """Test the completion endpoint works on the user's todos only."""
+        url = reverse('todo-complete', args=[self.todos[1].pk])
+        response = self.client.post(url)
+        self.assertTrue(response.json()['completed'] is not None)
+        self.assertTrue(Todo.objects.get(
+            pk=self.todos[1].pk).completed is not None)
+        self.client.delete(url)
+        self.assertTrue(Todo.objects.get(
+            pk=self.todos[1].pk).completed is None)
+        stranger = TodoFactory.create(owner=UserFactory.create().profile)
+        response = self.client.post(reverse('todo-complete',
+                                            args=[stranger.pk]))
+        self.assertTrue(response.status_code == 404)
+
+    def test_old_completed_todos_are_archived_in_batches(self):
+        """Test only todos finished before the cutoff move, keeping ids."""
+        now = timezone.now()
+        old = [TodoFactory.create(owner=self.profile, title='Old {}'.format(i))
+               for i in range(5)]
+        for todo in old:
+            todo.complete(now - timedelta(days=40))
+        self.todos[0].complete(now - timedelta(days=2))
+        self.assertTrue(archive_todos(days=30, batch_size=2, now=now) == 5)
+        self.assertTrue(sorted(ArchivedTodo.objects.values_list(
+            'id', flat=True)) == sorted(todo.pk for todo in old))
+        archived = ArchivedTodo.objects.get(pk=old[0].pk)
+        self.assertTrue(archived.title == 'Old 0')
+        self.assertTrue(archived.owner_id == self.profile.pk)
+        self.assertTrue(Todo.objects.filter(pk=self.todos[0].pk).exists())
+        self.assertTrue(Todo.objects.count() == 3)
+        self.assertTrue(summary_for(self.profile).total == 2)
+
+    def test_archiving_removes_past_plan_entries(self):
+        """Test archived todos are dropped from plans that held them."""
+        done = self.todos[0]
+        PlanEntry.objects.create(
+            plan=Plan.objects.create(owner=self.profile,
+                                     day=self.day - timedelta(30)),
+            todo=done, start=timezone.now(), end=timezone.now())
+        done.complete(timezone.now() - timedelta(days=40))
+        out = StringIO()
+        call_command('archive_todos', stdout=out)
+        self.assertTrue('Archived 1 todos.' in out.getvalue())
+        self.assertTrue(not PlanEntry.objects.filter(
+            todo_id=done.pk).exists())
+        self.assertTrue(not Todo.objects.filter(pk=done.pk).exists())
@@ -0,0 +1,24 @@
+"""Todo urls."""
+from django.conf.urls import url
+from .views import (FeedResetView, NextTodosView, PlanFeedView,
+                    PlanRequestView, TodoCompleteView, TodoImportView,
+                    TodoListView, TodoSummaryView)
+from django.contrib.auth.decorators import login_required
+
+urlpatterns = [
+    url(r'^import/$', login_required(TodoImportView.as_view()),
+        name='todo-import'),
+    url(r'^(?P<pk>\d+)/complete/$',
+        login_required(TodoCompleteView.as_view()), name='todo-complete'),
+    url(r'^next/$', login_required(NextTodosView.as_view()),
+        name='todo-next'),
+    url(r'^summary/$', login_required(TodoSummaryView.as_view()),
+        name='todo-summary'),
+    url(r'^plan/$', login_required(PlanRequestView.as_view()),
+        name='plan-request'),
+    url(r'^feed/(?P<token>[\w:-]+)\.ics$', PlanFeedView.as_view(),
+        name='plan-feed'),
+    url(r'^feed/reset/$', login_required(FeedResetView.as_view()),
+        name='plan-feed-reset'),
+    url(r'^$', login_required(TodoListView.as_view()), name='todo-list')
+]
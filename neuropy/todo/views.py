@@ -1,3 +1,251 @@
-from django.shortcuts import render
+"""Views for todos."""
+import uuid
+from datetime import timedelta
+from django.core.files.storage import default_storage
+from django.core.signing import BadSignature
+from django.http import (Http404, HttpResponseBadRequest,
+                         HttpResponseRedirect, JsonResponse,
+                         StreamingHttpResponse)
+from django.urls import reverse
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import condition
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+from django.views.generic import View
+from jobs.queue import enqueue
+from jobs.views import accepted
+from todo.export import CHUNK_SIZE, CONTENT_TYPES, export_lines
+from todo.feed import feed_etag, feed_lines, reset_feed, token_profile_id
+from todo.importer import DEFAULT_BATCH_SIZE, READERS, import_stream
+from todo.models import Todo
+from todo.pagination import ORDERINGS, keyset_page
+from todo.ranking import best_todos
+from todo.summary import summary_for
 
-# Create your views here.
+
+class TodoListView(View):
+    """List the logged in user's open todos a page at a time."""
+
+    use_replica = True
+    fields = ('id', 'title', 'description', 'date', 'duration', 'ease',
+              'priority')
+    default_limit = 50
+    max_limit = 200
+
+    def get(self, request):
+        """Return a page of todos and the cursor for the next page."""
+        ordering = request.GET.get('order', 'date')
+        if ordering not in ORDERINGS:
+            return HttpResponseBadRequest('Unknown order.')
+        try:
+            limit = int(request.GET.get('limit', self.default_limit))
+        except ValueError:
+            return HttpResponseBadRequest('Invalid limit.')
+        limit = min(max(limit, 1), self.max_limit)
+        todos = Todo.objects.live().filter(owner=request.user.profile)
+        try:
+            rows, cursor = keyset_page(todos, ordering,
+                                       request.GET.get('cursor'), limit,
+                                       self.fields)
+        except ValueError:
+            return HttpResponseBadRequest('Invalid cursor.')
+        return JsonResponse({'results': rows, 'next': cursor})
+
+
+class TodoCompleteView(View):
+    """Mark one of the logged in user's todos as done, or open again."""
+
+    def get_todo(self, request, pk):
+        """Return the user's todo ``pk``, raising 404 for anyone else's."""
+        try:
+            return Todo.objects.get(pk=pk, owner=request.user.profile)
+        except Todo.DoesNotExist:
+            raise Http404('No such todo.')
+
+    def post(self, request, pk):
+        """Mark the todo as done now, keeping an earlier completion."""
+        todo = self.get_todo(request, pk)
+        if todo.completed is None:
+            todo.complete()
+        return JsonResponse({'id': todo.pk, 'completed': todo.completed})
+
+    def delete(self, request, pk):
+        """Mark the todo as open again."""
+        todo = self.get_todo(request, pk)
+        if todo.completed is not None:
+            todo.reopen()
+        return JsonResponse({'id': todo.pk, 'completed': None})
+
+
+class NextTodosView(View):
+    """Suggest the logged in user's best todos to start right now."""
+
+    use_replica = True
+    default_limit = 5
+    max_limit = 50
+
+    def get(self, request):
+        """Return the current energy level and the top ``k`` todos."""
+        try:
+            k = int(request.GET.get('k', self.default_limit))
+        except ValueError:
+            return HttpResponseBadRequest('Invalid k.')
+        level, rows = best_todos(request.user.profile,
+                                 min(max(k, 1), self.max_limit))
+        return JsonResponse({'energy': round(level, 4), 'results': rows})
+
+
+class TodoSummaryView(View):
+    """Report the counts of the logged in user's open todos."""
+
+    use_replica = True
+    fields = ('total', 'total_duration', 'priority_1', 'priority_2',
+              'priority_3', 'priority_4', 'ease_1', 'ease_2', 'ease_3')
+
+    def get(self, request):
+        """Return the stored counters without touching the todo table."""
+        summary = summary_for(request.user.profile)
+        return JsonResponse(dict(
+            (name, getattr(summary, name)) for name in self.fields))
+
+
+class TodoExportView(View):
+    """Export all of the logged in user's todos as CSV or JSON."""
+
+    use_replica = True
+    chunk_size = CHUNK_SIZE
+
+    def post(self, request, fmt):
+        """Queue the export as a job writing a file to download."""
+        return accepted(enqueue('todo.export_todos',
+                                owner=request.user.profile,
+                                profile_id=request.user.profile.pk,
+                                fmt=fmt))
+
+    def get(self, request, fmt):
+        """Stream the export one row at a time."""
+        response = StreamingHttpResponse(
+            export_lines(request.user.profile, fmt, self.chunk_size),
+            content_type=CONTENT_TYPES[fmt])
+        response['Content-Disposition'] = (
+            'attachment; filename="todos.{}"'.format(fmt))
+        return response
+
+
+class TodoImportView(View):
+    """Import todos for the logged in user from an uploaded CSV or JSON."""
+
+    max_batch_size = 5000
+
+    def post(self, request):
+        """
+        Queue importing the uploaded file or request body.
+
+        With ``inline`` the import runs in the request instead, and bad
+        rows are reported in the response.
+        """
+        upload = request.FILES.get('file')
+        fmt = request.GET.get('format')
+        if fmt is None and upload is not None:
+            fmt = upload.name.rsplit('.', 1)[-1].lower()
+        if fmt not in READERS:
+            return HttpResponseBadRequest('Format must be csv or json.')
+        try:
+            batch_size = int(request.GET.get('batch_size',
+                                             DEFAULT_BATCH_SIZE))
+        except ValueError:
+            return HttpResponseBadRequest('Invalid batch size.')
+        batch_size = min(max(batch_size, 1), self.max_batch_size)
+        if not request.GET.get('inline'):
+            return self.enqueue(request, upload, fmt, batch_size)
+        try:
+            result = import_stream(request.user.profile, upload or request,
+                                   fmt, batch_size)
+        except ValueError as error:
+            return HttpResponseBadRequest(str(error))
+        return JsonResponse({
+            'created': result.created,
+            'errors': [{'row': row, 'error': message}
+                       for row, message in result.errors],
+        })
+
+    def enqueue(self, request, upload, fmt, batch_size):
+        """Save the upload and queue a job importing it."""
+        path = default_storage.save(
+            'imports/{}.{}'.format(uuid.uuid4().hex, fmt),
+            upload or request)
+        return accepted(enqueue('todo.import_todos',
+                                owner=request.user.profile,
+                                profile_id=request.user.profile.pk,
+                                path=path, fmt=fmt, batch_size=batch_size))
+
+
+class PlanRequestView(View):
+    """Queue planning a day, or several at once, for the logged in user."""
+
+    max_days = 14
+
+    def post(self, request):
+        """Queue plans for ``days`` days from ``day``, by default tomorrow."""
+        try:
+            days = int(request.POST.get('days', 1))
+        except ValueError:
+            return HttpResponseBadRequest('Invalid days.')
+        if not 1 <= days <= self.max_days:
+            return HttpResponseBadRequest(
+                'days must be between 1 and {}.'.format(self.max_days))
+        day = request.POST.get('day')
+        if day:
+            try:
+                day = parse_date(day)
+            except ValueError:
+                day = None
+            if day is None:
+                return HttpResponseBadRequest('day must be YYYY-MM-DD.')
+        else:
+            day = timezone.localtime(timezone.now()).date() + timedelta(1)
+        if days > 1:
+            return accepted(enqueue('todo.plan_week',
+                                    owner=request.user.profile,
+                                    profile_id=request.user.profile.pk,
+                                    day=day, days=days))
+        return accepted(enqueue('todo.plan_day',
+                                owner=request.user.profile,
+                                profile_id=request.user.profile.pk,
+                                day=day))
+
+
+def token_etag(request, token):
+    """ETag of the feed a token names, None for a bad token."""
+    try:
+        return feed_etag(token_profile_id(token))
+    except BadSignature:
+        return None
+
+
+class PlanFeedView(View):
+    """Stream a profile's current plans as an iCalendar feed."""
+
+    use_replica = True
+
+    @method_decorator(condition(etag_func=token_etag))
+    def get(self, request, token):
+        """Stream the feed, or answer 304 when the client's copy is current."""
+        try:
+            profile_id = token_profile_id(token)
+        except BadSignature:
+            raise Http404('No such feed.')
+        response = StreamingHttpResponse(
+            feed_lines(profile_id, request.get_host().split(':')[0]),
+            content_type='text/calendar; charset=utf-8')
+        response['Cache-Control'] = 'private, no-cache'
+        return response
+
+
+class FeedResetView(View):
+    """Give the logged in user a new feed URL, revoking the old one."""
+
+    def post(self, request):
+        """Reset the feed key and go back to the profile."""
+        reset_feed(request.user.profile)
+        return HttpResponseRedirect(reverse('profile'))
@@ -0,0 +1,328 @@
+"""Plan several days of a profile's todos at once.
+
+The days are laid out as rows of one slot grid and todos are packed into
+it in a single greedy pass, most urgent first. A todo never crosses from
+one day into the next and must end before its deadline, unless that
+deadline has already passed. Earlier days are always filled first, and
+within a day a todo goes where the energy suits it, with a bonus for
+starting or ending next to taken time so free time is not cut into
+pieces too small to use. Free runs and energy fit are computed once
+per todo width and reused until a placement changes the grid, so
+thousands of todos that cannot fit cost next to nothing.
+
+The greedy plan is then improved by local search for as long as the time
+budget allows: an unplaced todo may take the place of a run of todos
+worth less in total, which are then put back anywhere they still fit.
+Every move raises the total score, so stopping at any point keeps the
+best plan found so far.
+"""
+
+import time
+from datetime import timedelta
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from todo import slots
+from todo.scheduler import (MAX_EASE, SLOT_MINUTES, SLOTS_PER_DAY, DayPlan,
+                            PlannedTodo, busy_slots, energy_curve,
+                            free_slots, load_busy, load_todos, score_todos,
+                            slot_datetime, slots_for, store_plans, to_epoch,
+                            window_sums)
+
+
+WEEK_DAYS = 7
+DAY_PENALTY = 2.0
+SNUG_BONUS = 0.5
+MOVES_TRIED = 4
+
+
+def plan_budget():
+    """Seconds the local search may spend improving a plan."""
+    return getattr(settings, 'WEEK_PLAN_BUDGET_SECONDS', 0.5)
+
+
+def deadline_limits(dates, days, now):
+    """
+    Global slot each todo has to end by, as an index into the day rows.
+
+    Todos without a deadline, with one past the last day or with one that
+    has passed by ``now`` or by the first day may end anywhere.
+    """
+    total = len(days) * SLOTS_PER_DAY
+    limits = np.full(len(dates), total, dtype=np.int64)
+    starts = np.array([to_epoch(slot_datetime(day, 0)) for day in days])
+    ahead = ~np.isnan(dates)
+    ahead[ahead] = dates[ahead] > max(to_epoch(now), starts[0])
+    day = np.searchsorted(starts, dates[ahead], 'right') - 1
+    slot = np.floor((dates[ahead] - starts[day]) /
+                    (SLOT_MINUTES * 60.0)).astype(np.int64)
+    limits[ahead] = np.clip(day * SLOTS_PER_DAY +
+                            np.minimum(slot, SLOTS_PER_DAY), 0, total)
+    return limits
+
+
+class WeekPlanner(object):
+    """Greedy packing of todos into the free slots of several days."""
+
+    def __init__(self, todos, scores, curve, free, limits):
+        """Start from ``free``, a mask with one row of slots per day."""
+        self.todos = todos
+        self.scores = scores
+        self.curve = curve
+        self.free = free & (curve > 0)
+        self.flat = self.free.reshape(-1)
+        self.limits = limits
+        self.widths = slots_for(todos.duration)
+        self.demand = (todos.ease - 1) / float(max(MAX_EASE - 1, 1))
+        self.blocked = ~self.flat
+        self.owner = np.full(len(self.flat), -1, dtype=np.int64)
+        self.starts = np.full(len(todos), -1, dtype=np.int64)
+        self.runs = {}
+        self.fits = {}
+        self.clear = {}
+
+    def open_runs(self, width):
+        """Flat mask of the slots starting a free run of ``width``."""
+        if width not in self.runs:
+            self.runs[width] = slots.run_starts(self.free, width).reshape(-1)
+        return self.runs[width]
+
+    def snug(self, width):
+        """Flat mask of the starts of ``width`` slots next to taken time."""
+        key = ('snug', width)
+        if key not in self.runs:
+            taken = ~self.free
+            before = np.ones(self.free.shape, dtype=bool)
+            before[:, 1:] = taken[:, :-1]
+            after = np.ones(self.free.shape, dtype=bool)
+            after[:, :SLOTS_PER_DAY - width] = taken[:, width:]
+            self.runs[key] = (before | after).reshape(-1)
+        return self.runs[key]
+
+    def fit(self, width, demand):
+        """How well each start matches ``demand``, preferring early days."""
+        key = (width, demand)
+        if key not in self.fits:
+            day = np.full(SLOTS_PER_DAY, -np.inf)
+            day[:SLOTS_PER_DAY - width + 1] = -np.abs(
+                window_sums(self.curve, width) / float(width) - demand)
+            rows = day - DAY_PENALTY * np.arange(len(self.free))[:, None]
+            self.fits[key] = rows.reshape(-1)
+        return self.fits[key]
+
+    def best_start(self, index, allowed):
+        """Best start for todo ``index`` where ``allowed`` is true, or -1."""
+        limit = self.limits[index] - self.widths[index] + 1
+        if limit <= 0:
+            return -1
+        allowed = allowed[:limit]
+        if not allowed.any():
+            return -1
+        width = int(self.widths[index])
+        fit = self.fit(width, self.demand[index])[:limit]
+        fit = np.where(allowed, fit + SNUG_BONUS * self.snug(width)[:limit],
+                       -np.inf)
+        return int(np.argmax(fit))
+
+    def take(self, index, start):
+        """Place todo ``index`` at global slot ``start``."""
+        self.flat[start:start + self.widths[index]] = False
+        self.owner[start:start + self.widths[index]] = index
+        self.starts[index] = start
+        self.runs.clear()
+
+    def release(self, index):
+        """Take todo ``index`` out of the plan."""
+        start = self.starts[index]
+        self.flat[start:start + self.widths[index]] = True
+        self.owner[start:start + self.widths[index]] = -1
+        self.starts[index] = -1
+        self.runs.clear()
+
+    def insert(self, index):
+        """Place todo ``index`` wherever fits best, if anywhere."""
+        width = int(self.widths[index])
+        if width > SLOTS_PER_DAY:
+            return False
+        start = self.best_start(index, self.open_runs(width))
+        if start < 0:
+            return False
+        self.take(index, start)
+        return True
+
+    def greedy(self):
+        """Place todos most urgent first, skipping those that cannot fit."""
+        remaining = int(self.free.sum())
+        smallest_miss = SLOTS_PER_DAY + 1
+        for index in np.lexsort((self.todos.id, -self.scores)):
+            width = int(self.widths[index])
+            if width > remaining or width >= smallest_miss:
+                continue
+            if not self.open_runs(width).any():
+                smallest_miss = width
+                continue
+            if self.insert(index):
+                remaining -= width
+                if not remaining:
+                    break
+
+    def clear_runs(self, width):
+        """Flat mask of the starts of ``width`` slots none of them blocked."""
+        if width not in self.clear:
+            self.clear[width] = slots.run_starts(
+                ~self.blocked.reshape(self.free.shape), width).reshape(-1)
+        return self.clear[width]
+
+    def window_costs(self, width):
+        """Summed score of the todos every window of ``width`` would evict."""
+        value = np.zeros(len(self.flat))
+        placed = np.flatnonzero(self.starts >= 0)
+        value[self.starts[placed]] = self.scores[placed]
+        totals = np.cumsum(value.reshape(self.free.shape), axis=1)
+        totals = np.concatenate((np.zeros((len(totals), 1)), totals), axis=1)
+        costs = np.full(self.free.shape, np.inf)
+        costs[:, :SLOTS_PER_DAY - width + 1] = (totals[:, width:] -
+                                                totals[:, :-width])
+        costs = costs.reshape(-1)
+        owner = self.owner
+        straddle = np.flatnonzero(owner >= 0)
+        straddle = straddle[self.starts[owner[straddle]] < straddle]
+        costs[straddle] += self.scores[owner[straddle]]
+        costs[~self.clear_runs(width)] = np.inf
+        return costs
+
+    def move(self, index, start):
+        """
+        Put todo ``index`` at ``start``, displacing whatever is there.
+
+        Displaced todos are put back wherever they still fit. The move is
+        undone unless it raised the total score. Returns whether it was kept.
+        """
+        width = self.widths[index]
+        displaced = np.unique(self.owner[start:start + width])
+        displaced = displaced[displaced >= 0]
+        displaced = displaced[np.argsort(-self.scores[displaced],
+                                         kind='mergesort')]
+        before = self.starts[displaced].copy()
+        for victim in displaced:
+            self.release(victim)
+        self.take(index, start)
+        lost = sum(self.scores[victim] for victim in displaced
+                   if not self.insert(victim))
+        if lost < self.scores[index]:
+            return True
+        self.release(index)
+        for victim in displaced:
+            if self.starts[victim] >= 0:
+                self.release(victim)
+        for victim, old in zip(displaced, before):
+            self.take(victim, old)
+        return False
+
+    def eject(self, index):
+        """
+        Place todo ``index`` over less urgent todos, if that pays.
+
+        The windows the todo could take are costed at the summed score of
+        the todos they would displace, and the cheapest few are tried.
+        Returns whether a move was made.
+        """
+        width = int(self.widths[index])
+        limit = self.limits[index] - width + 1
+        if limit <= 0:
+            return False
+        costs = self.window_costs(width)[:limit]
+        for start in np.argsort(costs, kind='mergesort')[:MOVES_TRIED]:
+            if not np.isfinite(costs[start]):
+                break
+            if self.move(index, int(start)):
+                return True
+        return False
+
+    def improve(self, budget):
+        """Eject less urgent todos for unplaced ones until out of time."""
+        stop = time.time() + budget
+        waiting = np.flatnonzero(self.starts < 0)
+        waiting = waiting[np.lexsort((self.todos.id[waiting],
+                                      -self.scores[waiting]))]
+        total = len(self.flat)
+        smallest_miss = SLOTS_PER_DAY + 1
+        for index in waiting:
+            if time.time() > stop:
+                break
+            width = int(self.widths[index])
+            if width >= smallest_miss or self.starts[index] >= 0:
+                continue
+            if self.eject(index):
+                smallest_miss = SLOTS_PER_DAY + 1
+            elif self.limits[index] == total:
+                smallest_miss = width
+
+    def day_plans(self, days, busy):
+        """Split the placements into one ``DayPlan`` per day."""
+        placed = np.flatnonzero(self.starts >= 0)
+        placed = placed[np.argsort(self.starts[placed], kind='mergesort')]
+        row = self.starts[placed] // SLOTS_PER_DAY
+        plans = []
+        for number, day in enumerate(days):
+            mine = placed[row == number]
+            starts = self.starts[mine] - number * SLOTS_PER_DAY
+            widths = self.widths[mine]
+            entries = [
+                PlannedTodo(int(self.todos.id[index]),
+                            slot_datetime(day, start),
+                            slot_datetime(day, start + width))
+                for index, start, width in zip(mine, starts, widths)
+            ]
+            plans.append(DayPlan(entries, slots.pack(slots.taken(
+                self.curve, busy[number], starts, widths))))
+        return plans
+
+
+def plan_week(todos, curve, days, now, busy=None, budget=None):
+    """
+    Pack ``todos`` into ``days`` and return one ``DayPlan`` per day.
+
+    ``busy`` is an optional list of busy slot masks, one per day. The
+    local search stops after ``budget`` seconds, ``plan_budget()`` if not
+    given, and returns the best plan found by then.
+    """
+    days = list(days)
+    busy = busy or [None] * len(days)
+    free = np.array([free_slots(day, now) for day in days], dtype=bool)
+    for row, mask in zip(free, busy):
+        if mask is not None:
+            row &= ~mask
+    planner = WeekPlanner(todos, score_todos(todos, now), curve, free,
+                          deadline_limits(todos.date, days, now))
+    if len(todos):
+        planner.greedy()
+        planner.improve(plan_budget() if budget is None else budget)
+    return planner.day_plans(days, busy)
+
+
+def week_plans(profile, first_day=None, days=WEEK_DAYS, now=None,
+               budget=None):
+    """Plan ``days`` days of ``profile`` from ``first_day``, keyed by day."""
+    now = now or timezone.now()
+    first_day = first_day or timezone.localtime(now).date()
+    days = [first_day + timedelta(days=number) for number in range(days)]
+    index = load_busy(profile, days[0], days[-1])
+    plans = plan_week(load_todos(profile), energy_curve(profile), days, now,
+                      [busy_slots(index, day) for day in days], budget)
+    return dict(zip(days, plans))
+
+
+def store_week(profile, plans):
+    """
+    Store the ``DayPlan`` of each day in ``plans`` for ``profile``.
+
+    Every day is replaced in one transaction, so a failure on a later day
+    leaves the earlier days as they were.
+    """
+    with transaction.atomic():
+        for day, plan in sorted(plans.items()):
+            store_plans(day, {profile.pk: plan})
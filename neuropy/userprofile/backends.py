@@ -0,0 +1,52 @@
+"""Authentication backend loading users and their profiles from the cache.
+
+Every logged in request looks up its user, and most pages go on to read
+the profile. The backend fetches both with one query and keeps them in the
+cache under the user's page version, which saving either of them bumps, so
+a cached user is never older than the rows it came from. The rows are
+read from the primary database, as a lagging replica would put an old user
+in the cache under the new version.
+"""
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+
+from neuropy.cache import user_version
+
+
+def user_timeout():
+    """Seconds a loaded user is kept in the cache."""
+    return getattr(settings, 'USER_CACHE_TIMEOUT', 300)
+
+
+def user_key(user_id):
+    """Cache key of a user under the user's current version."""
+    return 'auth-user:{}:{}'.format(user_id, user_version(user_id))
+
+
+def load_user(user_id):
+    """Fetch a user together with the profile in one primary query."""
+    UserModel = get_user_model()
+    try:
+        return UserModel._default_manager.using(
+            DEFAULT_DB_ALIAS).select_related('profile').get(pk=user_id)
+    except UserModel.DoesNotExist:
+        return None
+
+
+class CachedUserBackend(ModelBackend):
+    """Log users in as usual but load them per request from the cache."""
+
+    def get_user(self, user_id):
+        """Return the user with the profile attached, from cache if able."""
+        key = user_key(user_id)
+        user = cache.get(key)
+        if user is None:
+            user = load_user(user_id)
+            if user is None:
+                return None
+            cache.set(key, user, user_timeout())
+        return user if self.user_can_authenticate(user) else None
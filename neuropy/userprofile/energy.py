@@ -0,0 +1,168 @@
+"""Energy curves derived from a profile's daily rhythm.
+
+A curve gives the expected energy, from 0 to 1, for every slot of a day.
+It only depends on a few profile fields, so it is stored in the cache as a
+compact ``uint8`` array keyed by a hash of those fields and shared between
+profiles with the same settings.
+
+The medication part of a curve comes from a table of drug levels over a
+day for a half-life and dose time. Tables are computed once per process
+and kept in a bounded LRU, since most profiles share a handful of them.
+"""
+
+import hashlib
+
+import numpy as np
+from django.core.cache import cache
+from django.utils.lru_cache import lru_cache
+
+
+SLOT_MINUTES = 5
+SLOTS_PER_DAY = 24 * 60 // SLOT_MINUTES
+
+PEAK_PERIOD_HOURS = {
+    'early_bird': 6,
+    'morning': 9,
+    'midday': 12,
+    'afternoon': 15,
+    'evening': 18,
+    'night_owl': 21,
+}
+
+BASE_ENERGY = 0.4
+PEAK_ENERGY = 0.4
+PEAK_WIDTH_HOURS = 1.5
+DOSE_ENERGY = 0.2
+DOSE_PEAK_HOURS = 2.0
+ABSORPTION_HALF_LIFE_HOURS = 0.5
+DOSING_DAYS = 7
+TABLE_CACHE_SIZE = 256
+
+CURVE_FIELDS = ('active_period_start', 'active_period_end', 'peak_period',
+                'dose_time', 'medication_half_life')
+CURVE_CACHE_TIMEOUT = 7 * 24 * 60 * 60
+CURVE_LEVELS = 255
+
+
+def slot_of(value):
+    """Return the slot index a ``datetime.time`` falls in."""
+    return (value.hour * 60 + value.minute) // SLOT_MINUTES
+
+
+def peak_hour(peak_period):
+    """Return the centre hour of a peak period choice or label."""
+    key = str(peak_period).strip().lower().replace(' ', '_')
+    return PEAK_PERIOD_HOURS.get(key, PEAK_PERIOD_HOURS['morning'])
+
+
+def active_mask(start, end):
+    """Boolean slot mask for an active period, wrapping past midnight."""
+    slots = np.arange(SLOTS_PER_DAY)
+    first, last = slot_of(start), slot_of(end)
+    if first < last:
+        return (slots >= first) & (slots < last)
+    return (slots >= first) | (slots < last)
+
+
+def half_life_minutes(half_life):
+    """Round a half-life in hours to whole slots, None when unknown."""
+    if half_life is None:
+        return None
+    return max(int(round(half_life * 60 / SLOT_MINUTES)), 1) * SLOT_MINUTES
+
+
+@lru_cache(maxsize=TABLE_CACHE_SIZE)
+def level_table(half_life):
+    """
+    Relative medication level for each slot after a dose at midnight.
+
+    With a half-life in minutes, levels follow a one-compartment model
+    with first order absorption, summed over a week of daily doses so they
+    include what is left of earlier days. Without one, a generic curve
+    peaking ``DOSE_PEAK_HOURS`` after the dose is used. Peaks are 1.
+    """
+    hours = np.arange(SLOTS_PER_DAY) * (SLOT_MINUTES / 60.0)
+    if half_life is None:
+        since_dose = hours / DOSE_PEAK_HOURS
+        levels = since_dose * np.exp(1 - since_dose)
+    else:
+        elimination = np.log(2) / (half_life / 60.0)
+        absorption = np.log(2) / ABSORPTION_HALF_LIFE_HOURS
+        if np.isclose(elimination, absorption):
+            absorption *= 1.01
+        elapsed = hours + 24 * np.arange(DOSING_DAYS)[:, np.newaxis]
+        levels = (np.exp(-elimination * elapsed) -
+                  np.exp(-absorption * elapsed)).sum(axis=0)
+        levels *= np.sign(absorption - elimination)
+    levels = levels / levels.max()
+    levels.flags.writeable = False
+    return levels
+
+
+@lru_cache(maxsize=TABLE_CACHE_SIZE)
+def medication_table(half_life, dose_slot):
+    """Relative medication level per slot for a half-life and dose slot."""
+    levels = np.roll(level_table(half_life), dose_slot)
+    levels.flags.writeable = False
+    return levels
+
+
+def compute_curve(profile):
+    """Compute the energy curve for a profile without the cache."""
+    hours = np.arange(SLOTS_PER_DAY) * (SLOT_MINUTES / 60.0)
+
+    from_peak = np.abs(hours - peak_hour(profile.peak_period))
+    from_peak = np.minimum(from_peak, 24 - from_peak)
+    peak = PEAK_ENERGY * np.exp(-0.5 * (from_peak / PEAK_WIDTH_HOURS) ** 2)
+
+    medication = DOSE_ENERGY * medication_table(
+        half_life_minutes(profile.medication_half_life),
+        slot_of(profile.dose_time))
+
+    curve = np.clip(BASE_ENERGY + peak + medication, 0, 1)
+    curve[~active_mask(profile.active_period_start,
+                       profile.active_period_end)] = 0
+    return curve
+
+
+def curve_key(profile):
+    """Cache key for the curve of a profile's current settings."""
+    fields = '|'.join(str(getattr(profile, name)) for name in CURVE_FIELDS)
+    digest = hashlib.sha1(fields.encode('utf-8')).hexdigest()
+    return 'energy-curve:{}'.format(digest)
+
+
+def profile_key(profile_id):
+    """Cache key remembering which curve a profile last used."""
+    return 'energy-curve-profile:{}'.format(profile_id)
+
+
+def pack(curve):
+    """Quantize a curve to bytes for the cache."""
+    return np.round(curve * CURVE_LEVELS).astype(np.uint8).tobytes()
+
+
+def unpack(packed):
+    """Expand cached bytes back to a float curve."""
+    return np.frombuffer(packed, dtype=np.uint8) / float(CURVE_LEVELS)
+
+
+def energy_curve(profile):
+    """Return the energy for every slot of a day, computing it once."""
+    key = curve_key(profile)
+    packed = cache.get(key)
+    if packed is None:
+        packed = pack(compute_curve(profile))
+        cache.set(key, packed, CURVE_CACHE_TIMEOUT)
+        if profile.pk:
+            cache.set(profile_key(profile.pk), key, CURVE_CACHE_TIMEOUT)
+    return unpack(packed)
+
+
+def invalidate_curve(profile):
+    """Drop the curve a profile used before its settings changed."""
+    old_key = cache.get(profile_key(profile.pk))
+    new_key = curve_key(profile)
+    if old_key and old_key != new_key:
+        cache.delete(old_key)
+    cache.set(profile_key(profile.pk), new_key, CURVE_CACHE_TIMEOUT)
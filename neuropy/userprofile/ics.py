@@ -0,0 +1,271 @@
+"""Streaming import of busy time from iCalendar files.
+
+The calendar is read line by line and every single event is turned into
+busy blocks as soon as its ``END:VEVENT`` line has been read. Recurring
+events are only kept until the end of the file, since events moving or
+cancelling one of their occurrences with a RECURRENCE-ID may follow them,
+and are then expanded without those occurrences. Expansion happens in the
+wall clock time of the event's own time zone within a horizon, so even
+calendars holding years of recurring events are never held in memory, and
+the blocks are written with ``bulk_create`` in batches.
+"""
+
+import codecs
+import re
+from datetime import datetime, time, timedelta
+
+from dateutil import rrule, tz
+from django.db import transaction
+from django.utils import timezone
+
+from userprofile.models import BusyBlock, busy_blocks_replaced
+
+
+DEFAULT_BATCH_SIZE = 1000
+DEFAULT_HORIZON_DAYS = 365
+SUMMARY_LENGTH = BusyBlock._meta.get_field('summary').max_length
+UID_LENGTH = BusyBlock._meta.get_field('uid').max_length
+
+DURATION_PATTERN = re.compile(
+    r'^([+-])?P(?:(\d+)W)?(?:(\d+)D)?'
+    r'(?:T(?:(\d+)H)?(?:(\d+)M)?(?:(\d+)S)?)?$')
+UNTIL_PATTERN = re.compile(r'UNTIL=([0-9TZ]+)', re.IGNORECASE)
+
+
+def unfold(lines):
+    """Join folded content lines, yielding one logical line at a time."""
+    current = None
+    for line in lines:
+        line = line.rstrip('\r\n')
+        if line[:1] in (' ', '\t') and current is not None:
+            current += line[1:]
+            continue
+        if current:
+            yield current
+        current = line
+    if current:
+        yield current
+
+
+def split_line(line):
+    """Split a content line into its name, parameters and value."""
+    head, colon, value = line.partition(':')
+    if not colon:
+        raise ValueError('Invalid content line: {!r}'.format(line[:40]))
+    parts = head.split(';')
+    params = {}
+    for part in parts[1:]:
+        key, _, param = part.partition('=')
+        params[key.upper()] = param.strip('"')
+    return parts[0].upper(), params, value
+
+
+def unescape(value):
+    """Undo the escaping of an iCalendar text value."""
+    return re.sub(r'\\([\\;,nN])',
+                  lambda match: '\n' if match.group(1) in 'nN'
+                  else match.group(1), value)
+
+
+def read_events(stream):
+    """
+    Yield each VEVENT of a UTF-8 byte stream as a dict of properties.
+
+    Property values are ``(params, value)`` pairs. Properties that may
+    repeat, like EXDATE, are collected into lists. Components nested in an
+    event, such as alarms, are skipped.
+    """
+    event, depth = None, 0
+    for line in unfold(codecs.getreader('utf-8')(stream)):
+        name, params, value = split_line(line)
+        if name == 'BEGIN':
+            if event is not None:
+                depth += 1
+            elif value.upper() == 'VEVENT':
+                event, depth = {}, 0
+        elif name == 'END' and event is not None:
+            if depth:
+                depth -= 1
+            elif value.upper() == 'VEVENT':
+                yield event
+                event = None
+        elif event is not None and not depth:
+            if name in ('EXDATE', 'RDATE'):
+                event.setdefault(name, []).append((params, value))
+            else:
+                event[name] = (params, value)
+
+
+def zone_for(params, value):
+    """Return the time zone a date-time value is given in."""
+    if value.upper().endswith('Z'):
+        return timezone.utc
+    if 'TZID' in params:
+        zone = tz.gettz(params['TZID'])
+        if zone is not None:
+            return zone
+    return timezone.get_default_timezone()
+
+
+def parse_value(params, value):
+    """
+    Parse a DATE or DATE-TIME value into a naive wall time and its zone.
+
+    A DATE value is returned as midnight in the default time zone, with a
+    flag saying the value was a whole day.
+    """
+    value = value.strip()
+    try:
+        if params.get('VALUE', '').upper() == 'DATE' or len(value) == 8:
+            day = datetime.strptime(value[:8], '%Y%m%d')
+            return day, timezone.get_default_timezone(), True
+        naive = datetime.strptime(value.rstrip('Zz'), '%Y%m%dT%H%M%S')
+    except ValueError:
+        raise ValueError('Invalid date: {!r}'.format(value))
+    return naive, zone_for(params, value), False
+
+
+def parse_duration(value):
+    """Parse an iCalendar DURATION into a ``timedelta``."""
+    match = DURATION_PATTERN.match(value.strip().upper())
+    if match is None:
+        raise ValueError('Invalid duration: {!r}'.format(value))
+    sign, weeks, days, hours, minutes, seconds = match.groups()
+    duration = timedelta(weeks=int(weeks or 0), days=int(days or 0),
+                         hours=int(hours or 0), minutes=int(minutes or 0),
+                         seconds=int(seconds or 0))
+    return -duration if sign == '-' else duration
+
+
+def localize(naive, zone):
+    """Return the UTC datetime of a naive wall time in ``zone``."""
+    return timezone.make_aware(naive, zone, is_dst=False).astimezone(
+        timezone.utc)
+
+
+def wall_time(params, value, zone):
+    """Parse a date or date-time as a naive wall time in ``zone``."""
+    naive, value_zone, _ = parse_value(params, value)
+    if value_zone is zone:
+        return naive
+    return timezone.make_naive(localize(naive, value_zone), zone)
+
+
+def recurrence(event, start, zone):
+    """Build the ``rruleset`` of an event's occurrences, naive in ``zone``."""
+    rules = rrule.rruleset()
+    rule = UNTIL_PATTERN.sub(
+        lambda match: 'UNTIL=' + wall_time(
+            {}, match.group(1), zone).strftime('%Y%m%dT%H%M%S'),
+        event['RRULE'][1])
+    rules.rrule(rrule.rrulestr(rule, dtstart=start, ignoretz=True))
+    for name, add in (('RDATE', rules.rdate), ('EXDATE', rules.exdate)):
+        for params, values in event.get(name, ()):
+            for value in values.split(','):
+                add(wall_time(params, value, zone))
+    return rules
+
+
+def occurrences(event, since, until):
+    """
+    Yield the ``(start, end)`` of every busy occurrence of an event.
+
+    Only occurrences overlapping ``since`` to ``until`` are yielded.
+    Cancelled and transparent events take no time and yield nothing.
+    """
+    if 'DTSTART' not in event:
+        raise ValueError('Event without DTSTART.')
+    if event.get('STATUS', ({}, ''))[1].upper() == 'CANCELLED':
+        return
+    if event.get('TRANSP', ({}, ''))[1].upper() == 'TRANSPARENT':
+        return
+    start, zone, whole_day = parse_value(*event['DTSTART'])
+    if 'DTEND' in event:
+        end = localize(wall_time(*(event['DTEND'] + (zone,))), zone)
+        duration = end - localize(start, zone)
+    elif 'DURATION' in event:
+        duration = parse_duration(event['DURATION'][1])
+    else:
+        duration = timedelta(days=1 if whole_day else 0)
+    if duration <= timedelta(0):
+        return
+
+    if 'RRULE' not in event:
+        first = localize(start, zone)
+        if first < until and first + duration > since:
+            yield first, first + duration
+        return
+    for naive in recurrence(event, start, zone):
+        first = localize(naive, zone)
+        if first >= until:
+            return
+        if first + duration > since:
+            yield first, first + duration
+
+
+def event_blocks(event, since, until):
+    """Yield unsaved ``BusyBlock`` field dicts for one event."""
+    summary = unescape(event.get('SUMMARY', ({}, ''))[1])
+    uid = event.get('UID', ({}, ''))[1]
+    for start, end in occurrences(event, since, until):
+        yield {'start': start, 'end': end,
+               'summary': summary[:SUMMARY_LENGTH],
+               'uid': uid[:UID_LENGTH]}
+
+
+def read_blocks(stream, since, until):
+    """
+    Yield unsaved ``BusyBlock`` field dicts for a calendar stream.
+
+    Occurrences of a recurring event that another event with the same UID
+    overrides through its RECURRENCE-ID are left out of the expansion, so
+    only the override's own time is busy.
+    """
+    recurring, overridden = [], {}
+    for event in read_events(stream):
+        uid = event.get('UID', ({}, ''))[1]
+        if 'RECURRENCE-ID' in event:
+            overridden.setdefault(uid, []).append(event['RECURRENCE-ID'])
+        elif 'RRULE' in event:
+            recurring.append(event)
+            continue
+        for values in event_blocks(event, since, until):
+            yield values
+    for event in recurring:
+        uid = event.get('UID', ({}, ''))[1]
+        event.setdefault('EXDATE', []).extend(overridden.get(uid, ()))
+        for values in event_blocks(event, since, until):
+            yield values
+
+
+def import_calendar(profile, stream, horizon_days=DEFAULT_HORIZON_DAYS,
+                    batch_size=DEFAULT_BATCH_SIZE, now=None):
+    """
+    Replace ``profile``'s busy blocks with those of an iCalendar stream.
+
+    Busy time from the start of today up to ``horizon_days`` ahead is
+    stored, and ``busy_blocks_replaced`` is sent for the profile.
+    Returns the number of blocks created and raises ValueError if the
+    calendar cannot be read.
+    """
+    now = now or timezone.now()
+    since = localize(datetime.combine(timezone.localtime(now).date(),
+                                      time()),
+                     timezone.get_default_timezone())
+    until = since + timedelta(days=horizon_days)
+    created, batch = 0, []
+    try:
+        with transaction.atomic():
+            BusyBlock.objects.filter(owner=profile).delete()
+            for values in read_blocks(stream, since, until):
+                batch.append(BusyBlock(owner=profile, **values))
+                if len(batch) >= max(batch_size, 1):
+                    BusyBlock.objects.bulk_create(batch)
+                    created += len(batch)
+                    batch = []
+            BusyBlock.objects.bulk_create(batch)
+            created += len(batch)
+            busy_blocks_replaced.send(sender=BusyBlock, profile=profile)
+    except UnicodeDecodeError:
+        raise ValueError('The file is not UTF-8 encoded.')
+    return created
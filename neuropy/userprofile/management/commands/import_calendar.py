@@ -0,0 +1,42 @@
+"""Import a user's busy time from an iCalendar file."""
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from userprofile.ics import (DEFAULT_BATCH_SIZE, DEFAULT_HORIZON_DAYS,
+                             import_calendar)
+
+
+class Command(BaseCommand):
+    """Replace a user's busy blocks with the events of a calendar."""
+
+    help = ("Replace a user's busy blocks with the events of an .ics file, "
+            "expanding recurring events up to a horizon.")
+
+    def add_arguments(self, parser):
+        """Command line options."""
+        parser.add_argument('username', help='User to import busy time for.')
+        parser.add_argument('path', help='iCalendar file to import.')
+        parser.add_argument(
+            '--horizon', type=int, default=DEFAULT_HORIZON_DAYS,
+            help='Days ahead to expand recurring events for.')
+        parser.add_argument(
+            '--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+            help='Busy blocks inserted per batch.')
+
+    def handle(self, *args, **options):
+        """Run the import."""
+        try:
+            profile = User.objects.get(username=options['username']).profile
+        except User.DoesNotExist:
+            raise CommandError('No user named {!r}.'.format(
+                options['username']))
+        try:
+            with open(options['path'], 'rb') as stream:
+                created = import_calendar(profile, stream,
+                                          options['horizon'],
+                                          options['batch_size'])
+        except (IOError, ValueError) as error:
+            raise CommandError(str(error))
+        self.stdout.write(self.style.SUCCESS(
+            'Imported {} busy blocks.'.format(created)))
@@ -0,0 +1,41 @@
+"""Provision many users at once from a CSV file."""
+
+import csv
+import io
+
+from django.core.management.base import BaseCommand, CommandError
+
+from userprofile.provisioning import (ACCOUNT_FIELDS, DEFAULT_BATCH_SIZE,
+                                      provision_users)
+
+
+class Command(BaseCommand):
+    """Bulk create users, profiles and group memberships."""
+
+    help = ('Provision users from a CSV file with a header naming any of: '
+            '{}.'.format(', '.join(ACCOUNT_FIELDS)))
+
+    def add_arguments(self, parser):
+        """Command line options."""
+        parser.add_argument('path', help='CSV file of accounts.')
+        parser.add_argument(
+            '--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+            help='Accounts created per batch.')
+
+    def handle(self, *args, **options):
+        """Read the accounts and provision them."""
+        try:
+            with io.open(options['path'], encoding='utf-8',
+                         newline='') as accounts:
+                reader = csv.DictReader(accounts)
+                if 'username' not in (reader.fieldnames or []):
+                    raise CommandError('The file needs a username column.')
+                result = provision_users(reader,
+                                         max(options['batch_size'], 1))
+        except (IOError, csv.Error) as error:
+            raise CommandError(str(error))
+        for username in result.skipped:
+            self.stderr.write('Skipped existing user {!r}.'.format(username))
+        self.stdout.write(self.style.SUCCESS(
+            'Provisioned {} users, skipped {}.'.format(
+                result.created, len(result.skipped))))
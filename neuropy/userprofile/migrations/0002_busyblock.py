@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.5 on 2026-10-18 20:22
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('userprofile', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BusyBlock',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('start', models.DateTimeField()),
+                ('end', models.DateTimeField()),
+                ('summary', models.CharField(blank=True, max_length=255)),
+                ('uid', models.CharField(blank=True, max_length=255)),
+                ('owner', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='busy_blocks', to='userprofile.Profile')),
+            ],
+        ),
+        migrations.AlterIndexTogether(
+            name='busyblock',
+            index_together=set([('owner', 'start')]),
+        ),
+    ]
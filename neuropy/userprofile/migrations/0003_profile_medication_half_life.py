@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.5 on 2026-10-18 20:31
+from __future__ import unicode_literals
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('userprofile', '0002_busyblock'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='profile',
+            name='medication_half_life',
+            field=models.FloatField(blank=True, help_text='Hours for the level of medication to halve.', null=True, validators=[django.core.validators.MinValueValidator(0.25)]),
+        ),
+    ]
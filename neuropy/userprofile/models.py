@@ -1,9 +1,12 @@
 from django.db import models
+from django.core.validators import MinValueValidator
 from django.contrib.auth.models import User, Group
 from django.utils.encoding import python_2_unicode_compatible
-from django.db.models.signals import post_save
-from django.dispatch import receiver
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import Signal, receiver
 from datetime import time
+from neuropy.cache import bump_user_version
+from userprofile.energy import invalidate_curve
 
 
 @python_2_unicode_compatible
@@ -31,13 +34,84 @@ class Profile(models.Model):
         default='Morning'
     )
     dose_time = models.TimeField(default=time(hour=8))
+    medication_half_life = models.FloatField(
+        blank=True,
+        null=True,
+        validators=[MinValueValidator(0.25)],
+        help_text='Hours for the level of medication to halve.'
+    )
+    feed_key = models.CharField(max_length=32, blank=True, editable=False)
+
+
+@python_2_unicode_compatible
+class BusyBlock(models.Model):
+    """A stretch of time the profile's calendar marks as busy."""
+
+    owner = models.ForeignKey(Profile,
+                              related_name='busy_blocks',
+                              on_delete=models.CASCADE
+                              )
+    start = models.DateTimeField()
+    end = models.DateTimeField()
+    summary = models.CharField(max_length=255, blank=True)
+    uid = models.CharField(max_length=255, blank=True)
+
+    class Meta:
+        """Index for finding a profile's blocks around a time."""
+
+        index_together = [('owner', 'start')]
+
+    def __str__(self):
+        """String representation of BusyBlock."""
+        return '{} to {}'.format(self.start, self.end)
+
+
+# Sent with the profile once its busy blocks have been replaced in bulk,
+# which sends no signals of its own.
+busy_blocks_replaced = Signal(providing_args=['profile'])
+
+
+USER_GROUP_NAME = 'user'
+_group_ids = {}
+
+
+def user_group_id():
+    """Return the id of the default user group, looked up once."""
+    if USER_GROUP_NAME not in _group_ids:
+        _group_ids[USER_GROUP_NAME] = Group.objects.get(
+            name=USER_GROUP_NAME).pk
+    return _group_ids[USER_GROUP_NAME]
+
+
+@receiver([post_save, post_delete], sender=Group)
+def forget_group_ids(sender, **kwargs):
+    """Forget cached group ids whenever a group changes."""
+    _group_ids.clear()
 
 
 @receiver(post_save, sender=User)
 def build_profile(sender, instance, **kwargs):
     """Attaches a profile to a user whenever a user is made."""
     if kwargs["created"]:
-        group = Group.objects.get(name='user')
-        instance.groups.add(group)
+        instance.groups.add(user_group_id())
         new_profile = Profile(user=instance)
         new_profile.save()
+
+
+@receiver(post_save, sender=Profile)
+def refresh_energy_curve(sender, instance, **kwargs):
+    """Drop the cached energy curve when a profile's settings change."""
+    invalidate_curve(instance)
+
+
+@receiver(post_save, sender=Profile)
+def expire_profile_pages(sender, instance, **kwargs):
+    """Expire cached pages of a user whose profile changed."""
+    bump_user_version(instance.user_id)
+
+
+@receiver([post_save, post_delete], sender=User)
+def expire_user_pages(sender, instance, **kwargs):
+    """Expire cached pages of a user who changed or was deleted."""
+    if not kwargs.get("created"):
+        bump_user_version(instance.pk)
@@ -0,0 +1,90 @@
+"""Bulk provisioning of users with their profiles and group membership.
+
+``build_profile`` costs several queries per user. Here users, profiles and
+``user`` group memberships are each written with one ``bulk_create`` per
+batch, which never sends ``post_save`` so the per-user signal is skipped.
+"""
+
+from collections import namedtuple
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import transaction
+
+from userprofile.models import Profile, user_group_id
+
+
+ACCOUNT_FIELDS = ('username', 'email', 'first_name', 'last_name', 'password')
+DEFAULT_BATCH_SIZE = 1000
+
+ProvisionResult = namedtuple('ProvisionResult', 'created skipped')
+
+
+def build_user(account):
+    """
+    Build an unsaved user from an account dict.
+
+    Hashing a password is deliberately slow, so accounts without one get
+    an unusable password and are expected to set theirs by reset.
+    """
+    return User(
+        username=account['username'],
+        email=account.get('email') or '',
+        first_name=account.get('first_name') or '',
+        last_name=account.get('last_name') or '',
+        password=make_password(account.get('password') or None),
+    )
+
+
+def provision_batch(accounts):
+    """Create one batch of accounts, returning the usernames skipped."""
+    wanted = {}
+    skipped = []
+    for account in accounts:
+        if not account.get('username') or account['username'] in wanted:
+            skipped.append(account.get('username') or '')
+        else:
+            wanted[account['username']] = account
+    taken = set(User.objects.filter(
+        username__in=list(wanted)).values_list('username', flat=True))
+    skipped.extend(name for name in wanted if name in taken)
+    users = [build_user(account) for name, account in wanted.items()
+             if name not in taken]
+    if not users:
+        return skipped
+
+    User.objects.bulk_create(users)
+    user_ids = list(User.objects.filter(
+        username__in=[user.username for user in users]
+    ).values_list('id', flat=True))
+    Profile.objects.bulk_create([Profile(user_id=pk) for pk in user_ids])
+    membership = User.groups.through
+    group_id = user_group_id()
+    membership.objects.bulk_create(
+        [membership(user_id=pk, group_id=group_id) for pk in user_ids])
+    return skipped
+
+
+def provision_users(accounts, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Create users, profiles and group memberships from account dicts.
+
+    Each dict needs a ``username`` and may hold the other
+    ``ACCOUNT_FIELDS``. Usernames that already exist are skipped. Returns
+    a ``ProvisionResult``.
+    """
+    created, skipped = 0, []
+    batch = []
+    with transaction.atomic():
+        for account in accounts:
+            batch.append(account)
+            if len(batch) == batch_size:
+                batch_skipped = provision_batch(batch)
+                created += len(batch) - len(batch_skipped)
+                skipped.extend(batch_skipped)
+                batch = []
+        if batch:
+            batch_skipped = provision_batch(batch)
+            created += len(batch) - len(batch_skipped)
+            skipped.extend(batch_skipped)
+    return ProvisionResult(created, skipped)
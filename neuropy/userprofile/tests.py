@@ -1,8 +1,25 @@
 """Tests for the userprofile app."""
 
+import tempfile
+from datetime import datetime, time, timedelta
+from django.conf import settings
+from django.core.management import call_command
+from django.utils.six import StringIO
 from django.test import TestCase, Client, RequestFactory
+from django.utils import timezone
 from django.contrib.auth.models import User, Group, Permission
-from userprofile.models import Profile
+from django.core.cache import cache
+from neuropy import routers
+from neuropy.cache import user_version
+from neuropy.routers import replica_reads
+from todo.models import Todo
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from userprofile.models import BusyBlock, Profile, user_group_id
+from userprofile import energy
+from userprofile.backends import load_user
+from userprofile.ics import import_calendar
+from userprofile.provisioning import provision_users
 import factory
 from django.core.urlresolvers import reverse_lazy
 from bs4 import BeautifulSoup
@@ -66,11 +83,278 @@ class ProfileTestCase(TestCase):
         self.assertTrue(group.name == 'user')
 
 
+class EnergyCurveTestCase(TestCase):
+    """Test the cached energy curve."""
+
+    def setUp(self):
+        """Make a user with a profile."""
+        add_user_group()
+        self.profile = UserFactory.create().profile
+
+    def test_curve_has_a_value_per_slot(self):
+        """Test the curve covers the whole day."""
+        curve = energy.energy_curve(self.profile)
+        self.assertTrue(len(curve) == energy.SLOTS_PER_DAY)
+        self.assertTrue(curve.min() >= 0 and curve.max() <= 1)
+
+    def test_curve_is_cached_under_settings_hash(self):
+        """Test the curve is stored under a key for the profile settings."""
+        curve = energy.energy_curve(self.profile)
+        key = energy.curve_key(self.profile)
+        self.assertTrue(cache.get(key) == energy.pack(curve))
+
+    def test_cached_curve_matches_computed_curve(self):
+        """Test the compact cached curve stays close to the exact curve."""
+        exact = energy.compute_curve(self.profile)
+        cached = energy.energy_curve(self.profile)
+        self.assertTrue(abs(exact - cached).max() <= 1.0 / 255)
+
+    def test_saving_changed_profile_drops_old_curve(self):
+        """Test the post_save receiver invalidates the stale curve."""
+        energy.energy_curve(self.profile)
+        old_key = energy.curve_key(self.profile)
+        self.profile.peak_period = 'night_owl'
+        self.profile.save()
+        self.assertTrue(cache.get(old_key) is None)
+        self.assertFalse(energy.curve_key(self.profile) == old_key)
+
+    def test_saving_unchanged_profile_keeps_curve(self):
+        """Test saving without changing settings keeps the cached curve."""
+        energy.energy_curve(self.profile)
+        self.profile.save()
+        self.assertFalse(cache.get(energy.curve_key(self.profile)) is None)
+
+    def test_half_life_is_part_of_curve_key(self):
+        """Test setting a half-life gives the profile a new curve."""
+        old_key = energy.curve_key(self.profile)
+        self.profile.medication_half_life = 6
+        self.assertFalse(energy.curve_key(self.profile) == old_key)
+
+    def test_medication_tables_are_shared(self):
+        """Test profiles with the same settings reuse one table."""
+        first = energy.medication_table(energy.half_life_minutes(4), 96)
+        second = energy.medication_table(energy.half_life_minutes(4.01), 96)
+        self.assertTrue(first is second)
+        self.assertFalse(first.flags.writeable)
+
+    def test_levels_peak_after_dose_and_decay_by_half_life(self):
+        """Test a short half-life wears off sooner than a long one."""
+        dose = energy.slot_of(time(8))
+        short = energy.medication_table(energy.half_life_minutes(2), dose)
+        long = energy.medication_table(energy.half_life_minutes(12), dose)
+        self.assertTrue(short.argmax() > dose)
+        evening = energy.slot_of(time(20))
+        self.assertTrue(short[evening] < long[evening])
+        self.assertTrue(long.max() == 1)
+
+    def test_long_half_life_carries_over_to_next_day(self):
+        """Test earlier doses leave a level before the next dose."""
+        table = energy.medication_table(energy.half_life_minutes(24), 96)
+        self.assertTrue(table[95] > 0.3)
+
+
+class ProvisioningTestCase(TestCase):
+    """Test bulk user provisioning."""
+
+    def setUp(self):
+        """Add the default group."""
+        add_user_group()
+        self.accounts = [{'username': 'partner_{}'.format(i),
+                          'email': 'partner_{}@cbt.com'.format(i)}
+                         for i in range(25)]
+
+    def test_users_get_profiles_and_group(self):
+        """Test provisioned users look like signed up users."""
+        result = provision_users(self.accounts, batch_size=10)
+        self.assertTrue(result.created == 25)
+        user = User.objects.get(username='partner_3')
+        self.assertTrue(user.email == 'partner_3@cbt.com')
+        self.assertIsInstance(user.profile, Profile)
+        self.assertTrue(user.groups.first().name == 'user')
+        self.assertFalse(user.has_usable_password())
+
+    def test_existing_and_repeated_usernames_are_skipped(self):
+        """Test usernames already taken are reported, not duplicated."""
+        UserFactory.create(username='partner_0')
+        result = provision_users(self.accounts + self.accounts[1:2])
+        self.assertTrue(result.created == 24)
+        self.assertTrue(sorted(result.skipped) == ['partner_0', 'partner_1'])
+        self.assertTrue(Profile.objects.count() == 25)
+
+    def test_batch_query_count_does_not_grow_with_users(self):
+        """Test a batch costs the same queries for 5 or 25 users."""
+        user_group_id()
+        with CaptureQueriesContext(connection) as few:
+            provision_users(self.accounts[:5])
+        with CaptureQueriesContext(connection) as many:
+            provision_users(self.accounts[5:])
+        self.assertTrue(len(few) == len(many))
+
+    def test_signup_does_not_query_group_once_cached(self):
+        """Test build_profile reuses the cached group id."""
+        UserFactory.create()
+        with CaptureQueriesContext(connection) as queries:
+            UserFactory.create()
+        self.assertFalse(any('FROM "auth_group"' in query['sql']
+                             for query in queries))
+
+    def test_provision_command(self):
+        """Test the provision_users management command."""
+        with tempfile.NamedTemporaryFile(suffix='.csv') as accounts:
+            accounts.write(b'username,email\nann,ann@cbt.com\nbob,\n')
+            accounts.flush()
+            out = StringIO()
+            call_command('provision_users', accounts.name, stdout=out)
+        self.assertTrue('Provisioned 2 users' in out.getvalue())
+        self.assertTrue(User.objects.get(username='bob').profile)
+
+
+CALENDAR = '''BEGIN:VCALENDAR\r
+VERSION:2.0\r
+BEGIN:VEVENT\r
+UID:standup\r
+SUMMARY:Stand\\, up\r
+DTSTART;TZID=America/New_York:20170301T090000\r
+DURATION:PT15M\r
+RRULE:FREQ=DAILY;UNTIL=20170314T130000Z\r
+EXDATE;TZID=America/New_York:20170303T090000\r
+BEGIN:VALARM\r
+TRIGGER:-PT5M\r
+END:VALARM\r
+END:VEVENT\r
+BEGIN:VEVENT\r
+UID:lunch\r
+SUMMARY:Lunch with a very long\r
+  title\r
+DTSTART:20170302T200000Z\r
+DTEND:20170302T210000Z\r
+END:VEVENT\r
+BEGIN:VEVENT\r
+UID:free\r
+DTSTART:20170302T200000Z\r
+DTEND:20170302T210000Z\r
+TRANSP:TRANSPARENT\r
+END:VEVENT\r
+BEGIN:VEVENT\r
+UID:old\r
+DTSTART;VALUE=DATE:20160101\r
+END:VEVENT\r
+END:VCALENDAR\r
+'''
+
+
+class CalendarImportTestCase(TestCase):
+    """Test importing busy time from iCalendar files."""
+
+    def setUp(self):
+        """Make a profile and a time to import at."""
+        add_user_group()
+        self.profile = UserFactory.create().profile
+        self.now = timezone.make_aware(datetime(2017, 3, 1, 8, 0))
+
+    def import_calendar(self, text, **kwargs):
+        """Import calendar text for the profile."""
+        with tempfile.TemporaryFile() as stream:
+            stream.write(text.encode('utf-8'))
+            stream.seek(0)
+            return import_calendar(self.profile, stream, now=self.now,
+                                   **kwargs)
+
+    def test_recurring_events_are_expanded(self):
+        """Test a daily event gives a block per day bar excluded ones."""
+        self.import_calendar(CALENDAR, batch_size=3)
+        blocks = BusyBlock.objects.filter(uid='standup').order_by('start')
+        self.assertTrue(blocks.count() == 13)
+        first = blocks[0]
+        self.assertTrue(first.start == datetime(2017, 3, 1, 14, 0,
+                                                tzinfo=timezone.utc))
+        self.assertTrue(first.end - first.start == timedelta(minutes=15))
+        self.assertTrue(first.summary == 'Stand, up')
+        self.assertTrue(not blocks.filter(
+            start=first.start + timedelta(days=2)).exists())
+
+    def test_recurrence_follows_wall_clock_across_dst(self):
+        """Test occurrences keep their local time after a DST change."""
+        self.import_calendar(CALENDAR)
+        last = BusyBlock.objects.filter(uid='standup').latest('start')
+        self.assertTrue(last.start == datetime(2017, 3, 14, 13, 0,
+                                               tzinfo=timezone.utc))
+
+    def test_single_transparent_and_past_events(self):
+        """Test only busy events within the horizon are stored."""
+        created = self.import_calendar(CALENDAR)
+        self.assertTrue(created == 14)
+        lunch = BusyBlock.objects.get(uid='lunch')
+        self.assertTrue(lunch.summary == 'Lunch with a very long title')
+        self.assertTrue(not BusyBlock.objects.filter(uid='free').exists())
+        self.assertTrue(not BusyBlock.objects.filter(uid='old').exists())
+
+    def test_moved_occurrence_replaces_the_original(self):
+        """Test an override with a RECURRENCE-ID frees the original slot."""
+        moved = CALENDAR.replace('BEGIN:VEVENT\r\nUID:lunch', (
+            'BEGIN:VEVENT\r\n'
+            'UID:standup\r\n'
+            'RECURRENCE-ID;TZID=America/New_York:20170302T090000\r\n'
+            'DTSTART;TZID=America/New_York:20170302T150000\r\n'
+            'DURATION:PT15M\r\n'
+            'END:VEVENT\r\n'
+            'BEGIN:VEVENT\r\n'
+            'UID:standup\r\n'
+            'RECURRENCE-ID;TZID=America/New_York:20170306T090000\r\n'
+            'DTSTART;TZID=America/New_York:20170306T090000\r\n'
+            'DURATION:PT15M\r\n'
+            'STATUS:CANCELLED\r\n'
+            'END:VEVENT\r\n'
+            'BEGIN:VEVENT\r\nUID:lunch'))
+        self.import_calendar(moved)
+        starts = set(BusyBlock.objects.filter(uid='standup').values_list(
+            'start', flat=True))
+        self.assertTrue(len(starts) == 12)
+        self.assertTrue(datetime(2017, 3, 2, 20, 0,
+                                 tzinfo=timezone.utc) in starts)
+        self.assertTrue(datetime(2017, 3, 2, 14, 0,
+                                 tzinfo=timezone.utc) not in starts)
+        self.assertTrue(datetime(2017, 3, 6, 14, 0,
+                                 tzinfo=timezone.utc) not in starts)
+
+    def test_horizon_limits_expansion(self):
+        """Test recurring events are not expanded past the horizon."""
+        self.import_calendar(CALENDAR, horizon_days=2)
+        self.assertTrue(BusyBlock.objects.filter(uid='standup').count() == 2)
+
+    def test_reimport_replaces_blocks(self):
+        """Test importing again replaces the previous blocks."""
+        self.import_calendar(CALENDAR)
+        self.import_calendar(CALENDAR)
+        self.assertTrue(BusyBlock.objects.filter(
+            owner=self.profile).count() == 14)
+
+    def test_broken_calendar_imports_nothing(self):
+        """Test a malformed calendar raises and keeps old blocks."""
+        self.import_calendar(CALENDAR)
+        with self.assertRaises(ValueError):
+            self.import_calendar(CALENDAR.replace('DURATION:PT15M',
+                                                  'DURATION:soon'))
+        self.assertTrue(BusyBlock.objects.filter(
+            owner=self.profile).count() == 14)
+
+    def test_import_command(self):
+        """Test the import_calendar command reports the blocks made."""
+        with tempfile.NamedTemporaryFile(suffix='.ics') as calendar:
+            calendar.write(CALENDAR.encode('utf-8'))
+            calendar.flush()
+            out = StringIO()
+            call_command('import_calendar', self.profile.user.username,
+                         calendar.name, stdout=out)
+        self.assertTrue('Imported' in out.getvalue())
+
+
 class FrontendTestCases(TestCase):
     """Test the frontend of the imager_profile site."""
 
     def setUp(self):
         """Set up client and request factory."""
+        cache.clear()
         self.client = Client()
         self.request = RequestFactory()
 
@@ -198,3 +482,142 @@ class FrontendTestCases(TestCase):
             "dose_time": "09:00:00"
         })
         self.assertRedirects(response, '/profile/')
+
+
+class PageCacheTestCase(TestCase):
+    """Test whole page caching."""
+
+    def setUp(self):
+        """Log in a user with an empty cache."""
+        cache.clear()
+        add_user_group()
+        self.user = UserFactory.create(first_name='bob')
+        self.client.force_login(self.user)
+
+    def test_anonymous_home_page_is_cached(self):
+        """Test the home page renders once for anonymous visitors."""
+        self.client.logout()
+        self.client.get('/')
+        response = self.client.get('/')
+        self.assertTemplateNotUsed(response, 'neuropy/home.html')
+        self.assertTrue(b'Home Page' in response.content)
+
+    def test_logged_in_home_page_is_not_cached(self):
+        """Test logged in users always get a rendered home page."""
+        self.client.get('/')
+        response = self.client.get('/')
+        self.assertTemplateUsed(response, 'neuropy/home.html')
+
+    def test_profile_page_is_cached_per_user(self):
+        """Test the profile page is served from cache until data changes."""
+        self.client.get('/profile/')
+        User.objects.filter(pk=self.user.pk).update(first_name='alice')
+        response = self.client.get('/profile/')
+        self.assertTrue(b'Bob' in response.content)
+        self.assertTrue('private' in response['Cache-Control'])
+
+    def test_cached_page_token_matches_the_cookie(self):
+        """Test a form on a cached page posts with the visitor's cookie."""
+        client = Client(enforce_csrf_checks=True)
+        client.force_login(self.user)
+        client.get('/profile/')
+        client.get('/profile/')
+        response = client.get('/profile/')
+        self.assertTemplateNotUsed(response, 'userprofile/profile.html')
+        self.assertTrue('Cookie' in response['Vary'])
+        self.assertTrue(settings.CSRF_COOKIE_NAME in response.cookies)
+        token = BeautifulSoup(response.content, 'html.parser').find(
+            'input', {'name': 'csrfmiddlewaretoken'})['value']
+        reset = client.post(reverse_lazy('plan-feed-reset'),
+                            {'csrfmiddlewaretoken': token})
+        self.assertTrue(reset.status_code == 302)
+
+    def test_cached_page_is_rendered_again_for_a_new_cookie(self):
+        """Test a visitor without the page's CSRF cookie gets a new page."""
+        self.client.get('/profile/')
+        self.client.get('/profile/')
+        del self.client.cookies[settings.CSRF_COOKIE_NAME]
+        response = self.client.get('/profile/')
+        self.assertTemplateUsed(response, 'userprofile/profile.html')
+
+    def test_profile_save_expires_cached_page(self):
+        """Test saving the profile bumps the user's page version."""
+        self.client.get('/profile/')
+        profile = Profile.objects.get(user=self.user)
+        profile.peak_period = 'evening'
+        profile.save()
+        response = self.client.get('/profile/')
+        self.assertTrue(b'Peak Period: evening' in response.content)
+
+    def test_user_save_expires_cached_page(self):
+        """Test saving the user bumps the user's page version."""
+        self.client.get('/profile/')
+        self.user.first_name = 'alice'
+        self.user.save()
+        response = self.client.get('/profile/')
+        self.assertTrue(b'Alice' in response.content)
+
+    def test_todo_save_bumps_owner_version(self):
+        """Test saving a todo bumps its owner's page version."""
+        version = user_version(self.user.pk)
+        Todo.objects.create(owner=self.user.profile, title='Read')
+        self.assertTrue(user_version(self.user.pk) > version)
+
+
+class CachedUserTestCase(TestCase):
+    """Test loading logged in users and profiles from the cache."""
+
+    def setUp(self):
+        """Log in a user with an empty cache."""
+        cache.clear()
+        add_user_group()
+        self.user = UserFactory.create(first_name='bob')
+        self.client.force_login(self.user)
+
+    def test_edit_page_needs_no_queries_once_cached(self):
+        """Test session, user and profile all come from the cache."""
+        self.client.get('/profile/edit/')
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/profile/edit/')
+        self.assertTrue(response.status_code == 200)
+        self.assertTrue(len(queries) == 0)
+
+    def test_user_and_profile_load_in_one_query(self):
+        """Test a cold cache costs a single query for user and profile."""
+        self.client.get('/profile/edit/')
+        user_version_key = 'page-version:{}'.format(self.user.pk)
+        cache.delete(user_version_key)
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get('/profile/edit/')
+        self.assertTrue(len(queries) == 1)
+
+    def test_profile_save_refreshes_cached_user(self):
+        """Test a saved profile is seen by the next request."""
+        self.client.get('/profile/edit/')
+        profile = Profile.objects.get(user=self.user)
+        profile.peak_period = 'evening'
+        profile.save()
+        response = self.client.get('/profile/edit/')
+        self.assertTrue(
+            response.context['user'].profile.peak_period == 'evening')
+
+    def test_inactive_user_is_logged_out(self):
+        """Test deactivating a user ends the cached login."""
+        self.client.get('/profile/edit/')
+        self.user.is_active = False
+        self.user.save()
+        response = self.client.get('/profile/edit/')
+        self.assertTrue(response.status_code == 302)
+
+    def test_loading_a_user_leaves_replica_reads_on(self):
+        """Test a cache miss does not stick the request to the primary."""
+        with replica_reads():
+            self.assertTrue(load_user(self.user.pk) == self.user)
+            self.assertFalse(routers._state.sticky)
+
+    def test_deleted_user_is_logged_out(self):
+        """Test deleting a user ends the cached login."""
+        self.client.get('/profile/edit/')
+        User.objects.filter(pk=self.user.pk).get().delete()
+        response = self.client.get('/profile/edit/')
+        self.assertTrue(response.status_code == 302)
@@ -2,8 +2,10 @@
 from django.conf.urls import url
 from .views import ProfileView, EditProfile
 from django.contrib.auth.decorators import login_required
+from neuropy.cache import cache_user_page
 
 urlpatterns = [
     url(r'^edit/$', login_required(EditProfile.as_view()), name='edit-profile'),
-    url(r'^$', login_required(ProfileView.as_view()), name='profile')
+    url(r'^$', login_required(cache_user_page(ProfileView.as_view())),
+        name='profile')
 ]
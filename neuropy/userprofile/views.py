@@ -4,11 +4,13 @@ from userprofile.models import Profile
 from django.urls import reverse_lazy
 from userprofile.forms import ProfileForm
 from django.http import HttpResponseRedirect
+from todo.feed import feed_url
 
 
 class ProfileView(detail.DetailView):
     """View for profle."""
 
+    use_replica = True
     model = Profile
     template_name = 'userprofile/profile.html'
     slug_field = 'id'
@@ -17,6 +19,13 @@ class ProfileView(detail.DetailView):
         """Return logged in user."""
         return self.request.user
 
+    def get_context_data(self, **kwargs):
+        """Add the address of the user's plan feed."""
+        context = super(ProfileView, self).get_context_data(**kwargs)
+        context['feed_url'] = self.request.build_absolute_uri(
+            feed_url(self.request.user.profile))
+        return context
+
 
 class EditProfile(UpdateView):
     """Add Album."""